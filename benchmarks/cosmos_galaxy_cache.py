@@ -0,0 +1,79 @@
+"""Benchmark of the caches of COSMOS galaxies and PSF-convolved profiles in `CosmosGenerator`.
+
+Uses the example COSMOS catalog bundled in `data/cosmos`. Run from the root of the repository
+with::
+
+    python benchmarks/cosmos_galaxy_cache.py --n-batches 5 --cache-size 500
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import btk
+
+DATA_DIR = Path(__file__).parent.joinpath("../data").resolve()
+
+
+def time_generator(
+    n_batches: int, batch_size: int, galaxy_cache_size: float, profile_cache_size: float
+):
+    """Time generating batches of real COSMOS galaxies with the given cache sizes (in MB)."""
+    catalog_files = [
+        (DATA_DIR / "cosmos" / "real_galaxy_catalog_23.5_example.fits").as_posix(),
+        (DATA_DIR / "cosmos" / "real_galaxy_catalog_23.5_example_fits.fits").as_posix(),
+    ]
+    catalog = btk.catalog.CosmosCatalog.from_file(catalog_files)
+    sampling_function = btk.sampling_functions.DefaultSampling(
+        max_number=5, min_number=2, stamp_size=24.0, max_shift=5.0, max_mag=30, mag_name="MAG"
+    )
+    survey = btk.survey.get_surveys("LSST")
+    generator = btk.draw_blends.CosmosGenerator(
+        catalog,
+        sampling_function,
+        survey,
+        batch_size=batch_size,
+        add_noise="none",
+        gal_type="real",
+        galaxy_cache_size=galaxy_cache_size,
+        profile_cache_size=profile_cache_size,
+    )
+
+    times = []
+    for _ in range(n_batches):
+        start = time.perf_counter()
+        next(generator)
+        times.append(time.perf_counter() - start)
+    return np.median(times), generator.galaxy_cache, generator.profile_cache
+
+
+def main():
+    """Prints the timings with and without caches."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-batches", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--cache-size", type=float, default=500, help="Cache size in MB.")
+    args = parser.parse_args()
+
+    configs = {
+        "no cache:          ": (0, 0),
+        "galaxy cache:      ": (args.cache_size, 0),
+        "galaxy + profiles: ": (args.cache_size, args.cache_size),
+    }
+    print(f"Median time per batch of {args.batch_size} blends:")
+    for name, sizes in configs.items():
+        t, galaxy_cache, profile_cache = time_generator(args.n_batches, args.batch_size, *sizes)
+        print(f"    {name} {t * 1e3:.1f} ms")
+        for cache_name, cache in (("galaxies", galaxy_cache), ("profiles", profile_cache)):
+            if cache is not None:
+                stats = cache.stats
+                print(
+                    f"        {cache_name}: hit rate {stats['hit_rate']:.2f}, "
+                    f"{stats['n_items']} items, {stats['size'] / 1e6:.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark of the "threads" and "processes" backends of `DrawBlendsGenerator`.
+
+Reports the throughput (blends per second, excluding the first batch) and the peak PSS
+(proportional set size, summed over the main process and its workers) of the CATSIM and COSMOS
+generators with both backends, for several numbers of jobs and of CPU cores. Each configuration
+runs in its own process, restricted to the first `n_cores` cores with `os.sched_setaffinity`,
+so the memory of one run does not affect the others. Only works on Linux, as PSS is read from
+`/proc`. Run from the root of the repository with::
+
+    python benchmarks/thread_backend.py --njobs 4 8 16 32 --cores 8 16 32 --n-batches 5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import btk
+
+DATA_DIR = Path(__file__).parent.joinpath("../data").resolve()
+CATALOGS = ("catsim", "cosmos")
+
+
+def get_generator(catalog_name: str, backend: str, njobs: int, batch_size: int):
+    """Returns the generator of the given catalog with the given backend."""
+    survey = btk.survey.get_surveys("LSST")
+    kwargs = {"batch_size": batch_size, "njobs": njobs, "backend": backend}
+    if catalog_name == "catsim":
+        catalog = btk.catalog.CatsimCatalog.from_file(DATA_DIR / "input_catalog.fits")
+        for band in "ugrizy":
+            for component in ("disk", "bulge", "agn"):
+                column = f"fluxnorm_{component}"
+                catalog.table[f"{column}_{band}"] = catalog.table[column]
+        sampling_function = btk.sampling_functions.DefaultSampling(max_number=5, stamp_size=24.0)
+        return btk.draw_blends.CatsimGenerator(catalog, sampling_function, survey, **kwargs)
+    catalog_files = [
+        (DATA_DIR / "cosmos" / "real_galaxy_catalog_23.5_example.fits").as_posix(),
+        (DATA_DIR / "cosmos" / "real_galaxy_catalog_23.5_example_fits.fits").as_posix(),
+    ]
+    catalog = btk.catalog.CosmosCatalog.from_file(catalog_files)
+    sampling_function = btk.sampling_functions.DefaultSampling(
+        max_number=5, min_number=2, stamp_size=24.0, max_shift=5.0, max_mag=30, mag_name="MAG"
+    )
+    return btk.draw_blends.CosmosGenerator(
+        catalog, sampling_function, survey, gal_type="real", **kwargs
+    )
+
+
+def run(catalog_name: str, backend: str, njobs: int, batch_size: int, n_batches: int):
+    """Prints the throughput of a single configuration (run in a separate process).
+
+    The CPU affinity of the process must be set beforehand, as it is inherited by the workers.
+    """
+    with get_generator(catalog_name, backend, njobs, batch_size) as generator:
+        next(generator)  # the first batch includes starting the workers.
+        start = time.perf_counter()
+        for _ in range(n_batches):
+            next(generator)
+        elapsed = time.perf_counter() - start
+    print(n_batches * batch_size / elapsed)
+
+
+def _get_children(pid: int) -> list:
+    """Returns the PIDs of the direct children of a process."""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the name of the command is in parentheses and can contain spaces.
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _get_pss(pid: int) -> int:
+    """Returns the PSS of a single process, in bytes (0 if it already exited)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def get_pss(pid: int) -> int:
+    """Returns the PSS of a process and all its descendants, in bytes."""
+    return _get_pss(pid) + sum(get_pss(child) for child in _get_children(pid))
+
+
+def measure(catalog_name: str, backend: str, njobs: int, n_cores: int, args) -> tuple:
+    """Runs a configuration on `n_cores` cores and returns its throughput and peak PSS."""
+    cores = ",".join(str(core) for core in sorted(os.sched_getaffinity(0))[:n_cores])
+    command = [
+        sys.executable,
+        __file__,
+        "--run",
+        catalog_name,
+        backend,
+        str(njobs),
+        str(args.batch_size),
+        str(args.n_batches),
+        cores,
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    peak_pss = 0
+    while process.poll() is None:
+        peak_pss = max(peak_pss, get_pss(process.pid))
+        time.sleep(0.05)
+    if process.returncode != 0:
+        raise RuntimeError(f"Benchmark of {catalog_name} with {backend} failed.")
+    return float(process.stdout.read().split()[-1]), peak_pss
+
+
+def main():
+    """Prints the throughput and peak memory of both backends."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--njobs", type=int, nargs="+", default=[4])
+    parser.add_argument("--cores", type=int, nargs="+", default=[len(os.sched_getaffinity(0))])
+    parser.add_argument("--catalogs", nargs="+", choices=CATALOGS, default=list(CATALOGS))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--n-batches", type=int, default=5)
+    parser.add_argument("--run", nargs=6, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        catalog_name, backend, njobs, batch_size, n_batches, cores = args.run
+        os.sched_setaffinity(0, [int(core) for core in cores.split(",")])
+        run(catalog_name, backend, int(njobs), int(batch_size), int(n_batches))
+        return
+
+    n_available = len(os.sched_getaffinity(0))
+    print(f"Batches of {args.batch_size} blends, {n_available} cores available.")
+    print("catalog  cores  njobs  backend     blends/s  peak PSS (MB)")
+    for n_cores in args.cores:
+        if n_cores > n_available:
+            print(f"Skipping {n_cores} cores, only {n_available} are available.")
+            continue
+        for catalog_name in args.catalogs:
+            for njobs in args.njobs:
+                for backend in btk.multiprocess.BACKENDS:
+                    throughput, pss = measure(catalog_name, backend, njobs, n_cores, args)
+                    print(
+                        f"{catalog_name:<8} {n_cores:>5}  {njobs:>5}  {backend:<10} "
+                        f"{throughput:>9.2f}  {pss / 1e6:>13.0f}"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark of the per-batch overhead of multiprocessing in `DrawBlendsGenerator`.
+
+Compares creating a new pool of processes for every batch (`multiprocess` without a pool)
+with reusing a long-lived `WorkerPool`. Run from the root of the repository with::
+
+    python benchmarks/worker_pool.py --njobs 4 --n-batches 10
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+import btk
+from btk.multiprocess import WorkerPool, multiprocess
+
+DATA_DIR = Path(__file__).parent.joinpath("../data").resolve()
+
+
+def _noop(ii):
+    return ii
+
+
+def time_overhead(njobs: int, n_batches: int):
+    """Time running a trivial function, which only measures the cost of the pool itself."""
+    args = [(ii,) for ii in range(njobs)]
+
+    start = time.perf_counter()
+    for _ in range(n_batches):
+        multiprocess(_noop, args, njobs=njobs)
+    new_pool = (time.perf_counter() - start) / n_batches
+
+    with WorkerPool(njobs) as pool:
+        start = time.perf_counter()
+        for _ in range(n_batches):
+            multiprocess(_noop, args, pool=pool)
+        persistent_pool = (time.perf_counter() - start) / n_batches
+
+    return new_pool, persistent_pool
+
+
+def time_generator(njobs: int, n_batches: int, use_pool: bool):
+    """Time generating small batches with the CATSIM generator."""
+    catalog = btk.catalog.CatsimCatalog.from_file(DATA_DIR / "input_catalog.fits")
+    for band in "ugrizy":
+        for component in ("disk", "bulge", "agn"):
+            catalog.table[f"fluxnorm_{component}_{band}"] = catalog.table[f"fluxnorm_{component}"]
+    sampling_function = btk.sampling_functions.DefaultSampling(max_number=2, stamp_size=24.0)
+    survey = btk.survey.get_surveys("LSST")
+    generator = btk.draw_blends.CatsimGenerator(
+        catalog, sampling_function, survey, batch_size=njobs, njobs=njobs
+    )
+    if not use_pool:
+        generator.pool = None  # fall back to a new `mp.Pool` per batch and survey
+
+    times = []
+    with generator:
+        for _ in range(n_batches):
+            start = time.perf_counter()
+            next(generator)
+            times.append(time.perf_counter() - start)
+    # first batch includes starting the persistent pool.
+    return np.median(times)
+
+
+def main():
+    """Prints the timings for both approaches."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--njobs", type=int, default=4)
+    parser.add_argument("--n-batches", type=int, default=10)
+    args = parser.parse_args()
+
+    new_pool, persistent_pool = time_overhead(args.njobs, args.n_batches)
+    print(f"Pool overhead per call (njobs={args.njobs}):")
+    print(f"    new pool per call: {new_pool * 1e3:.1f} ms")
+    print(f"    persistent pool:   {persistent_pool * 1e3:.1f} ms")
+
+    print(f"Median time per batch of {args.njobs} blends:")
+    for use_pool in (False, True):
+        name = "persistent pool:  " if use_pool else "new pool per batch:"
+        t = time_generator(args.njobs, args.n_batches, use_pool)
+        print(f"    {name} {t * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
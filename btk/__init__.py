@@ -11,8 +11,8 @@ __author__ = "btk developers"
 __email__ = "imendoza@umich.edu"
 __version__ = metadata.version("blending_toolkit")
 
-from . import catalog, sampling_functions, survey, multiprocess, match, measure, utils
-from . import blend_generator, blend_batch
+from . import cache, catalog, sampling_functions, survey, multiprocess, match, measure, utils
+from . import blend_generator, blend_batch, dataset
 from . import draw_blends
 from . import deblend
 from . import metrics
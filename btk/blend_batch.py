@@ -2,29 +2,510 @@
 
 import os
 from dataclasses import dataclass
-from typing import List, Optional, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
 import galsim
 import h5py
 import numpy as np
-from astropy.io.misc.hdf5 import read_table_hdf5, write_table_hdf5
-from astropy.table import Table
+from astropy.io.misc import yaml
+from astropy.io.misc.hdf5 import read_table_hdf5
+from astropy.table import MaskedColumn, Table
 
+from btk.cache import get_process_cache
 from btk.survey import Survey, get_surveys, make_wcs
 
+# memory budget (in bytes) of the cache of drawn PSF images, see `draw_psf_image`.
+PSF_CACHE_SIZE = 64e6
+
+
+class SparseIsolatedImages:
+    """Sparse representation of the isolated images of a batch of blends.
+
+    Instead of a dense array of shape `(batch_size, max_n_sources, n_bands, H, W)`, only a cutout
+    around each source is stored: the smallest box containing all of its non-zero pixels (in any
+    band), along with the position of the box in the stamp. Empty source slots are not stored.
+    All cutouts are concatenated in a single flat array `data`, with `offsets` giving the start of
+    each cutout, `bboxes` its `(y0, x0, height, width)` in the stamp, and `sources` its index
+    among the sources of its blend. Cutouts are sorted by blend and the ones of blend `ii` are
+    `blend_offsets[ii]` to `blend_offsets[ii + 1]`. The representation is lossless, and saves the
+    most memory when galaxies are drawn in sub-stamps (see `DrawBlendsGenerator`).
+
+    The object can be used as a read-only array which is densified lazily on access: indexing
+    returns dense numpy arrays computed only for the blends and sources selected (e.g.
+    `isolated_images[ii]`), and `np.asarray` returns the full dense array. As an exception,
+    selecting a single band for all blends and sources (`isolated_images[:, :, band]`) returns
+    another sparse object, of shape `(batch_size, max_n_sources, H, W)`.
+    """
+
+    def __init__(
+        self,
+        shape: Sequence[int],
+        data: np.ndarray,
+        offsets: np.ndarray,
+        bboxes: np.ndarray,
+        sources: np.ndarray,
+        blend_offsets: np.ndarray,
+    ):
+        """Initializes the sparse images from their components (see class docstring).
+
+        Args:
+            shape: Shape of the dense array.
+            data: Flat array with all the cutouts concatenated.
+            offsets: Array of size `n_cutouts + 1` with the start of each cutout in `data`.
+            bboxes: Array of shape `(n_cutouts, 4)` with the `(y0, x0, height, width)` of each
+                cutout in the stamp.
+            sources: Array of size `n_cutouts` with the index of the source of each cutout.
+            blend_offsets: Array of size `batch_size + 1` with the index of the first cutout
+                of each blend.
+        """
+        self.shape = tuple(int(s) for s in shape)
+        self.data = data
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.bboxes = np.asarray(bboxes, dtype=np.int64).reshape(-1, 4)
+        self.sources = np.asarray(sources, dtype=np.int64)
+        self.blend_offsets = np.asarray(blend_offsets, dtype=np.int64)
+        assert len(self.shape) >= 4
+        assert len(self.blend_offsets) == self.shape[0] + 1
+        assert len(self.offsets) == len(self.bboxes) + 1 == len(self.sources) + 1
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Type of the images."""
+        return self.data.dtype
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions of the dense array."""
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the sparse representation (in bytes)."""
+        arrays = (self.data, self.offsets, self.bboxes, self.sources, self.blend_offsets)
+        return sum(array.nbytes for array in arrays)
+
+    def __len__(self) -> int:
+        """Returns the number of blends."""
+        return self.shape[0]
+
+    @classmethod
+    def from_dense(cls, images: np.ndarray) -> "SparseIsolatedImages":
+        """Creates the sparse representation of a dense array of isolated images.
+
+        Args:
+            images: Array of shape `(batch_size, max_n_sources, ..., H, W)`.
+
+        Returns:
+            `SparseIsolatedImages` object.
+        """
+        data, offsets, bboxes, sources, blend_offsets = [], [0], [], [], [0]
+        for ii in range(images.shape[0]):
+            for jj in range(images.shape[1]):
+                image = images[ii, jj]
+                mask = (image != 0).reshape(-1, *image.shape[-2:]).any(axis=0)
+                rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+                if len(rows) == 0:
+                    continue
+                y0, x0 = rows[0], cols[0]
+                height, width = rows[-1] + 1 - y0, cols[-1] + 1 - x0
+                cutout = image[..., y0 : y0 + height, x0 : x0 + width]
+                data.append(cutout.ravel())
+                offsets.append(offsets[-1] + cutout.size)
+                bboxes.append((y0, x0, height, width))
+                sources.append(jj)
+            blend_offsets.append(len(sources))
+        data = np.concatenate(data) if data else np.zeros(0, dtype=images.dtype)
+        return cls(images.shape, data, offsets, bboxes, sources, blend_offsets)
+
+    @classmethod
+    def concatenate(cls, images_list: List["SparseIsolatedImages"]) -> "SparseIsolatedImages":
+        """Concatenates sparse isolated images along the batch axis."""
+        image_shape = images_list[0].shape[1:]
+        assert all(images.shape[1:] == image_shape for images in images_list)
+        data_sizes = np.cumsum([0] + [len(images.data) for images in images_list])
+        n_cutouts = np.cumsum([0] + [len(images.sources) for images in images_list])
+        offsets = [images_list[0].offsets[:1]]
+        blend_offsets = [images_list[0].blend_offsets[:1]]
+        for ii, images in enumerate(images_list):
+            offsets.append(images.offsets[1:] + data_sizes[ii])
+            blend_offsets.append(images.blend_offsets[1:] + n_cutouts[ii])
+        return cls(
+            (sum(images.shape[0] for images in images_list), *image_shape),
+            np.concatenate([images.data for images in images_list]),
+            np.concatenate(offsets),
+            np.concatenate([images.bboxes for images in images_list]),
+            np.concatenate([images.sources for images in images_list]),
+            np.concatenate(blend_offsets),
+        )
+
+    def get_cutout(self, kk: int) -> Tuple[np.ndarray, Tuple[int, int, int, int]]:
+        """Returns the `kk`-th cutout and its bounding box `(y0, x0, height, width)`."""
+        y0, x0, height, width = (int(v) for v in self.bboxes[kk])
+        cutout = self.data[self.offsets[kk] : self.offsets[kk + 1]]
+        return cutout.reshape(*self.shape[2:-2], height, width), (y0, x0, height, width)
+
+    def _densify(self, blends: np.ndarray, sources: np.ndarray) -> np.ndarray:
+        """Returns the dense images of the given blends and sources."""
+        out = np.zeros((len(blends), len(sources), *self.shape[2:]), dtype=self.dtype)
+        for ii, blend in enumerate(blends):
+            for kk in range(self.blend_offsets[blend], self.blend_offsets[blend + 1]):
+                positions = np.flatnonzero(sources == self.sources[kk])
+                if len(positions) > 0:
+                    cutout, (y0, x0, height, width) = self.get_cutout(kk)
+                    out[ii, positions, ..., y0 : y0 + height, x0 : x0 + width] = cutout
+        return out
+
+    def to_dense(self) -> np.ndarray:
+        """Returns the dense array of isolated images."""
+        return self._densify(np.arange(self.shape[0]), np.arange(self.shape[1]))
+
+    def __array__(self, dtype=None, copy=None):
+        """Returns the dense array, which allows using `np.asarray` on the sparse images."""
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+    def _select_band(self, band: int) -> "SparseIsolatedImages":
+        """Returns the sparse isolated images in a single band."""
+        n_bands = self.shape[2]
+        band = range(n_bands)[band]
+        sizes = self.bboxes[:, 2] * self.bboxes[:, 3]
+        starts = self.offsets[:-1] + band * sizes
+        data = [self.data[start : start + size] for start, size in zip(starts, sizes)]
+        data = np.concatenate(data) if data else np.zeros(0, dtype=self.dtype)
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        shape = (*self.shape[:2], *self.shape[3:])
+        return SparseIsolatedImages(
+            shape, data, offsets, self.bboxes, self.sources, self.blend_offsets
+        )
+
+    def __getitem__(self, item):
+        """Returns the selected images as a dense array (see class docstring)."""
+        item = item if isinstance(item, tuple) else (item,)
+        if any(i is Ellipsis or i is None for i in item) or len(item) > self.ndim:
+            return np.asarray(self)[item]
+        full = slice(None)
+        if (
+            self.ndim == 5
+            and len(item) == 3
+            and item[:2] == (full, full)
+            and isinstance(item[2], (int, np.integer))
+        ):
+            return self._select_band(item[2])
+        item = item + (full,) * (self.ndim - len(item))
+        blends = np.arange(self.shape[0])[item[0]]
+        sources = np.arange(self.shape[1])[item[1]]
+        dense = self._densify(np.atleast_1d(blends), np.atleast_1d(sources))
+        first = tuple(0 if np.ndim(index) == 0 else full for index in (blends, sources))
+        return dense[first + item[2:]]
+
+    def sum(self, axis=None):
+        """Sums the images over `axis`, without densifying them when summing over sources."""
+        if axis != 1:
+            return np.asarray(self).sum(axis=axis)
+        out = np.zeros((self.shape[0], *self.shape[2:]), dtype=self.dtype)
+        for ii in range(self.shape[0]):
+            for kk in range(self.blend_offsets[ii], self.blend_offsets[ii + 1]):
+                cutout, (y0, x0, height, width) = self.get_cutout(kk)
+                out[ii, ..., y0 : y0 + height, x0 : x0 + width] += cutout
+        return out
+
+    def save(self, group: h5py.Group):
+        """Saves the sparse images in an (empty) hdf5 group."""
+        for name in ("data", "offsets", "bboxes", "sources", "blend_offsets"):
+            group.create_dataset(name, data=getattr(self, name))
+        group.attrs["shape"] = self.shape
+
+    @classmethod
+    def load(cls, group: h5py.Group) -> "SparseIsolatedImages":
+        """Loads sparse images saved with `save` from an hdf5 group."""
+        names = ("data", "offsets", "bboxes", "sources", "blend_offsets")
+        return cls(group.attrs["shape"], *(group[name][:] for name in names))
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return (
+            f"SparseIsolatedImages(shape={list(self.shape)}, n_cutouts={len(self.sources)}, "
+            f"nbytes={self.nbytes})"
+        )
+
+
+class CatalogList(Sequence):
+    """Catalogs of a batch of blends, stored as a single table which is split lazily.
+
+    The rows of blend `ii` are `offsets[ii]` to `offsets[ii + 1]` of `table`. The catalog of
+    each blend is only created when first accessed, and then kept, so that modifications
+    (e.g. adding columns) persist as they would with a list of tables. It is returned when
+    loading catalogs saved in the columnar layout of `append_catalog_columns`, which avoids
+    creating thousands of tables when only a few of them are needed.
+    """
+
+    def __init__(self, table: Table, offsets: np.ndarray, meta: Optional[List[dict]] = None):
+        """Initializes the list from the concatenated table and the offsets of each blend.
+
+        Args:
+            table: Table with the catalogs of all blends concatenated.
+            offsets: Array of size `n_blends + 1` with the first row of each blend in `table`.
+            meta: Optional list with the `meta` of the catalog of each blend (None for an empty
+                one). (Default: None)
+        """
+        self.table = table
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._catalogs = [None] * (len(self.offsets) - 1)
+        self._meta = meta
+
+    @property
+    def colnames(self) -> List[str]:
+        """Names of the columns of the catalogs."""
+        return self.table.colnames
+
+    def __len__(self) -> int:
+        """Returns the number of blends."""
+        return len(self._catalogs)
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[Table, List[Table]]:
+        """Returns the catalog of a blend, or a list of catalogs if `item` is a slice."""
+        if isinstance(item, slice):
+            return [self[ii] for ii in range(len(self))[item]]
+        ii = range(len(self))[item]
+        if self._catalogs[ii] is None:
+            catalog = self.table[self.offsets[ii] : self.offsets[ii + 1]]
+            if self._meta is not None and self._meta[ii] is not None:
+                catalog.meta = self._meta[ii]
+            self._catalogs[ii] = catalog
+        return self._catalogs[ii]
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return f"CatalogList(n_blends={len(self)}, n_rows={len(self.table)})"
+
+
+def _get_catalog_column(
+    catalog: Table, name: str, reference: np.ndarray
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Returns the values and mask (None if not masked) of a column of a blend catalog.
+
+    Columns missing from the catalog are filled with empty values of the same type as the array
+    `reference`, and fully masked.
+    """
+    if name not in catalog.colnames:
+        data = np.zeros((len(catalog), *reference.shape[1:]), dtype=reference.dtype)
+        return data, np.ones(data.shape, dtype=bool)
+    column = catalog[name]
+    mask = np.ma.getmaskarray(column) if hasattr(column, "mask") else None
+    return np.asarray(column), mask
+
+
+def _get_dataset_reference(dataset: h5py.Dataset) -> np.ndarray:
+    """Returns an empty array with the type of the column saved in a dataset."""
+    if dataset.attrs["unicode"]:
+        return np.zeros((0, *dataset.shape[1:]), dtype="U1")
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        return np.zeros((0, *dataset.shape[1:]), dtype="S1")
+    return np.zeros((0, *dataset.shape[1:]), dtype=dataset.dtype)
+
+
+def append_catalog_columns(group: h5py.Group, catalog_list: List[Table], **dataset_kwargs):
+    """Appends the catalogs of a list of blends to an hdf5 group in a columnar layout.
+
+    All catalogs are concatenated in one table, each column of which is saved as a resizable
+    dataset of the group, and the dataset `offsets` contains the first row of each blend (the
+    rows of blend `ii` are `offsets[ii]` to `offsets[ii + 1]`). Unicode columns are saved as
+    bytes, and the units of the columns are saved as attributes.
+
+    The columns are the union of the columns of all catalogs (including the ones saved before),
+    and values of columns missing from a catalog are masked. Masks of masked columns are saved
+    in the subgroup `masks`, and the `meta` of each catalog in the dataset `meta` (as YAML).
+
+    Args:
+        group: Hdf5 group in which to save the catalogs.
+        catalog_list: List of catalogs, one per blend.
+        dataset_kwargs: Additional arguments to `h5py.Group.create_dataset` for the columns
+            (e.g. compression).
+    """
+    if "offsets" not in group:
+        group.create_dataset("offsets", data=np.zeros(1, dtype=np.int64), maxshape=(None,))
+        group.attrs["columns"] = []
+    offsets = group["offsets"]
+    if "meta" not in group:
+        shape = (len(offsets) - 1,)
+        group.create_dataset("meta", shape=shape, dtype=h5py.string_dtype(), maxshape=(None,))
+    group.require_group("masks")
+    n_saved = int(offsets[-1])
+    columns = list(group.attrs["columns"])
+    for catalog in catalog_list:
+        columns.extend(name for name in catalog.colnames if name not in columns)
+    group.attrs["columns"] = columns
+
+    for name in columns:
+        if name in group:
+            reference = _get_dataset_reference(group[name])
+        else:
+            # the type of the column is taken from the first non-empty catalog with it.
+            with_column = [catalog for catalog in catalog_list if name in catalog.colnames]
+            non_empty = [catalog for catalog in with_column if len(catalog) > 0]
+            reference = np.asarray((non_empty or with_column)[0][name])
+        values, masks = zip(
+            *[_get_catalog_column(catalog, name, reference) for catalog in catalog_list]
+        )
+        column = np.concatenate(values)
+        if column.dtype.kind == "U":
+            column = np.char.encode(column, "utf-8")
+        if name not in group:
+            dataset = group.create_dataset(
+                name,
+                shape=(n_saved, *column.shape[1:]),
+                dtype=column.dtype if column.dtype.kind != "S" else h5py.string_dtype(),
+                maxshape=(None, *column.shape[1:]),
+                **dataset_kwargs,
+            )
+            unit = with_column[0][name].unit
+            dataset.attrs["unit"] = "" if unit is None else str(unit)
+            dataset.attrs["unicode"] = reference.dtype.kind == "U"
+            if n_saved > 0:
+                # rows of the catalogs saved before, which did not have the column.
+                group["masks"].create_dataset(
+                    name, data=np.ones(dataset.shape, dtype=bool), maxshape=dataset.maxshape
+                )
+        append_to_dataset(group[name], column)
+
+        if any(mask is not None for mask in masks) and name not in group["masks"]:
+            group["masks"].create_dataset(
+                name,
+                data=np.zeros((n_saved, *column.shape[1:]), dtype=bool),
+                maxshape=(None, *column.shape[1:]),
+            )
+        if name in group["masks"]:
+            mask = [
+                np.zeros(v.shape, dtype=bool) if m is None else m for v, m in zip(values, masks)
+            ]
+            append_to_dataset(group["masks"][name], np.concatenate(mask))
+
+    meta = [yaml.dump(dict(catalog.meta)) if catalog.meta else "" for catalog in catalog_list]
+    append_to_dataset(group["meta"], np.array(meta, dtype=object))
+    n_rows = np.cumsum([len(catalog) for catalog in catalog_list], dtype=np.int64)
+    append_to_dataset(offsets, n_saved + n_rows)
+
+
+def truncate_catalog_columns(group: h5py.Group, n_blends: int):
+    """Discards the catalogs saved with `append_catalog_columns` beyond the first `n_blends`."""
+    offsets = group["offsets"]
+    offsets.resize(min(len(offsets), n_blends + 1), axis=0)
+    n_rows = offsets[-1]
+    for name in group.attrs["columns"]:
+        if name in group:
+            group[name].resize(n_rows, axis=0)
+        if name in group.get("masks", {}):
+            group["masks"][name].resize(n_rows, axis=0)
+    if "meta" in group:
+        group["meta"].resize(len(offsets) - 1, axis=0)
+
+
+def read_catalog_columns(
+    group: h5py.Group, start: int = 0, stop: Optional[int] = None
+) -> CatalogList:
+    """Reads the catalogs of blends `start` to `stop` saved with `append_catalog_columns`.
+
+    Args:
+        group: Hdf5 group in which the catalogs were saved.
+        start: Index of the first blend to read.
+        stop: Index after the last blend to read (default: read until the last blend).
+
+    Returns:
+        `CatalogList` with the catalogs, one per blend.
+    """
+    n_blends = len(group["offsets"]) - 1
+    start, stop, _ = slice(start, stop).indices(n_blends)
+    stop = max(start, stop)
+    offsets = group["offsets"][start : stop + 1]
+    table = Table()
+    for name in group.attrs["columns"]:
+        dataset = group[name]
+        column = dataset[offsets[0] : offsets[-1]]
+        if dataset.attrs["unicode"]:
+            column = np.char.decode(column.astype(bytes), "utf-8")
+        elif column.dtype.kind == "O":
+            column = column.astype(bytes)
+        if name in group.get("masks", {}):
+            mask = group["masks"][name][offsets[0] : offsets[-1]]
+            table[name] = MaskedColumn(column, mask=mask)
+        else:
+            table[name] = column
+        table[name].unit = dataset.attrs["unit"] or None
+    meta = None
+    if "meta" in group:
+        meta = [yaml.load(m.decode()) if m else None for m in group["meta"][start:stop]]
+    return CatalogList(table, offsets - offsets[0], meta)
+
+
+def _load_catalog_list(f: h5py.File) -> Union[List[Table], CatalogList]:
+    """Loads the catalogs saved in a file, in the columnar layout or one table per blend."""
+    if "catalog" in f:
+        return read_catalog_columns(f["catalog"])
+    # files saved by previous versions of BTK
+    return [read_table_hdf5(f, path=f"catalog_list/{ii}") for ii in range(f.attrs["batch_size"])]
+
+
+def append_to_dataset(dataset: h5py.Dataset, data: np.ndarray):
+    """Appends data to a dataset which is resizable along its first axis."""
+    n_rows = dataset.shape[0]
+    dataset.resize(n_rows + len(data), axis=0)
+    dataset[n_rows:] = data
+
+
+def draw_psf_image(psf: galsim.GSObject, image_size: int, dtype=np.float64) -> np.ndarray:
+    """Returns the image of a PSF drawn in a stamp, computing it once per process.
+
+    Drawn images are kept in a least-recently-used cache (see `btk.cache.get_process_cache`)
+    keyed by the PSF profile, which galsim compares by value, along with the stamp size and
+    data type. Hence, the PSF of each band of a survey is only drawn once and then shared by all
+    batches, deblenders and saved files using it, while a different PSF (e.g. generated by a
+    PSF function for a new batch) is drawn again.
+
+    Args:
+        psf: Galsim profile of the PSF.
+        image_size: Size of the stamp in pixels.
+        dtype: Data type of the image. (Default: float64)
+
+    Returns:
+        Read-only array of shape `(image_size, image_size)`.
+    """
+    dtype = np.dtype(dtype)
+
+    def _draw():
+        image = psf.drawImage(nx=image_size, ny=image_size, dtype=dtype).array
+        image.setflags(write=False)
+        return image
+
+    cache = get_process_cache("psf-images", PSF_CACHE_SIZE)
+    return cache.get_or_compute((psf, image_size, dtype.str), _draw)
+
+
+def _load_psf_images(psf_array: np.ndarray, per_blend: bool) -> list:
+    """Converts saved PSF arrays to the `psf` of a `BlendBatch` (see `BlendBatch.psf_index`)."""
+    if per_blend:
+        return [[galsim.Image(psf) for psf in band_psf] for band_psf in psf_array.swapaxes(0, 1)]
+    return [galsim.Image(psf) for psf in psf_array]
+
 
 @dataclass
 class BlendBatch:
-    """Class which stores all relevant data for blends in a single survey."""
+    """Class which stores all relevant data for blends in a single survey.
+
+    By default, all blends of the batch share the same PSF, and `psf` contains one galsim
+    object per band. If the blends were drawn with a `btk.survey.PSFLibrary`, `psf_index`
+    contains the index in the library of the PSF of each blend, and `psf` contains the PSFs of
+    all blends in each band (i.e. `psf[band][blend]`, see `get_blend_psf`).
+    """
 
     batch_size: int
     max_n_sources: int
     stamp_size: int
     survey: Survey
     blend_images: np.ndarray
-    isolated_images: np.ndarray
-    catalog_list: List[Table]
+    isolated_images: Union[np.ndarray, SparseIsolatedImages]
+    catalog_list: Union[List[Table], CatalogList]
     psf: List[galsim.GSObject]  # each element corresponds to each band
+    psf_index: Optional[np.ndarray] = None  # index of the PSF of each blend in a PSF library
 
     def __post_init__(self):
         """Checks that the data is of the right shape."""
@@ -37,6 +518,10 @@ class BlendBatch:
         assert c1 == c2 == n_bands
         assert n == self.max_n_sources
         assert ps11 == ps12 == ps21 == ps22 == self._get_image_size()
+        assert self.blend_images.dtype == self.isolated_images.dtype
+        if self.psf_index is not None:
+            assert len(self.psf_index) == self.batch_size
+            assert all(len(band_psf) == self.batch_size for band_psf in self.psf)
 
     def _get_image_size(self) -> int:
         """Returns the size of the stamps in pixels."""
@@ -49,17 +534,47 @@ class BlendBatch:
         pixel_scale = self.survey.pixel_scale.to_value("arcsec")
         return make_wcs(pixel_scale, (pix_stamp_size, pix_stamp_size))
 
-    def get_numpy_psf(self):
-        """Returns the psf as a numpy array."""
+    @property
+    def dtype(self) -> np.dtype:
+        """Floating point type of the blend and isolated images."""
+        return self.blend_images.dtype
+
+    def get_blend_psf(self, index: int) -> List[galsim.GSObject]:
+        """Returns the PSF of each band used to draw the blend `index`."""
+        if self.psf_index is None:
+            return self.psf
+        return [band_psf[index] for band_psf in self.psf]
+
+    def get_numpy_psf(self, index: Optional[int] = None):
+        """Returns the psf as a numpy array (with the same type as the images).
+
+        PSF profiles are only drawn the first time, see `draw_psf_image`.
+
+        Args:
+            index: Index of a blend, whose PSF is returned as an array of shape
+                `(n_bands, H, W)`. If None, the PSF shared by all blends is returned with the
+                same shape, or the PSFs of all blends with shape `(batch_size, n_bands, H, W)`
+                if they have their own PSF (see `psf_index`).
+        """
+        if self.psf_index is not None and index is None:
+            return np.array([self.get_numpy_psf(ii) for ii in range(self.batch_size)])
+        psf_list = self.psf if index is None else self.get_blend_psf(index)
         return np.array(
-            [psf.drawImage(nx=self.image_size, ny=self.image_size).array for psf in self.psf]
+            [
+                psf.array.astype(self.dtype, copy=False)
+                if isinstance(psf, galsim.Image)  # e.g. for loaded batches
+                else draw_psf_image(psf, self.image_size, self.dtype)
+                for psf in psf_list
+            ]
         )
 
     def __repr__(self) -> str:
         """Return string representation of class."""
         string = self.__class__.__name__ + f"(survey_name={self.survey.name}, "
         string += "\n\t blend_images: np.ndarray, shape " + str(list(self.blend_images.shape))
-        string += "\n\t isolated_images: np.ndarray, shape " + str(list(self.isolated_images.shape))
+        iso_type = type(self.isolated_images).__name__
+        string += f"\n\t isolated_images: {iso_type}, shape "
+        string += str(list(self.isolated_images.shape))
         string += (
             "\n\t catalog_list: list of " + str(Table) + ", size " + str(len(self.catalog_list))
         )
@@ -79,17 +594,20 @@ class BlendBatch:
         with h5py.File(fpath, "w") as f:
             # save blend and isolated images
             f.create_dataset("blend_images", data=self.blend_images)
-            f.create_dataset("isolated_images", data=self.isolated_images)
+            if isinstance(self.isolated_images, SparseIsolatedImages):
+                self.isolated_images.save(f.create_group("isolated_images"))
+            else:
+                f.create_dataset("isolated_images", data=self.isolated_images)
 
             # save psfs
             # first convert psfs to numpy array
             psf_array = self.get_numpy_psf()
             f.create_dataset("psf", data=psf_array)
+            if self.psf_index is not None:
+                f.create_dataset("psf_index", data=self.psf_index)
 
-            # save catalog using astropy functions
-            # (this is faster than saving as numpy array)
-            for ii, catalog in enumerate(self.catalog_list):
-                write_table_hdf5(catalog, f, path=f"catalog_list/{ii}")
+            # save catalogs concatenated in a single table
+            append_catalog_columns(f.create_group("catalog"), self.catalog_list)
 
             # save general info about blend
             f.attrs["batch_size"] = self.batch_size
@@ -112,15 +630,17 @@ class BlendBatch:
         with h5py.File(fpath, "r") as f:
             # load blend and isolated images
             blend_images = f["blend_images"][:]
-            isolated_images = f["isolated_images"][:]
+            if isinstance(f["isolated_images"], h5py.Group):
+                isolated_images = SparseIsolatedImages.load(f["isolated_images"])
+            else:
+                isolated_images = f["isolated_images"][:]
 
             # load psfs
-            psf_list = [galsim.Image(psf) for psf in f["psf"][:]]
+            psf_index = f["psf_index"][:] if "psf_index" in f else None
+            psf_list = _load_psf_images(f["psf"][:], psf_index is not None)
 
             # load catalog
-            catalog_list = []
-            for ii in range(f.attrs["batch_size"]):
-                catalog_list.append(read_table_hdf5(f, path=f"catalog_list/{ii}"))
+            catalog_list = _load_catalog_list(f)
 
             # load general info about blend
             batch_size = f.attrs["batch_size"]
@@ -141,6 +661,7 @@ class BlendBatch:
             isolated_images=isolated_images,
             catalog_list=catalog_list,
             psf=psf_list,
+            psf_index=psf_index,
         )
 
 
@@ -153,10 +674,10 @@ class MultiResolutionBlendBatch:
         self.batch_size = blend_batch_list[0].batch_size
         self.max_n_sources = blend_batch_list[0].max_n_sources
         self.stamp_size = blend_batch_list[0].stamp_size
-        self.survey_names = [blend_batch.survey_name for blend_batch in blend_batch_list]
+        self.survey_names = [blend_batch.survey.name for blend_batch in blend_batch_list]
         for blend_batch in blend_batch_list:
             assert isinstance(blend_batch, BlendBatch)
-        self.results = {blend_batch.survey_name: blend_batch for blend_batch in blend_batch_list}
+        self.results = {blend_batch.survey.name: blend_batch for blend_batch in blend_batch_list}
 
     def __getitem__(self, item: Union[str, int, slice]):
         """Return SurveyBatch for a given survey name or index."""
@@ -296,7 +817,7 @@ class DeblendBatch:
 
     batch_size: int
     max_n_sources: int
-    catalog_list: List[Table]
+    catalog_list: Union[List[Table], CatalogList]
     n_bands: Optional[int] = None
     image_size: Optional[int] = None
     segmentation: Optional[np.ndarray] = None
@@ -310,12 +831,14 @@ class DeblendBatch:
         self.deblended_images = self._validate_deblended_images(self.deblended_images)
 
     def _validate_catalog(self, catalog_list: List[Table]):
-        if not isinstance(catalog_list, list):
+        if not isinstance(catalog_list, (list, CatalogList)):
             raise TypeError(
                 "Catalog must be a list of 'astropy.table.Table' for each image in the batch"
             )
         assert len(catalog_list) == self.batch_size
-        for catalog in catalog_list:
+        # all catalogs of a `CatalogList` have the same columns.
+        catalogs = [catalog_list] if isinstance(catalog_list, CatalogList) else catalog_list
+        for catalog in catalogs:
             if not ("ra" in catalog.colnames and "dec" in catalog.colnames):
                 raise ValueError(
                     "The output catalog of at least one of your measurement functions does"
@@ -401,9 +924,8 @@ class DeblendBatch:
         """Save batch of measure results to disk in hdf5 format."""
         fpath = os.path.join(path, f"deblend_{batch_number}.hdf5")
         with h5py.File(fpath, "w") as f:
-            # save catalog with astropy hdf5 functions
-            for ii, catalog in enumerate(self.catalog_list):
-                write_table_hdf5(catalog, f, path=f"catalog_list/{ii}")
+            # save catalogs concatenated in a single table
+            append_catalog_columns(f.create_group("catalog"), self.catalog_list)
 
             # save segmentation
             if self.segmentation is not None:
@@ -426,10 +948,8 @@ class DeblendBatch:
 
         # open file
         with h5py.File(fpath, "r") as f:
-            # load catalog with astropy hdf5 functions
-            catalog_list = []
-            for ii in range(f.attrs["batch_size"]):
-                catalog_list.append(read_table_hdf5(f, path=f"catalog_list/{ii}"))
+            # load catalog
+            catalog_list = _load_catalog_list(f)
 
             # load segmentation
             segmentation = f["segmentation"][:] if "segmentation" in f.keys() else None
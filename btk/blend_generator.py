@@ -13,6 +13,7 @@ class BlendGenerator:
         sampling_function: SamplingFunction,
         batch_size: int = 8,
         verbose: bool = False,
+        batch_sampling: bool = False,
     ):
         """Initializes the BlendGenerator.
 
@@ -21,11 +22,17 @@ class BlendGenerator:
             sampling_function: An object that return samples from catalog.
             batch_size: Size of batches returned. (Default: 8)
             verbose: Whether to print additional information.
+            batch_sampling: Whether to sample all the blends of a batch at once with the
+                `sample_batch` method of the sampling function, if it has one. Sampling
+                functions with a batched implementation (e.g. `DefaultSampling`) then return
+                different blends for a given seed than with one call per blend, which is used
+                otherwise. (Default: False)
         """
         self.catalog = catalog
         self.batch_size = batch_size
         self.verbose = verbose
         self.sampling_function = sampling_function
+        self.batch_sampling = batch_sampling
 
         if not hasattr(sampling_function, "max_number"):
             raise AttributeError(
@@ -39,6 +46,14 @@ class BlendGenerator:
         """Returns an iterable which is the object itself."""
         return self
 
+    def state_dict(self) -> dict:
+        """Returns the state of the generator (i.e. of its sampling function)."""
+        return {"sampling_function": self.sampling_function.state_dict()}
+
+    def load_state_dict(self, state: dict):
+        """Restores the state of the generator returned by `state_dict`."""
+        self.sampling_function.load_state_dict(state["sampling_function"])
+
     def _check_n_sources(self, blend_table):
         if len(blend_table) > self.max_number:
             raise ValueError(
@@ -55,14 +70,19 @@ class BlendGenerator:
         """Generates a list of blend tables of len batch_size.
 
         Each blend table has entries numbered between `min_number` and `max_number`, corresponding
-        to overlapping objects in the blend.
+        to overlapping objects in the blend. The blends are sampled with the `sample_batch` method
+        of the sampling function if `batch_sampling` is set and it has one, and with one call per
+        blend otherwise.
 
         Returns:
             blend_tables (list): a list of astropy tables, each one corresponding to a blend.
         """
-        blend_tables = []
-        for _ in range(self.batch_size):
-            blend_table = self.sampling_function(self.catalog.table)
+        if self.batch_sampling and hasattr(self.sampling_function, "sample_batch"):
+            blend_tables = self.sampling_function.sample_batch(self.catalog.table, self.batch_size)
+        else:
+            blend_tables = [
+                self.sampling_function(self.catalog.table) for _ in range(self.batch_size)
+            ]
+        for blend_table in blend_tables:
             self._check_n_sources(blend_table)
-            blend_tables.append(blend_table)
         return blend_tables
@@ -0,0 +1,210 @@
+"""Contains a memory-bounded LRU cache used to avoid recomputing expensive galsim objects."""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional
+
+import galsim
+import numpy as np
+
+
+def estimate_nbytes(obj: Any, exclude: Iterable[Any] = ()) -> int:
+    """Returns a rough estimate of the memory used by an object and the objects it refers to.
+
+    Numpy arrays (including the ones in galsim images) are counted with their full size, views
+    being counted through the array owning their data, and other objects are traversed through
+    their attributes and items. Memory allocated by the C++ layer of galsim is not accounted for.
+
+    Args:
+        obj: Object whose size to estimate.
+        exclude: Objects which are not counted, e.g. because they are shared with other
+            values of a cache.
+
+    Returns:
+        Estimated size in bytes.
+    """
+    return _estimate_nbytes(obj, {id(o) for o in exclude})
+
+
+def _estimate_nbytes(obj: Any, _seen: set) -> int:
+    """Recursive part of `estimate_nbytes`, `_seen` contains the ids of objects already counted."""
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        if obj.base is None:
+            return sys.getsizeof(obj)  # includes the data owned by the array.
+        # views are counted through the array owning the data, which is only counted once.
+        return sys.getsizeof(obj) + _estimate_nbytes(obj.base, _seen)
+    if isinstance(obj, galsim.Image):
+        return _estimate_nbytes(obj.array, _seen)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_estimate_nbytes(v, _seen) for v in obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_estimate_nbytes(v, _seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += _estimate_nbytes(vars(obj), _seen)
+    return size
+
+
+class LRUCache:
+    """Least-recently-used cache whose size is bounded by the estimated memory of its values.
+
+    When adding a new value would exceed `max_size`, the least recently used values are evicted
+    until it fits. The number of hits, misses and evictions are recorded in `stats`.
+
+    The cache can be shared by several threads: values are computed outside of the lock, so a
+    value missing from the cache may be computed by more than one thread at the same time.
+    """
+
+    def __init__(self, max_size: float, sizeof: Callable[[Any], int] = estimate_nbytes):
+        """Initializes the cache.
+
+        Args:
+            max_size: Maximum memory used by the values in the cache (in bytes).
+            sizeof: Function returning the memory used by a value (in bytes).
+                (Default: `estimate_nbytes`)
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        """Locks can not be pickled, a new one is created when unpickling."""
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        """Restores the cache with a new lock."""
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Returns the number of values in the cache."""
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Checks if a key is in the cache (without updating the order or statistics)."""
+        return key in self._data
+
+    def get_or_compute(
+        self, key: Hashable, func: Callable[[], Any], size: Optional[Callable[[Any], int]] = None
+    ) -> Any:
+        """Returns the value corresponding to `key`, computing it with `func()` if missing.
+
+        Args:
+            key: Key of the value in the cache.
+            func: Function without arguments computing the value.
+            size: Optional function returning the size of the computed value, which is used
+                instead of `self.sizeof` (see `put`).
+
+        Returns:
+            Cached or newly computed value.
+        """
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key][0]
+            self.misses += 1
+        value = func()
+        self.put(key, value, None if size is None else size(value))
+        return value
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        """Adds a value to the cache, evicting least recently used ones as needed.
+
+        Values larger than `max_size` are not stored.
+
+        Args:
+            key: Key of the value in the cache.
+            value: Value to store.
+            size: Memory used by the value (in bytes). If None, it is given by `self.sizeof`.
+        """
+        size = self.sizeof(value) if size is None else size
+        with self._lock:
+            if key in self._data:
+                self.size -= self._data.pop(key)[1]
+            if size > self.max_size:
+                return
+            while self.size + size > self.max_size:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            self._data[key] = (value, size)
+            self.size += size
+
+    def clear(self):
+        """Removes all values from the cache and resets the statistics."""
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        """Returns a dictionary with the statistics of the cache."""
+        n_calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / n_calls if n_calls > 0 else 0.0,
+            "evictions": self.evictions,
+            "n_items": len(self),
+            "size": self.size,
+            "max_size": self.max_size,
+        }
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return (
+            f"LRUCache(n_items={len(self)}, size={self.size}, max_size={self.max_size}, "
+            f"hits={self.hits}, misses={self.misses})"
+        )
+
+
+_PROCESS_CACHES: Dict[str, LRUCache] = {}
+_PROCESS_CACHES_LOCK = threading.Lock()
+
+
+def get_process_cache(name: str, max_size: float) -> LRUCache:
+    """Returns the cache with a given name in the current process, creating it if needed.
+
+    Objects sent to worker processes are unpickled anew for each task, so caches that should
+    persist across tasks are stored at the module level of each process instead.
+
+    Args:
+        name: Unique name of the cache.
+        max_size: Maximum memory used by the cache (in bytes), if it needs to be created.
+
+    Returns:
+        `LRUCache` object, which is shared by all callers (and threads) using the same name in
+        this process.
+    """
+    with _PROCESS_CACHES_LOCK:
+        if name not in _PROCESS_CACHES:
+            _PROCESS_CACHES[name] = LRUCache(max_size)
+        return _PROCESS_CACHES[name]
+
+
+def release_process_cache(name: str):
+    """Removes the cache with a given name from the current process, if it exists.
+
+    The memory of the cache is freed once the objects using it are garbage collected.
+
+    Args:
+        name: Unique name of the cache.
+    """
+    with _PROCESS_CACHES_LOCK:
+        _PROCESS_CACHES.pop(name, None)
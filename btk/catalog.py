@@ -1,9 +1,10 @@
 """Contains abstract base class `Catalog` that standarizes catalog usage across BTK."""
 
 import os
+import threading
 from abc import ABC, abstractmethod
 from copy import deepcopy
-from typing import Tuple, Union
+from typing import Dict, Optional, Tuple, Union
 
 import astropy
 import galsim
@@ -77,16 +78,57 @@ class CatsimCatalog(Catalog):
         table = deepcopy(raw_catalog)
         if "ra" not in table.colnames or "dec" not in table.colnames:
             raise ValueError("Catalog must have 'ra' and 'dec' columns.")
+        table["btk_index"] = np.arange(0, len(table))
         return table
 
 
+_GALSIM_CATALOGS: Dict[Tuple[str, str], galsim.COSMOSCatalog] = {}
+_GALSIM_CATALOGS_LOCK = threading.Lock()
+
+
+def get_process_galsim_catalog(file_name: str, exclusion_level: str) -> galsim.COSMOSCatalog:
+    """Returns the `galsim.COSMOSCatalog` of a file in the current process, loading it if needed.
+
+    Worker processes use it to load the COSMOS catalog once per process, instead of receiving it
+    with every task (see `btk.cache.get_process_cache` for the same pattern).
+
+    Args:
+        file_name: Path to the COSMOS real galaxy catalog.
+        exclusion_level: Level of cuts made on the galaxies, see `CosmosCatalog.from_file`.
+
+    Returns:
+        `galsim.COSMOSCatalog` object, which is shared by all callers using the same file and
+        exclusion level in this process.
+    """
+    key = (os.path.abspath(file_name), exclusion_level)
+    with _GALSIM_CATALOGS_LOCK:
+        if key not in _GALSIM_CATALOGS:
+            _GALSIM_CATALOGS[key] = galsim.COSMOSCatalog(key[0], exclusion_level=exclusion_level)
+        return _GALSIM_CATALOGS[key]
+
+
 class CosmosCatalog(Catalog):
     """Class containing catalog information for drawing COSMOS galaxies from galsim."""
 
-    def __init__(self, raw_catalog: Table, galsim_catalog: galsim.COSMOSCatalog):
-        """Initializes the COSMOS Catalog class."""
+    def __init__(
+        self,
+        raw_catalog: Table,
+        galsim_catalog: galsim.COSMOSCatalog,
+        galsim_catalog_args: Optional[Tuple[str, str]] = None,
+    ):
+        """Initializes the COSMOS Catalog class.
+
+        Args:
+            raw_catalog: Astropy table containing the COSMOS catalog.
+            galsim_catalog: Corresponding `galsim.COSMOSCatalog` object.
+            galsim_catalog_args: Path to the real galaxy catalog and exclusion level from which
+                `galsim_catalog` can be loaded again (see `get_process_galsim_catalog`), if any.
+                Generators then load it in each worker process instead of sending it with every
+                task. (Default: None)
+        """
         super().__init__(raw_catalog)
         self.galsim_catalog = galsim_catalog
+        self.galsim_catalog_args = galsim_catalog_args
 
     @classmethod
     def from_file(cls, catalog_files: Tuple[str, str], exclusion_level="marginal"):
@@ -126,7 +168,7 @@ class CosmosCatalog(Catalog):
 
         catalog = astropy.table.hstack([catalog_coord, catalog_fit])
 
-        return cls(catalog, galsim_catalog)
+        return cls(catalog, galsim_catalog, (str(catalog_files[0]), exclusion_level))
 
     def _prepare_table(self, raw_catalog: Table) -> Table:
         """Carries operations to generate a standardized table."""
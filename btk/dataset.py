@@ -0,0 +1,553 @@
+"""Contains tools to store many batches of blends in a single on-disk dataset."""
+
+import contextlib
+import json
+import os
+import queue
+import threading
+from typing import Iterator, List, Optional, Sequence, Union
+
+import galsim
+import h5py
+import numpy as np
+from astropy.io.misc.hdf5 import read_table_hdf5
+from astropy.table import Table
+
+from btk.blend_batch import (
+    BlendBatch,
+    MultiResolutionBlendBatch,
+    SparseIsolatedImages,
+    append_catalog_columns,
+    append_to_dataset,
+    read_catalog_columns,
+    truncate_catalog_columns,
+)
+from btk.survey import Survey, get_surveys
+
+
+class DatasetWriter:
+    """Streams batches of blends into a single chunked and appendable hdf5 file.
+
+    Each survey is stored in its own group of the file (named after the survey), which contains
+    the following datasets, all resizable along their first axis:
+
+        - `blend_images` of shape `(n_blends, n_bands, H, W)`, chunked per blend.
+        - `isolated_images` of shape `(n_blends, max_n_sources, n_bands, H, W)`, chunked per
+          blend. If the batches contain `SparseIsolatedImages`, it is instead a group with the
+          components of the sparse representation, concatenated over all batches (see
+          `SparseIsolatedImages.save`).
+        - `psf` of shape `(n_batches, n_bands, H, W)`, with the PSF of each batch. If the
+          blends were drawn with a `btk.survey.PSFLibrary`, it has shape
+          `(n_blends, n_bands, H, W)` instead, with the PSF of each blend, and `psf_index` of
+          size `n_blends` contains their indices in the library.
+        - `batch_offsets` of size `n_batches + 1`, with the index of the first blend of each
+          batch.
+        - `catalog`, a group with the catalogs of all blends in a columnar layout (see
+          `btk.blend_batch.append_catalog_columns`).
+
+    Batches are written by a background thread, so that rendering the next batches can proceed
+    while the previous ones are written to disk. `write` only blocks when `max_queue_size`
+    batches are already waiting to be written. Errors raised while writing are propagated to
+    the main thread on the next call to `write`, `flush` or `close`.
+
+    The writer should be closed after use, which waits for all batches to be written; it can
+    also be used as a context manager::
+
+        with DatasetWriter("blends.hdf5", compression="lzf") as writer:
+            writer.write_batches(draw_generator, n_batches=100)
+
+    `write_batches` also saves the state of the generator (see `DrawBlendsGenerator.state_dict`)
+    after each batch, so that an interrupted run can be resumed::
+
+        with DatasetWriter("blends.hdf5", mode="a") as writer:
+            draw_generator.load_state_dict(writer.generator_state)
+            writer.write_batches(draw_generator, n_batches=100 - writer.n_batches)
+
+    When opening a dataset in "a" mode, data of batches that were not completely written
+    (e.g. if the program was killed while writing) is discarded.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "w",
+        compression: Optional[str] = None,
+        compression_opts: Optional[int] = None,
+        max_queue_size: int = 2,
+    ):
+        """Opens the file and starts the writing thread.
+
+        Args:
+            path: Path of the hdf5 file.
+            mode: Either "w" to create the file (erasing any existing file) or "a" to append
+                batches to an existing dataset.
+            compression: Compression filter of the datasets, e.g. "gzip" or "lzf" (see
+                `h5py.Group.create_dataset`). Default is no compression.
+            compression_opts: Options of the compression filter (e.g. the level of "gzip").
+            max_queue_size: Maximum number of batches waiting to be written.
+        """
+        if mode not in ("w", "a"):
+            raise ValueError(f"mode must be either 'w' or 'a', got '{mode}'.")
+        self.path = path
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self._file = h5py.File(path, mode)
+        n_batches = int(self._file.attrs.get("n_batches", 0))
+        # groups created by a batch that was not completely written are truncated as well.
+        for group in self._file.values():
+            self._truncate_survey_group(group, n_batches)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def n_batches(self) -> int:
+        """Number of batches written to the dataset (after waiting for queued batches)."""
+        self.flush()
+        return int(self._file.attrs.get("n_batches", 0))
+
+    @property
+    def generator_state(self) -> Optional[dict]:
+        """State of the generator after the last batch written with `write_batches`."""
+        self.flush()
+        if "generator_state" not in self._file.attrs:
+            return None
+        return json.loads(self._file.attrs["generator_state"])
+
+    @property
+    def _dataset_kwargs(self) -> dict:
+        return {"compression": self.compression, "compression_opts": self.compression_opts}
+
+    def _run(self):
+        """Writes the batches of the queue until receiving `None`."""
+        while True:
+            blend_batch, state = self._queue.get()
+            try:
+                if blend_batch is None:
+                    break
+                if self._error is None:
+                    self._write(blend_batch, state)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        """Raises in the main thread the error that happened in the writing thread."""
+        if self._error is not None:
+            raise RuntimeError(f"Writing to {self.path} failed.") from self._error
+
+    def write(
+        self,
+        blend_batch: Union[BlendBatch, MultiResolutionBlendBatch],
+        generator_state: Optional[dict] = None,
+    ):
+        """Queues a batch of blends to be written to the dataset.
+
+        The arrays of the batch should not be modified afterwards, as they are written
+        asynchronously.
+
+        Args:
+            blend_batch: Batch of blends, as returned by a `DrawBlendsGenerator`.
+            generator_state: State of the generator after returning the batch, saved along with
+                the batch (must be convertible to JSON).
+        """
+        self._check_error()
+        if self._file.id is None or not self._thread.is_alive():
+            raise ValueError("Cannot write to a closed DatasetWriter.")
+        self._queue.put((blend_batch, generator_state))
+
+    def write_batches(self, draw_generator: Iterator, n_batches: int):
+        """Draws `n_batches` batches from `draw_generator` and writes them to the dataset.
+
+        The state of the generator is saved with each batch if it has a `state_dict` method.
+        """
+        for _ in range(n_batches):
+            blend_batch = next(draw_generator)
+            state = draw_generator.state_dict() if hasattr(draw_generator, "state_dict") else None
+            self.write(blend_batch, state)
+
+    def flush(self):
+        """Waits for all queued batches to be written and flushes the file."""
+        self._queue.join()
+        self._check_error()
+        self._file.flush()
+
+    def close(self):
+        """Waits for all queued batches to be written and closes the file."""
+        if self._thread.is_alive():
+            self._queue.put((None, None))
+            self._thread.join()
+        if self._file.id:
+            self._file.close()
+        self._check_error()
+
+    def __enter__(self) -> "DatasetWriter":
+        """Returns the writer to use it as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Closes the writer when exiting the context."""
+        self.close()
+
+    def _write(
+        self,
+        blend_batch: Union[BlendBatch, MultiResolutionBlendBatch],
+        generator_state: Optional[dict],
+    ):
+        """Appends a batch to the file (called in the writing thread)."""
+        if isinstance(blend_batch, MultiResolutionBlendBatch):
+            batch_list = list(blend_batch.results.values())
+        else:
+            batch_list = [blend_batch]
+        for batch in batch_list:
+            if batch.survey.name not in self._file:
+                self._create_survey_group(batch)
+            self._append_batch(self._file[batch.survey.name], batch)
+        # the batch is only considered written once all of its data is in the file.
+        self._file.attrs["surveys"] = list(self._file.keys())
+        self._file.attrs["n_batches"] = self._file.attrs.get("n_batches", 0) + 1
+        if generator_state is not None:
+            self._file.attrs["generator_state"] = json.dumps(generator_state)
+        self._file.flush()
+
+    def _create_survey_group(self, blend_batch: BlendBatch):
+        """Creates the resizable datasets of a survey, using the first batch for their shapes."""
+        group = self._file.create_group(blend_batch.survey.name)
+        shape = blend_batch.blend_images.shape[1:]
+        group.create_dataset(
+            "blend_images",
+            shape=(0, *shape),
+            dtype=blend_batch.dtype,
+            maxshape=(None, *shape),
+            chunks=(1, *shape),
+            **self._dataset_kwargs,
+        )
+        if isinstance(blend_batch.isolated_images, SparseIsolatedImages):
+            isolated_group = group.create_group("isolated_images")
+            isolated_group.attrs["shape"] = (0, *blend_batch.isolated_images.shape[1:])
+            for name in ("offsets", "blend_offsets"):
+                isolated_group.create_dataset(
+                    name, data=np.zeros(1, dtype=np.int64), maxshape=(None,)
+                )
+            isolated_group.create_dataset(
+                "data",
+                shape=(0,),
+                dtype=blend_batch.dtype,
+                maxshape=(None,),
+                chunks=True,
+                **self._dataset_kwargs,
+            )
+            isolated_group.create_dataset(
+                "bboxes", shape=(0, 4), dtype=np.int64, maxshape=(None, 4), chunks=True
+            )
+            isolated_group.create_dataset(
+                "sources", shape=(0,), dtype=np.int64, maxshape=(None,), chunks=True
+            )
+        else:
+            shape = blend_batch.isolated_images.shape[1:]
+            group.create_dataset(
+                "isolated_images",
+                shape=(0, *shape),
+                dtype=blend_batch.dtype,
+                maxshape=(None, *shape),
+                chunks=(1, *shape),
+                **self._dataset_kwargs,
+            )
+        shape = blend_batch.blend_images.shape[1:]
+        if blend_batch.psf_index is None:
+            group.create_dataset(
+                "psf", shape=(0, *shape), dtype=blend_batch.dtype, maxshape=(None, *shape)
+            )
+        else:
+            group.create_dataset(
+                "psf",
+                shape=(0, *shape),
+                dtype=blend_batch.dtype,
+                maxshape=(None, *shape),
+                chunks=(1, *shape),
+                **self._dataset_kwargs,
+            )
+            group.create_dataset(
+                "psf_index", shape=(0,), dtype=np.int64, maxshape=(None,), chunks=True
+            )
+        group.create_dataset("batch_offsets", data=np.zeros(1, dtype=np.int64), maxshape=(None,))
+        group.create_group("catalog")
+        group.attrs["max_n_sources"] = blend_batch.max_n_sources
+        group.attrs["stamp_size"] = blend_batch.stamp_size
+        group.attrs["survey_name"] = blend_batch.survey.name
+        self._file.attrs["surveys"] = list(self._file.keys())
+
+    def _append_batch(self, group: h5py.Group, blend_batch: BlendBatch):
+        """Appends a batch of a single survey to its group."""
+        if ("psf_index" in group) != (blend_batch.psf_index is not None):
+            raise ValueError("All batches of a dataset must use PSF libraries, or none of them.")
+        append_to_dataset(group["blend_images"], blend_batch.blend_images)
+        if isinstance(group["isolated_images"], h5py.Group):
+            self._append_sparse_images(group["isolated_images"], blend_batch.isolated_images)
+        else:
+            append_to_dataset(group["isolated_images"], np.asarray(blend_batch.isolated_images))
+        if blend_batch.psf_index is None:
+            append_to_dataset(group["psf"], blend_batch.get_numpy_psf()[None])
+        else:
+            append_to_dataset(group["psf"], blend_batch.get_numpy_psf())
+            append_to_dataset(group["psf_index"], blend_batch.psf_index)
+        append_catalog_columns(group["catalog"], blend_batch.catalog_list, **self._dataset_kwargs)
+        batch_offsets = group["batch_offsets"]
+        append_to_dataset(batch_offsets, [batch_offsets[-1] + blend_batch.batch_size])
+
+    @staticmethod
+    def _append_sparse_images(group: h5py.Group, isolated_images: SparseIsolatedImages):
+        """Appends sparse isolated images to the group of the sparse representation."""
+        if not isinstance(isolated_images, SparseIsolatedImages):
+            isolated_images = SparseIsolatedImages.from_dense(isolated_images)
+        shape = group.attrs["shape"]
+        assert tuple(shape[1:]) == isolated_images.shape[1:]
+        offsets, blend_offsets = group["offsets"], group["blend_offsets"]
+        append_to_dataset(offsets, isolated_images.offsets[1:] + offsets[-1])
+        append_to_dataset(blend_offsets, isolated_images.blend_offsets[1:] + blend_offsets[-1])
+        for name in ("data", "bboxes", "sources"):
+            append_to_dataset(group[name], getattr(isolated_images, name))
+        group.attrs["shape"] = (shape[0] + isolated_images.shape[0], *shape[1:])
+
+    @staticmethod
+    def _truncate_survey_group(group: h5py.Group, n_batches: int):
+        """Discards the data of a survey beyond the first `n_batches` batches."""
+        batch_offsets = group["batch_offsets"]
+        batch_offsets.resize(min(len(batch_offsets), n_batches + 1), axis=0)
+        n_blends = batch_offsets[-1]
+        group["blend_images"].resize(n_blends, axis=0)
+        if "psf_index" in group:
+            group["psf"].resize(n_blends, axis=0)
+            group["psf_index"].resize(n_blends, axis=0)
+        else:
+            group["psf"].resize(n_batches, axis=0)
+        isolated_images = group["isolated_images"]
+        if isinstance(isolated_images, h5py.Group):
+            isolated_images["blend_offsets"].resize(n_blends + 1, axis=0)
+            n_cutouts = isolated_images["blend_offsets"][-1]
+            isolated_images["offsets"].resize(n_cutouts + 1, axis=0)
+            isolated_images["data"].resize(isolated_images["offsets"][-1], axis=0)
+            isolated_images["bboxes"].resize(n_cutouts, axis=0)
+            isolated_images["sources"].resize(n_cutouts, axis=0)
+            shape = isolated_images.attrs["shape"]
+            isolated_images.attrs["shape"] = (n_blends, *shape[1:])
+        else:
+            isolated_images.resize(n_blends, axis=0)
+        if "offsets" in group["catalog"]:
+            truncate_catalog_columns(group["catalog"], n_blends)
+
+
+class BlendDataset:
+    """Random-access reader of blends saved on disk, which loads data lazily.
+
+    Reads either a dataset written with `DatasetWriter` or a single batch saved with
+    `BlendBatch.save`. Only the data of the requested blends is read from disk: images are read
+    as hyperslabs of the (chunked) hdf5 datasets and catalogs are decoded on demand, so datasets
+    much larger than memory can be used.
+
+    Indexing with an integer returns a dictionary with the `blend_images`, `isolated_images`,
+    `psf` (as numpy arrays) and `catalog` (as an astropy table) of a single blend, as usually
+    expected by training loops. Indexing with a slice returns the selected blends as a
+    `BlendBatch`, whose PSF is the one of the first selected blend (unless blends have their
+    own PSF, see `btk.survey.PSFLibrary`).
+
+    The file is opened on first access in each process, so that a dataset can be shared by
+    several processes, e.g. in the workers of a PyTorch `DataLoader`.
+    """
+
+    def __init__(self, path: str, survey_name: Optional[str] = None):
+        """Initializes the dataset, without reading any data.
+
+        Args:
+            path: Path of the hdf5 file.
+            survey_name: Name of the survey to read, if the dataset contains several surveys.
+        """
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._survey = None
+        surveys = self.surveys
+        if survey_name is None:
+            if len(surveys) > 1:
+                raise ValueError(f"Dataset contains several surveys {surveys}, pick one.")
+            survey_name = surveys[0]
+        if survey_name not in surveys:
+            raise ValueError(f"Survey '{survey_name}' not in dataset, available: {surveys}.")
+        self.survey_name = survey_name
+        self.close()
+
+    @property
+    def file(self) -> h5py.File:
+        """The hdf5 file, opened (read-only) once per process."""
+        if self._file is None or self._pid != os.getpid():
+            self._file = h5py.File(self.path, "r")
+            self._pid = os.getpid()
+        return self._file
+
+    @property
+    def surveys(self) -> List[str]:
+        """Names of the surveys in the dataset."""
+        if "blend_images" in self.file:
+            return [self.file.attrs["survey_name"]]
+        return list(self.file.attrs["surveys"])
+
+    @property
+    def _group(self) -> h5py.Group:
+        """Group containing the data of the survey."""
+        return self.file if "blend_images" in self.file else self.file[self.survey_name]
+
+    @property
+    def survey(self) -> Survey:
+        """Survey of the blends."""
+        if self._survey is None:
+            self._survey = get_surveys(self.survey_name)
+        return self._survey
+
+    def __len__(self) -> int:
+        """Returns the number of blends."""
+        return self._group["blend_images"].shape[0]
+
+    def __getstate__(self) -> dict:
+        """Does not pickle the opened file, which is reopened by each process."""
+        state = self.__dict__.copy()
+        state["_file"] = None
+        return state
+
+    def close(self):
+        """Closes the file (it is reopened if the dataset is used again)."""
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "BlendDataset":
+        """Returns the dataset to use it as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Closes the file when exiting the context."""
+        self.close()
+
+    def get_catalogs(self, start: int, stop: int) -> List[Table]:
+        """Returns the catalogs of blends `start` to `stop`."""
+        group = self._group
+        if "catalog" in group:
+            return read_catalog_columns(group["catalog"], start, stop)
+        return [read_table_hdf5(group, path=f"catalog_list/{ii}") for ii in range(start, stop)]
+
+    def get_isolated_images(self, start: int, stop: int) -> Union[np.ndarray, SparseIsolatedImages]:
+        """Returns the isolated images of blends `start` to `stop` (sparse if saved as such)."""
+        isolated_images = self._group["isolated_images"]
+        if not isinstance(isolated_images, h5py.Group):
+            return isolated_images[start:stop]
+        blend_offsets = isolated_images["blend_offsets"][start : stop + 1]
+        first, last = blend_offsets[0], blend_offsets[-1]
+        offsets = isolated_images["offsets"][first : last + 1]
+        return SparseIsolatedImages(
+            (stop - start, *isolated_images.attrs["shape"][1:]),
+            isolated_images["data"][offsets[0] : offsets[-1]],
+            offsets - offsets[0],
+            isolated_images["bboxes"][first:last],
+            isolated_images["sources"][first:last],
+            blend_offsets - first,
+        )
+
+    def get_psf(self, index: int) -> np.ndarray:
+        """Returns the PSF images (one per band) of the blend `index`."""
+        group = self._group
+        if "psf_index" in group:
+            return group["psf"][index]
+        if "batch_offsets" not in group:
+            return group["psf"][:]
+        batch = np.searchsorted(group["batch_offsets"][:], index, side="right") - 1
+        return group["psf"][batch]
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[dict, BlendBatch]:
+        """Returns a single blend as a dictionary or several blends as a `BlendBatch`."""
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                raise ValueError("Only contiguous slices of the dataset are supported.")
+            return self.get_batch(start, max(start, stop))
+        index = range(len(self))[item]
+        return {
+            "blend_images": self._group["blend_images"][index],
+            "isolated_images": np.asarray(self.get_isolated_images(index, index + 1))[0],
+            "psf": self.get_psf(index),
+            "catalog": self.get_catalogs(index, index + 1)[0],
+        }
+
+    def get_batch(self, start: int, stop: int) -> BlendBatch:
+        """Returns blends `start` to `stop` as a `BlendBatch`."""
+        group = self._group
+        if "psf_index" in group:
+            psf_index = group["psf_index"][start:stop]
+            psf_array = group["psf"][start:stop].swapaxes(0, 1)
+            psf = [[galsim.Image(p) for p in band_psf] for band_psf in psf_array]
+        else:
+            psf_index = None
+            psf = [galsim.Image(p) for p in self.get_psf(start)]
+        return BlendBatch(
+            batch_size=stop - start,
+            max_n_sources=group.attrs["max_n_sources"],
+            stamp_size=group.attrs["stamp_size"],
+            survey=self.survey,
+            blend_images=group["blend_images"][start:stop],
+            isolated_images=self.get_isolated_images(start, stop),
+            catalog_list=self.get_catalogs(start, stop),
+            psf=psf,
+            psf_index=psf_index,
+        )
+
+    def __iter__(self) -> Iterator[dict]:
+        """Iterates over the blends of the dataset."""
+        for index in range(len(self)):
+            yield self[index]
+
+
+def merge_datasets(
+    paths: Sequence[str], output_path: str, interleave: bool = True, **writer_kwargs
+):
+    """Merges several datasets written with `DatasetWriter` into a single dataset.
+
+    The datasets are copied batch by batch, so they do not need to fit in memory.
+
+    Args:
+        paths: Paths of the datasets to merge, e.g. the outputs of each shard of a
+            `DrawBlendsGenerator` (see `DrawBlendsGenerator.shard`) in order of shard index.
+        output_path: Path of the merged dataset.
+        interleave: If True, batches are taken in turn from each dataset (first batch of each
+            dataset, then second batch of each dataset, etc.), which recovers the order of a
+            single run for shards. Otherwise, datasets are concatenated.
+        writer_kwargs: Additional arguments of the `DatasetWriter` of the merged dataset
+            (e.g. compression).
+    """
+    with BlendDataset(paths[0]) as blend_dataset:
+        survey_names = blend_dataset.surveys
+    with contextlib.ExitStack() as stack:
+        datasets = {
+            name: [stack.enter_context(BlendDataset(path, name)) for path in paths]
+            for name in survey_names
+        }
+        batch_bounds = []
+        for blend_dataset in datasets[survey_names[0]]:
+            offsets = blend_dataset._group["batch_offsets"][:]
+            batch_bounds.append(np.stack([offsets[:-1], offsets[1:]], axis=1))
+        if interleave:
+            order = [
+                (ii, bounds[jj])
+                for jj in range(max(len(bounds) for bounds in batch_bounds))
+                for ii, bounds in enumerate(batch_bounds)
+                if jj < len(bounds)
+            ]
+        else:
+            order = [(ii, bound) for ii, bounds in enumerate(batch_bounds) for bound in bounds]
+
+        with DatasetWriter(output_path, **writer_kwargs) as writer:
+            for ii, (start, stop) in order:
+                batch_list = [datasets[name][ii].get_batch(start, stop) for name in survey_names]
+                if len(batch_list) == 1:
+                    writer.write(batch_list[0])
+                else:
+                    writer.write(MultiResolutionBlendBatch(batch_list))
@@ -21,7 +21,7 @@ from btk.blend_batch import (
     MultiResolutionBlendBatch,
 )
 from btk.draw_blends import DrawBlendsGenerator
-from btk.multiprocess import multiprocess
+from btk.multiprocess import WorkerPool, multiprocess
 
 
 class Deblender(ABC):
@@ -38,13 +38,20 @@ class Deblender(ABC):
         """
         self.max_n_sources = max_n_sources
 
-    def __call__(self, blend_batch: BlendBatch, njobs: int = 1, **kwargs) -> DeblendBatch:
+    def __call__(
+        self,
+        blend_batch: BlendBatch,
+        njobs: int = 1,
+        pool: Optional[WorkerPool] = None,
+        **kwargs,
+    ) -> DeblendBatch:
         """Calls the (user-implemented) `deblend` method along with validation of the input.
 
         Args:
             ii: The index of the example in the batch.
             blend_batch: Instance of `BlendBatch` class.
             njobs: Number of processes to use.
+            pool: Long-lived `WorkerPool` to use instead of creating new processes.
             kwargs: Additional arguments to pass to deblender call.
 
         Returns:
@@ -54,7 +61,7 @@ class Deblender(ABC):
             raise TypeError(
                 f"Got type '{type(blend_batch)}', but expected an object of a BlendBatch class."
             )
-        return self.batch_call(blend_batch, njobs, **kwargs)
+        return self.batch_call(blend_batch, njobs, pool=pool, **kwargs)
 
     @abstractmethod
     def deblend(self, ii: int, blend_batch: BlendBatch) -> DeblendExample:
@@ -70,7 +77,13 @@ class Deblender(ABC):
             Instance of `DeblendedExample` class
         """
 
-    def batch_call(self, blend_batch: BlendBatch, njobs: int = 1, **kwargs) -> DeblendBatch:
+    def batch_call(
+        self,
+        blend_batch: BlendBatch,
+        njobs: int = 1,
+        pool: Optional[WorkerPool] = None,
+        **kwargs,
+    ) -> DeblendBatch:
         """Implements the call of the deblender on the entire batch.
 
         Overwrite this function if you perform measurments on the batch.
@@ -80,6 +93,8 @@ class Deblender(ABC):
         Args:
             blend_batch: Instance of `BlendBatch` class
             njobs: Number of jobs to paralelize across
+            pool: Long-lived `WorkerPool` to use instead of creating new processes. If provided,
+                `njobs` is ignored.
             kwargs: Additional keyword arguments to pass to each deblend call.
 
         Returns:
@@ -87,7 +102,7 @@ class Deblender(ABC):
         """
         args_iter = ((ii, blend_batch) for ii in range(blend_batch.batch_size))
         kwargs_iter = repeat(kwargs)
-        output = multiprocess(self.deblend, args_iter, kwargs_iter, njobs=njobs)
+        output = multiprocess(self.deblend, args_iter, kwargs_iter, njobs=njobs, pool=pool)
         catalog_list = [db_example.catalog for db_example in output]
         segmentation, deblended, extra_data = None, None, None
         n_bands = None
@@ -159,7 +174,12 @@ class MultiResolutionDeblender(ABC):
             Instance of `DeblendedExample` class
         """
 
-    def batch_call(self, mr_batch: MultiResolutionBlendBatch, njobs: int = 1) -> DeblendBatch:
+    def batch_call(
+        self,
+        mr_batch: MultiResolutionBlendBatch,
+        njobs: int = 1,
+        pool: Optional[WorkerPool] = None,
+    ) -> DeblendBatch:
         """Implements the call of the deblender on the entire batch.
 
         Overwrite this function if you perform measurments on a batch.
@@ -169,6 +189,7 @@ class MultiResolutionDeblender(ABC):
         Args:
             mr_batch: Instance of `MultiResolutionBlendBatch` class
             njobs: Number of njobs to paralelize across
+            pool: Long-lived `WorkerPool` to use instead of creating new processes.
 
         Returns:
             Instance of `DeblendedBatch` class
@@ -764,7 +785,9 @@ class DeepDisc(Deblender):
             extra_segs = segmentation[(self.max_n_sources-segmentation.shape[0]):] # get the rest of the segmentation maps
             extra_dict = {'segs': extra_segs} # add to extra_dict
 
-            deblended_images = np.zeros((segmentation.shape[0], img.shape[2],img.shape[0],img.shape[1]))
+            deblended_images = np.zeros(
+                (segmentation.shape[0], img.shape[2], img.shape[0], img.shape[1]), dtype=img.dtype
+            )
             rimg = np.transpose(img,(2,0,1))
             for i in range(segmentation.shape[0]):
                 deblended_images[i] = rimg * segmentation[i].astype(img.dtype) # cuts out source from image using segmentation mask
@@ -774,7 +797,9 @@ class DeepDisc(Deblender):
         else:
             segs = np.zeros((self.max_n_sources, img.shape[0], img.shape[1]),dtype=segmentation.dtype)
             segs[:segmentation.shape[0]] = segmentation
-            deblended_images = np.zeros((self.max_n_sources, img.shape[2],img.shape[0],img.shape[1]))
+            deblended_images = np.zeros(
+                (self.max_n_sources, img.shape[2], img.shape[0], img.shape[1]), dtype=img.dtype
+            )
             rimg = np.transpose(img,(2,0,1))
             for i in range(segmentation.shape[0]):
                 deblended_images[i] = rimg * segmentation[i].astype(img.dtype) # cuts out source from image using segmentation mask
@@ -860,7 +885,7 @@ class Scarlet(Deblender):
         image = blend_batch.blend_images[ii]
         n_bands = image.shape[0]
 
-        psf = blend_batch.get_numpy_psf()
+        psf = blend_batch.get_numpy_psf(ii)
         wcs = blend_batch.wcs
         survey = blend_batch.survey
         bands = survey.available_filters
@@ -871,7 +896,9 @@ class Scarlet(Deblender):
             t = Table()
             t["ra"] = []
             t["dec"] = []
-            deblended_images = np.zeros((self.max_n_sources, n_bands, img_size, img_size))
+            deblended_images = np.zeros(
+                (self.max_n_sources, n_bands, img_size, img_size), dtype=image.dtype
+            )
             return DeblendExample(self.max_n_sources, t, n_bands, img_size, None, deblended_images)
 
         # get background
@@ -914,7 +941,9 @@ class Scarlet(Deblender):
                 model_ = observations.render(model)
                 individual_sources.append(model_)
             selected_peaks = np.array(selected_peaks)
-            deblended_images = np.zeros((self.max_n_sources, n_bands, img_size, img_size))
+            deblended_images = np.zeros(
+                (self.max_n_sources, n_bands, img_size, img_size), dtype=image.dtype
+            )
             deblended_images[: len(individual_sources)] = individual_sources
 
             assert len(selected_peaks) == len(catalog)
@@ -933,7 +962,9 @@ class Scarlet(Deblender):
             t = Table()
             t["ra"] = []
             t["dec"] = []
-            deblended_images = np.zeros((self.max_n_sources, n_bands, img_size, img_size))
+            deblended_images = np.zeros(
+                (self.max_n_sources, n_bands, img_size, img_size), dtype=image.dtype
+            )
             return DeblendExample(self.max_n_sources, t, n_bands, img_size, None, deblended_images)
 
 
@@ -946,6 +977,7 @@ class DeblendGenerator:
         draw_blend_generator: DrawBlendsGenerator,
         njobs: int = 1,
         verbose: bool = False,
+        pool: Optional[WorkerPool] = None,
     ):
         """Initialize deblender generator.
 
@@ -955,6 +987,9 @@ class DeblendGenerator:
             draw_blend_generator: Instance of subclasses of `DrawBlendsGenerator`.
             njobs: The number of parallel processes to run [Default: 1].
             verbose: Whether to print information about deblending.
+            pool: `WorkerPool` used to run the deblenders in parallel, which can be shared
+                            with the `draw_blend_generator`. If None and `njobs > 1`, a pool
+                            owned by this generator is created and terminated by `close`.
         """
         self.deblenders = self._validate_deblenders(deblenders)
         self.deblender_names = self._get_unique_deblender_names()
@@ -964,6 +999,22 @@ class DeblendGenerator:
         self.batch_size = self.draw_blend_generator.batch_size
         self.verbose = verbose
 
+        self._owns_pool = pool is None
+        self.pool = WorkerPool(njobs) if pool is None and njobs > 1 else pool
+
+    def close(self):
+        """Stops the worker processes of the generator's pool, if it was created by it."""
+        if self._owns_pool and self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self):
+        """Returns the generator itself when used as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Closes the generator's pool when exiting the context manager."""
+        self.close()
+
     def __iter__(self):
         """Return iterator which is the object itself."""
         return self
@@ -1015,7 +1066,7 @@ class DeblendGenerator:
         """
         blend_batch = next(self.draw_blend_generator)
         deblended_output = {
-            name: deblender.batch_call(blend_batch, njobs=self.njobs)
+            name: deblender.batch_call(blend_batch, njobs=self.njobs, pool=self.pool)
             for name, deblender in zip(self.deblender_names, self.deblenders)
         }
         return blend_batch, deblended_output
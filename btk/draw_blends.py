@@ -1,9 +1,11 @@
 """Module for generating batches of drawn blended images."""
 
 import copy
+import weakref
 from abc import ABC, abstractmethod
 from itertools import chain
-from typing import List, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from uuid import uuid4
 
 import galsim
 import numpy as np
@@ -12,15 +14,25 @@ from astropy.wcs import WCS
 from surveycodex.utilities import mag2counts, mean_sky_level
 from tqdm.auto import tqdm
 
-from btk.blend_batch import BlendBatch, MultiResolutionBlendBatch
+from btk.blend_batch import BlendBatch, MultiResolutionBlendBatch, SparseIsolatedImages
 from btk.blend_generator import BlendGenerator
-from btk.catalog import Catalog, CosmosCatalog
-from btk.multiprocess import get_current_process, multiprocess
+from btk.cache import LRUCache, estimate_nbytes, get_process_cache, release_process_cache
+from btk.catalog import Catalog, CosmosCatalog, get_process_galsim_catalog
+from btk.multiprocess import (
+    BACKENDS,
+    Prefetcher,
+    SharedArray,
+    WorkerPool,
+    get_current_process,
+    multiprocess,
+)
 from btk.sampling_functions import SamplingFunction
-from btk.survey import Filter, Survey, make_wcs
+from btk.survey import Filter, PSFLibrary, Survey, make_wcs
 from btk.utils import DEFAULT_SEED
 
 MAX_SEED_INT = 1_000_000_000
+# spawn key of the seeds of PSF library indices, distinct from the keys of spawned seeds.
+_PSF_SPAWN_KEY = 2**32 - 1
 
 
 class SourceNotVisible(Exception):
@@ -45,6 +57,123 @@ def _get_center_in_pixels(blend_table: Table, wcs: WCS):
     return dx_col, dy_col
 
 
+def draw_on_stamp(
+    gal_conv: galsim.GSObject,
+    ra: float,
+    dec: float,
+    slen: int,
+    pixel_scale: float,
+    use_substamp: bool = False,
+) -> galsim.Image:
+    """Draws a PSF-convolved profile shifted by (ra, dec) from the center of the postage stamp.
+
+    By default the profile is drawn on the full `slen x slen` postage stamp. If `use_substamp`
+    is True, the profile is only drawn inside a sub-stamp centered on the object, whose size
+    is given by `galsim.GSObject.getGoodImageSize` (clipped to the postage stamp). The returned
+    image then has the bounds of the sub-stamp within the postage stamp, which should be used
+    to place it in the full stamp.
+
+    Pixels inside the sub-stamp are identical (up to floating point precision) to the ones
+    obtained from drawing on the full stamp. Only the flux that falls outside the sub-stamp
+    is dropped, which is at most of order `gal_conv.gsparams.folding_threshold` (0.5% by
+    default) of the total flux of the object.
+
+    Args:
+        gal_conv: Galsim profile already convolved with the PSF, centered at the origin.
+        ra: Shift of the object from the center of the stamp along the x axis (arcsec).
+        dec: Shift of the object from the center of the stamp along the y axis (arcsec).
+        slen: Size of the postage stamp in pixels.
+        pixel_scale: Pixel scale of the survey (arcsec / pixel).
+        use_substamp: Whether to only draw the object in a sub-stamp around its center.
+
+    Returns:
+        galsim.Image with bounds contained in the bounds of the postage stamp.
+    """
+    if not use_substamp:
+        return gal_conv.shift(ra, dec).drawImage(nx=slen, ny=slen, scale=pixel_scale)
+
+    full_bounds = galsim.BoundsI(1, slen, 1, slen)
+    size = min(gal_conv.getGoodImageSize(pixel_scale), slen)
+    center = full_bounds.true_center
+    x = int(np.floor(center.x + ra / pixel_scale + 0.5))
+    y = int(np.floor(center.y + dec / pixel_scale + 0.5))
+    bounds = (
+        galsim.BoundsI(x - size // 2, x + size // 2 - 1, y - size // 2, y + size // 2 - 1)
+        & full_bounds
+    )
+    if not bounds.isDefined():
+        # object is centered so far out of the stamp that none of its light falls in it.
+        bounds = galsim.BoundsI(1, 1, 1, 1)
+    image = galsim.Image(bounds, scale=pixel_scale, dtype=np.float64)
+    return gal_conv.shift(ra, dec).drawImage(image=image, center=center)
+
+
+def _add_to_stamp(stamp: np.ndarray, image: galsim.Image):
+    """Adds `image` into the numpy array `stamp` at the location given by the bounds of `image`."""
+    bounds = image.bounds
+    stamp[bounds.ymin - 1 : bounds.ymax, bounds.xmin - 1 : bounds.xmax] += image.array
+
+
+def convolve_galaxy(
+    get_galaxy: Callable[[], galsim.GSObject],
+    entry: Table,
+    psf: galsim.GSObject,
+    apply_shear: bool = False,
+    cache: Optional[LRUCache] = None,
+    key: Optional[tuple] = None,
+) -> galsim.GSObject:
+    """Returns the galaxy given by `get_galaxy()` rotated, sheared and convolved with the PSF.
+
+    If `cache` is provided, the convolved profile is looked up in it and `get_galaxy` is only
+    called on a miss. The cache key is made of `key` (which should identify the galaxy and its
+    flux, e.g. catalog index, band and survey), the PSF, and the transformations that cannot be
+    applied after the convolution. When no shear is applied and the PSF is axisymmetric,
+    rotating the convolved profile is equivalent to convolving the rotated galaxy, so the
+    rotation is applied after the lookup and the same cached profile is reused for any rotation.
+    Otherwise, the rotation and shear are part of the key.
+
+    Args:
+        get_galaxy: Function without arguments returning the galaxy profile, centered at the
+            origin and with its flux in the band being drawn.
+        entry: Catalog line of the galaxy, containing the `btk_rotation` column (in degrees) and
+            the `g1`, `g2` columns if `apply_shear` is True.
+        psf: PSF of the band being drawn.
+        apply_shear: Whether to apply the shear in `entry` to the galaxy.
+        cache: Optional cache of PSF-convolved profiles.
+        key: Key identifying the galaxy in the cache, required if `cache` is provided.
+
+    Returns:
+        galsim.GSObject: PSF-convolved profile, centered at the origin.
+    """
+    rotation = entry["btk_rotation"]
+    shear = None
+    if apply_shear:
+        if "g1" in entry.keys() and "g2" in entry.keys():
+            shear = (float(entry["g1"]), float(entry["g2"]))
+        else:
+            raise KeyError("g1 and g2 not found in blend list.")
+    rotate_after = cache is not None and shear is None and psf.is_axisymmetric
+
+    def _convolve():
+        gal = get_galaxy()
+        if not rotate_after:
+            gal = gal.rotate(galsim.Angle(rotation, unit=galsim.degrees))
+        if shear is not None:
+            gal = gal.shear(g1=shear[0], g2=shear[1])
+        return galsim.Convolve(gal, psf)
+
+    if cache is None:
+        return _convolve()
+
+    transform = (None if rotate_after else float(rotation), shear)
+    gal_conv = cache.get_or_compute(
+        (*key, psf, transform), _convolve, lambda value: estimate_nbytes(value, exclude=[psf])
+    )
+    if rotate_after and rotation != 0:
+        gal_conv = gal_conv.rotate(galsim.Angle(rotation, unit=galsim.degrees))
+    return gal_conv
+
+
 def render_single_catsim_galaxy(
     entry: Table,
     filt: Filter,
@@ -52,18 +181,28 @@ def render_single_catsim_galaxy(
     psf: galsim.GSObject,
     slen: int,
     apply_shear: bool = False,
+    use_substamp: bool = False,
+    cache: Optional[LRUCache] = None,
 ):
-    """Render an image of a single galsim galaxy from a CATSIM entry."""
-    gal = get_catsim_galaxy(entry, filt, survey)
-    gal = gal.rotate(galsim.Angle(entry["btk_rotation"], unit=galsim.degrees))
-    if apply_shear:
-        if "g1" in entry.keys() and "g2" in entry.keys():
-            gal = gal.shear(g1=entry["g1"], g2=entry["g2"])
-        else:
-            raise KeyError("g1 and g2 not found in blend list.")
-    gal_conv = galsim.Convolve(gal, psf)
-    gal_conv = gal_conv.shift(entry["ra"], entry["dec"])
-    return gal_conv.drawImage(nx=slen, ny=slen, scale=survey.pixel_scale.to_value("arcsec"))
+    """Render an image of a single galsim galaxy from a CATSIM entry.
+
+    If the entry contains the profile parameters precomputed by `get_catsim_params`, they are
+    used directly instead of being recomputed from the CATSIM columns. If `cache` is provided
+    and the entry has a `btk_index` column, PSF-convolved profiles are reused across calls
+    (see `convolve_galaxy`).
+    """
+
+    def get_galaxy():
+        if f"disk_flux_{filt.name}" in entry.colnames:
+            return get_catsim_galaxy_from_params(entry, filt.name)
+        return get_catsim_galaxy(entry, filt, survey)
+
+    if "btk_index" not in entry.colnames:
+        cache = None
+    key = None if cache is None else (int(entry["btk_index"]), filt.name, survey.name)
+    gal_conv = convolve_galaxy(get_galaxy, entry, psf, apply_shear, cache, key)
+    pixel_scale = survey.pixel_scale.to_value("arcsec")
+    return draw_on_stamp(gal_conv, entry["ra"], entry["dec"], slen, pixel_scale, use_substamp)
 
 
 def get_catsim_galaxy(
@@ -131,13 +270,279 @@ def get_catsim_galaxy(
     return galsim.Add(components)
 
 
+def get_catsim_params(catalog: Union[Table, np.ndarray], survey: Survey) -> Dict[str, np.ndarray]:
+    """Computes the parameters of the galsim profiles of many CATSIM galaxies at once.
+
+    This is a vectorized version of the computations in `get_catsim_galaxy`, for all entries of
+    `catalog` and all bands of `survey`. The galsim profiles can then be built from the
+    resulting floats with `get_catsim_galaxy_from_params`. Galaxies with zero total flux in a
+    band, which are not visible, have all their component fluxes set to zero in that band.
+
+    Args:
+        catalog: Table or structured array with the CATSIM columns (see `get_catsim_galaxy`).
+        survey: BTK Survey object.
+
+    Returns:
+        Dictionary with the arrays of parameters. Shape parameters are named `disk_hlr`,
+        `disk_q`, `disk_beta` (and same for the bulge) with `beta` in degrees, and fluxes in
+        electrons are named `{component}_flux_{band}` for the disk, bulge and AGN components.
+    """
+    params = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for component, short in (("disk", "d"), ("bulge", "b")):
+            a, b = np.asarray(catalog[f"a_{short}"]), np.asarray(catalog[f"b_{short}"])
+            params[f"{component}_hlr"] = np.sqrt(a * b)
+            params[f"{component}_q"] = b / a
+            params[f"{component}_beta"] = np.asarray(catalog[f"pa_{component}"], dtype=float)
+
+        for band in survey.available_filters:
+            filt = survey.get_filter(band)
+            mags = np.asarray(catalog[f"{band}_ab"])
+            total_flux = mag2counts(mags, survey, filt).to_value("electron")
+            fluxnorms = {
+                component: np.asarray(catalog[f"fluxnorm_{component}_{band}"])
+                for component in ("disk", "bulge", "agn")
+            }
+            total_fluxnorm = fluxnorms["disk"] + fluxnorms["bulge"] + fluxnorms["agn"]
+            for component, fluxnorm in fluxnorms.items():
+                flux = fluxnorm / total_fluxnorm * total_flux
+                params[f"{component}_flux_{band}"] = np.nan_to_num(flux, nan=0.0)
+    return params
+
+
+def get_catsim_galaxy_from_params(entry: Table, band: str) -> galsim.GSObject:
+    """Returns a bulge/disk/agn Galsim galaxy profile from the precomputed parameters in entry.
+
+    Args:
+        entry: single astropy line containing the parameters returned by `get_catsim_params`.
+        band: Name of the band in which to draw the galaxy.
+
+    Returns:
+        galsim.GSObject: Galsim galaxy profile
+    """
+    disk_flux = entry[f"disk_flux_{band}"]
+    bulge_flux = entry[f"bulge_flux_{band}"]
+    agn_flux = entry[f"agn_flux_{band}"]
+    if disk_flux + bulge_flux + agn_flux == 0:
+        raise SourceNotVisible
+
+    components = []
+    if disk_flux > 0:
+        disk = galsim.Exponential(flux=disk_flux, half_light_radius=entry["disk_hlr"]).shear(
+            q=entry["disk_q"], beta=entry["disk_beta"] * galsim.degrees
+        )
+        components.append(disk)
+
+    if bulge_flux > 0:
+        bulge = galsim.DeVaucouleurs(flux=bulge_flux, half_light_radius=entry["bulge_hlr"]).shear(
+            q=entry["bulge_q"], beta=entry["bulge_beta"] * galsim.degrees
+        )
+        components.append(bulge)
+
+    if agn_flux > 0:
+        agn = galsim.Gaussian(flux=agn_flux, sigma=1e-8)
+        components.append(agn)
+
+    return galsim.Add(components)
+
+
+def add_batch_noise(
+    images: np.ndarray,
+    sky_levels: np.ndarray,
+    add_noise: str,
+    rng: np.random.Generator,
+    gaussian: bool = False,
+) -> np.ndarray:
+    """Adds noise to a whole batch of noiseless blend images at once with numpy.
+
+    The noise follows the same model as the galsim noise added in `DrawBlendsGenerator`: each
+    pixel is a Poisson realization of its (non-negative) expected number of electrons from the
+    galaxies ("galaxy") and/or from the sky ("background"), from which the sky level is then
+    subtracted. The `gaussian` option replaces the Poisson distribution with a Gaussian of the
+    same variance, which is accurate and faster when the number of counts is high.
+
+    Args:
+        images: Noiseless images in electrons, of shape `(batch_size, n_bands, H, W)`.
+            The noise is added in place.
+        sky_levels: Sky level (in electrons per pixel) of each band.
+        add_noise: Which noise to add, one of "all", "galaxy", "background" or "none".
+        rng: Numpy random generator used to draw the noise.
+        gaussian: Whether to use the Gaussian approximation of the Poisson noise.
+
+    Returns:
+        The noisy images (same array as `images`).
+    """
+    if add_noise == "none":
+        return images
+    variance = np.zeros(images.shape, dtype=images.dtype)
+    if add_noise in ("galaxy", "all"):
+        np.clip(images, 0, None, out=variance)
+    if add_noise in ("background", "all"):
+        variance += np.asarray(sky_levels, dtype=images.dtype)[None, :, None, None]
+    if gaussian:
+        noise = rng.standard_normal(images.shape, dtype=images.dtype)
+        noise *= np.sqrt(variance)
+    else:
+        noise = rng.poisson(variance).astype(images.dtype)
+        noise -= variance
+    images += noise
+    return images
+
+
+def _get_seedseq_state(seedseq: np.random.SeedSequence) -> dict:
+    """Returns the state of a `SeedSequence`, in a format which can be converted to JSON."""
+    return {
+        "entropy": seedseq.entropy,
+        "spawn_key": list(seedseq.spawn_key),
+        "pool_size": seedseq.pool_size,
+        "n_children_spawned": seedseq.n_children_spawned,
+    }
+
+
+def _make_seedseq(state: dict) -> np.random.SeedSequence:
+    """Creates a `SeedSequence` from the state returned by `_get_seedseq_state`."""
+    return np.random.SeedSequence(
+        state["entropy"],
+        spawn_key=tuple(state["spawn_key"]),
+        pool_size=state["pool_size"],
+        n_children_spawned=state["n_children_spawned"],
+    )
+
+
+def _release_process_caches(names: List[str]):
+    """Removes the caches with the given names from the current process."""
+    for name in names:
+        release_process_cache(name)
+
+
+def _without_psf_libraries(survey: Survey) -> Survey:
+    """Returns a shallow copy of the survey where PSF libraries of the filters are set to None.
+
+    The PSF of each blend is sent separately to the worker processes, so the libraries (with
+    all their images) do not need to be pickled along with the survey.
+    """
+    filters = dict(survey._filters)
+    for band, filt in filters.items():
+        if isinstance(getattr(filt, "psf", None), PSFLibrary):
+            filters[band] = copy.copy(filt)
+            filters[band].psf = None
+    if all(filt is survey._filters[band] for band, filt in filters.items()):
+        return survey
+    light_survey = copy.copy(survey)
+    light_survey._filters = filters  # pylint: disable=attribute-defined-outside-init
+    return light_survey
+
+
+def _get_render_specs(
+    catalog_list: List[Table], columns: Optional[List[str]] = None
+) -> List[np.ndarray]:
+    """Returns compact structured arrays with the columns of each blend needed for rendering.
+
+    Args:
+        catalog_list: List of blend tables.
+        columns: Names of the columns needed to render the blends. Columns missing from a blend
+            table are skipped. If None, all columns are kept.
+
+    Returns:
+        List of structured numpy arrays, one per blend.
+    """
+    specs = []
+    for blend in catalog_list:
+        names = blend.colnames if columns is None else [c for c in columns if c in blend.colnames]
+        specs.append(blend[names].as_array())
+    return specs
+
+
+def _render_mini_batch_from_specs(
+    draw_generator: "DrawBlendsGenerator",
+    specs: List[np.ndarray],
+    psf: Union[List[galsim.GSObject], List[List[galsim.GSObject]]],
+    wcs: WCS,
+    survey: Survey,
+    seedseq_minibatch: Union[np.random.SeedSequence, List[np.random.SeedSequence]],
+    out: Optional[Tuple[SharedArray, SharedArray, int]] = None,
+) -> list:
+    """Renders a mini-batch of blends from their render specs, this is what workers run.
+
+    The blend tables are rebuilt from the structured arrays `specs` (see `_get_render_specs`),
+    and rendered with `draw_generator._render_mini_batch`. Only the columns added during
+    rendering are returned for each blend (as structured arrays), which are then joined with
+    the original blend tables in the main process.
+
+    Args:
+        draw_generator: Generator used to render the blends. Its catalog is not sent to the
+            worker processes.
+        specs: Structured arrays with the columns needed to render each blend.
+        psf: See `DrawBlendsGenerator._render_mini_batch`.
+        wcs: See `DrawBlendsGenerator._render_mini_batch`.
+        survey: See `DrawBlendsGenerator._render_mini_batch`.
+        seedseq_minibatch: See `DrawBlendsGenerator._render_mini_batch`.
+        out: See `DrawBlendsGenerator._render_mini_batch`.
+
+    Returns:
+        Same as `DrawBlendsGenerator._render_mini_batch`, but with each catalog replaced by
+        a structured array containing only the new columns.
+    """
+    catalog_list = [Table(spec) for spec in specs]
+    results = draw_generator._render_mini_batch(
+        catalog_list, psf, wcs, survey, seedseq_minibatch, out
+    )
+    new_columns = []
+    for spec, blend in zip(specs, catalog_list):
+        names = [name for name in blend.colnames if name not in spec.dtype.names]
+        new_columns.append(blend[names].as_array())
+    if out is not None:
+        return new_columns
+    return [[*result[:2], columns] for result, columns in zip(results, new_columns)]
+
+
+def _get_catsim_render_columns(survey: Survey) -> List[str]:
+    """Returns names of the CATSIM columns used by `get_catsim_galaxy` to draw in a survey."""
+    columns = ["ra", "dec", "btk_index", "g1", "g2"]
+    columns += ["a_d", "b_d", "a_b", "b_b", "pa_disk", "pa_bulge"]
+    for band in survey.available_filters:
+        columns.append(f"{band}_ab")
+        columns += [f"fluxnorm_{component}_{band}" for component in ("disk", "bulge", "agn")]
+    return columns
+
+
+def _get_catsim_render_specs(catalog_list: List[Table], survey: Survey) -> List[np.ndarray]:
+    """Returns render specs containing the precomputed CATSIM parameters of each blend.
+
+    The parameters of all galaxies in the batch are computed at once with `get_catsim_params`,
+    and replace the raw CATSIM columns in the render specs.
+    """
+    specs = _get_render_specs(catalog_list, _get_catsim_render_columns(survey))
+    lengths = [len(spec) for spec in specs]
+    if sum(lengths) == 0:
+        return specs
+    batch = {
+        name: np.concatenate([spec[name] for spec in specs if len(spec) > 0])
+        for name in specs[0].dtype.names
+    }
+    columns = {
+        name: batch[name] for name in ("ra", "dec", "btk_index", "g1", "g2") if name in batch
+    }
+    columns.update(get_catsim_params(batch, survey))
+
+    batch_spec = np.empty(sum(lengths), dtype=[(name, col.dtype) for name, col in columns.items()])
+    for name, col in columns.items():
+        batch_spec[name] = col
+    return np.split(batch_spec, np.cumsum(lengths)[:-1])
+
+
 class DrawBlendsGenerator(ABC):
     """Class that generates images of blends and individual isolated objects in batches.
 
     Batch is divided into 'mini-batches' of size `batch_size//njobs` and
     each mini-batch analyzed separately. The results are then combined to output a
     dict with results of entire batch. If the number of njobs is greater than one, then each of
-    the mini-batches are run in parallel.
+    the mini-batches are run in parallel in a `WorkerPool` that is kept alive across batches.
+    Use `close` (or the generator as a context manager) to terminate the worker processes.
+
+    The PSF of each band is given by the `psf` attribute of the filters of the surveys. If it
+    is a `btk.survey.PSFLibrary`, each blend is drawn with a PSF of the library chosen at random
+    (see `BlendBatch.psf_index`).
     """
 
     compatible_catalogs = ("Catalog",)
@@ -155,6 +560,17 @@ class DrawBlendsGenerator(ABC):
         seed: int = DEFAULT_SEED,
         apply_shear: bool = False,
         augment_data: bool = False,
+        use_substamps: bool = False,
+        pool: Optional[WorkerPool] = None,
+        use_shared_memory: bool = False,
+        profile_cache_size: float = 0,
+        noise_engine: str = "galsim",
+        dtype: Union[str, np.dtype] = np.float64,
+        sparse_isolated_images: bool = False,
+        seeding: str = "minibatch",
+        scheduling: str = "static",
+        backend: str = "processes",
+        batch_sampling: bool = False,
     ):
         """Initializes the DrawBlendsGenerator class.
 
@@ -177,14 +593,87 @@ class DrawBlendsGenerator(ABC):
                             If set to True, sampling function must add 'g1', 'g2' columns.
             augment_data: If set to True, augment data by adding a random rotation to every
                             galaxy drawn. Rotation added is stored in the `btk_rotation` column.
+            use_substamps: If set to True, each galaxy is drawn in a sub-stamp around its
+                            center sized according to its profile and the PSF, instead of the
+                            full postage stamp. This is much faster for large stamps, and the
+                            images only differ by the (small) flux outside each sub-stamp.
+                            See `draw_on_stamp` for details. (Default: False)
+            pool: `WorkerPool` used to render the mini-batches in parallel. It can be shared
+                            with other generators and deblenders, and it is not closed by the
+                            generator. If None and `njobs > 1`, the generator creates its own pool
+                            which is terminated by `close`. (Default: None)
+            use_shared_memory: If set to True, blend and isolated images are written by the
+                            workers directly into arrays in shared memory preallocated for the
+                            whole batch, so that only the catalogs are sent back to the main
+                            process. Recommended for large `max_number` when `njobs > 1`.
+                            (Default: False)
+            profile_cache_size: Memory budget (in MB) of the least-recently-used cache of
+                            PSF-convolved galaxy profiles, keyed by catalog index, band and
+                            survey. Galaxies drawn again (e.g. in later batches) are then only
+                            shifted and rotated instead of being rebuilt. The cache is kept in
+                            each process rendering blends, so with `njobs > 1` each worker of
+                            the pool has its own cache (threads share the cache of the main
+                            process). The caches are released by `close`, when the generator is
+                            garbage collected, or for workers when their pool is closed (so a
+                            `pool` shared by several generators keeps the caches of all of
+                            them). Set to 0 to disable it. (Default: 0)
+            noise_engine: How the noise is generated. "galsim" adds galsim Poisson noise to
+                            each blend and band while rendering. "poisson" instead adds Poisson
+                            noise to the whole batch at once with numpy after rendering (see
+                            `add_batch_noise`), and "gaussian" uses the Gaussian approximation
+                            of the Poisson noise, which is faster and accurate for high counts.
+                            Noise realizations differ between engines, but the numpy engines
+                            give the same images for any `njobs`. (Default: "galsim")
+            dtype: Floating point type of the blend and isolated images, either `np.float64`
+                            or `np.float32`. Images are rendered, stored and saved with this
+                            type, and `np.float32` halves their memory. (Default: `np.float64`)
+            sparse_isolated_images: If set to True, the isolated images of each batch are
+                            stored as `SparseIsolatedImages`, i.e. only a cutout around each
+                            source, which uses much less memory than the dense array for large
+                            `max_number`. Best combined with `use_substamps=True`, since profiles
+                            drawn on the full stamp have non-zero pixels everywhere. Not
+                            compatible with `use_shared_memory`. (Default: False)
+            seeding: How the random seeds of each batch (for noise and data augmentation) are
+                            generated. With "minibatch", a seed is spawned for each mini-batch
+                            and shared by its blends, so the images depend on `njobs`. With
+                            "blend", a seed is spawned for each blend from its index in the
+                            batch, so the images are the same for any `njobs` (but differ from
+                            the ones of "minibatch"). (Default: "minibatch")
+            scheduling: How blends are split between processes when `njobs > 1`. With
+                            "static", the batch is split in `njobs` contiguous mini-batches.
+                            With "dynamic", it is split in smaller mini-batches (about 4 per
+                            process) which are sent to the processes as they become available,
+                            starting with the ones with the largest estimated cost (number of
+                            sources times stamp area). This balances the load when the number
+                            of sources per blend varies a lot (e.g. with `DensitySampling`).
+                            Requires `seeding="blend"` so that images do not depend on the
+                            scheduling. (Default: "static")
+            backend: Whether the mini-batches are rendered in "processes" or in "threads" of
+                            the main process when `njobs > 1` (see `btk.multiprocess`). Threads
+                            share the catalog and caches (e.g. `profile_cache`) instead of
+                            copying them in each worker, which bounds memory for large `njobs`,
+                            but only render in parallel while galsim and numpy release the
+                            GIL. Images are the same with both backends. Ignored if `pool` is
+                            provided, whose backend is used instead. (Default: "processes")
+            batch_sampling: Whether the blends of each batch are sampled with a single call to
+                            the `sample_batch` method of the sampling function, which is faster
+                            but gives different blends for a given seed than the default of one
+                            call per blend (see `BlendGenerator`). (Default: False)
         """
-        self.blend_generator = BlendGenerator(catalog, sampling_function, batch_size, verbose)
+        self.blend_generator = BlendGenerator(
+            catalog, sampling_function, batch_size, verbose, batch_sampling
+        )
         self.catalog = self.blend_generator.catalog
         self.njobs = njobs
         self.batch_size = self.blend_generator.batch_size
         self.max_number = self.blend_generator.max_number
         self.apply_shear = apply_shear
         self.augment_data = augment_data
+        self.use_substamps = use_substamps
+        self.use_shared_memory = use_shared_memory
+        self.sparse_isolated_images = sparse_isolated_images
+        if use_shared_memory and sparse_isolated_images:
+            raise ValueError("`use_shared_memory` and `sparse_isolated_images` are not compatible.")
         self.stamp_size = sampling_function.stamp_size
         self.use_bar = use_bar
         self._set_surveys(surveys)
@@ -195,8 +684,133 @@ class DrawBlendsGenerator(ABC):
                 f"The options for add_noise are {noise_options}, but you provided {add_noise}"
             )
         self.add_noise = add_noise
+        noise_engines = {"galsim", "poisson", "gaussian"}
+        if noise_engine not in noise_engines:
+            raise ValueError(
+                f"The options for noise_engine are {noise_engines}, but you provided {noise_engine}"
+            )
+        self.noise_engine = noise_engine
+        seeding_options = {"minibatch", "blend"}
+        if seeding not in seeding_options:
+            raise ValueError(
+                f"The options for seeding are {seeding_options}, but you provided {seeding}"
+            )
+        self.seeding = seeding
+        if scheduling not in {"static", "dynamic"}:
+            raise ValueError(
+                f"The options for scheduling are 'static' and 'dynamic', but you provided "
+                f"{scheduling}"
+            )
+        if scheduling == "dynamic" and seeding != "blend":
+            raise ValueError("`scheduling='dynamic'` requires `seeding='blend'`.")
+        self.scheduling = scheduling
+        if backend not in BACKENDS:
+            raise ValueError(f"The options for backend are {BACKENDS}, but you provided {backend}")
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError(f"dtype must be either float32 or float64, but you provided {dtype}")
         self.verbose = verbose
         self.seedseq = np.random.SeedSequence(seed)
+        if self.noise_engine != "galsim":
+            # separate from the mini-batch seeds, so the noise does not depend on `njobs`.
+            self.seedseq_noise = self.seedseq.spawn(1)[0]
+
+        self.shard_index = 0
+        self.shard_count = 1
+        self._batch_number = 0  # number of batches returned or skipped
+
+        self._owns_pool = pool is None
+        self.backend = backend if pool is None else pool.backend
+        self.pool = WorkerPool(njobs, backend) if pool is None and njobs > 1 else pool
+
+        self._psf_cache = {}  # survey name -> (PSF models of the filters, PSF list)
+        self.profile_cache_size = profile_cache_size
+        # shared by copies of the generator unpickled in the same worker process.
+        self._profile_cache_name = f"profiles-{uuid4().hex}"
+        # caches of the main process are released when the generator is closed or collected.
+        self._cache_names = [self._profile_cache_name]
+        self._finalizer = weakref.finalize(self, _release_process_caches, self._cache_names)
+
+    @property
+    def profile_cache(self) -> Optional[LRUCache]:
+        """Cache of PSF-convolved galaxy profiles of the current process (None if disabled).
+
+        Its `stats` attribute contains the number of hits and misses. When rendering with
+        `njobs > 1`, the caches (and statistics) of the worker processes are separate from the
+        one of the main process.
+        """
+        if self.profile_cache_size <= 0:
+            return None
+        return get_process_cache(self._profile_cache_name, self.profile_cache_size * 1e6)
+
+    def close(self):
+        """Closes the generator's pool, if it was created by it, and releases its caches.
+
+        The caches of the main process (e.g. `profile_cache`) are also released when the
+        generator is garbage collected. The caches of the worker processes are released along
+        with the processes, i.e. when the pool is closed.
+        """
+        if self._owns_pool and self.pool is not None:
+            self.pool.close()
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def prefetch(self, n_prefetch: int = 2) -> Prefetcher:
+        """Returns an iterator over batches which renders the next ones in the background.
+
+        The batches are the same as the ones returned by `next(draw_generator)`, in the same
+        order. The generator should not be used directly while it is being prefetched.
+
+        Args:
+            n_prefetch: Number of batches rendered in advance.
+
+        Returns:
+            `btk.multiprocess.Prefetcher` object, which should be closed after use.
+        """
+        return Prefetcher(self, n_prefetch)
+
+    def __enter__(self):
+        """Returns the generator itself when used as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Closes the generator's pool when exiting the context manager."""
+        self.close()
+
+    def __getstate__(self):
+        """Excludes the pool of workers and the catalog when sending the generator to workers.
+
+        Worker processes only need the rows of the catalog that are in each blend, which are
+        sent separately as render specs (see `_get_render_columns`). Similarly, PSF libraries
+        are removed from the surveys since only the PSF of each blend is sent to the workers.
+        """
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["blend_generator"] = None
+        state["catalog"] = None
+        state["_psf_cache"] = {}
+        state["_finalizer"] = None  # only the generator of the main process releases caches.
+        state["surveys"] = {
+            name: _without_psf_libraries(survey) for name, survey in self.surveys.items()
+        }
+        return state
+
+    def _get_render_columns(self, survey: Survey) -> Optional[List[str]]:
+        """Returns names of the catalog columns needed by `render_single` for a given survey.
+
+        Only these columns of each blend table are sent to the worker processes. The default
+        of None sends all of them, subclasses can override this method to reduce the amount
+        of data transferred.
+        """
+        return None
+
+    def _prepare_render_specs(self, catalog_list: List[Table], survey: Survey) -> List[np.ndarray]:
+        """Returns the render specs of each blend of the batch sent to the worker processes.
+
+        By default these are the columns given by `_get_render_columns`. Subclasses can
+        override this method to precompute quantities for the whole batch at once.
+        """
+        return _get_render_specs(catalog_list, self._get_render_columns(survey))
 
     def _get_pix_stamp_size(self, survey: Survey):
         """Returns the pixel stamp size for a given survey."""
@@ -235,6 +849,17 @@ class DrawBlendsGenerator(ABC):
         return self
 
     def _get_psf_from_survey(self, survey: Survey) -> List[galsim.GSObject]:
+        """Returns the PSF of each band of the survey for a new batch.
+
+        PSFs given as galsim objects are reused across batches until the filters of the survey
+        are assigned different ones, while PSFs given as functions are generated again for each
+        batch since they may vary (e.g. `get_psf_from_file`).
+        """
+        psf_models = [survey.get_filter(band).psf for band in survey.available_filters]
+        cached = self._psf_cache.get(survey.name)
+        if cached is not None and all(a is b for a, b in zip(cached[0], psf_models)):
+            return list(cached[1])
+
         # make PSF and WCS
         psf = []
         for band in survey.available_filters:
@@ -249,86 +874,257 @@ class DrawBlendsGenerator(ABC):
                         f"The generated PSF with the provided function"
                         f"for filter '{filt.name}' is not a galsim object"
                     )
-            elif isinstance(filt.psf, galsim.GSObject):
+            elif isinstance(filt.psf, (galsim.GSObject, PSFLibrary)):
                 psf.append(filt.psf)  # or directly retrieve the PSF
             else:
                 raise TypeError(
                     f"The PSF within filter '{filt.name}' is neither a "
-                    f"function nor a galsim object"
+                    f"function, a galsim object nor a PSF library"
                 )
+        if not any(callable(psf_model) for psf_model in psf_models):
+            self._psf_cache[survey.name] = (psf_models, list(psf))
         return psf
 
+    def _sample_psf_index(self, psf: list) -> Optional[np.ndarray]:
+        """Returns the index of the PSF of each blend if the PSFs are libraries, None otherwise.
+
+        Indices only depend on the seed and the number of the batch, so that they are the same
+        in all surveys whose libraries have the same size, and are not affected by `njobs`.
+        """
+        is_library = [isinstance(band_psf, PSFLibrary) for band_psf in psf]
+        if not any(is_library):
+            return None
+        if not all(is_library) or len({len(band_psf) for band_psf in psf}) > 1:
+            raise ValueError(
+                "The PSFs of all filters of a survey must be `PSFLibrary` objects of the same "
+                "size to draw blends with a PSF library."
+            )
+        seedseq = np.random.SeedSequence(
+            self.seedseq.entropy, spawn_key=(_PSF_SPAWN_KEY, self._batch_number)
+        )
+        return np.random.default_rng(seedseq).integers(len(psf[0]), size=self.batch_size)
+
     def __next__(self) -> Union[BlendBatch, MultiResolutionBlendBatch]:
         """Outputs dictionary containing blend output in batches.
 
         Returns:
             `BlendBatch` or `MultiResolutionBlendBatch` object
         """
+        while self._batch_number % self.shard_count != self.shard_index:
+            self._skip_batch()
         blend_cat = next(self.blend_generator)
+        self._batch_number += 1
+        blend_batch_list = [self._render_batch(blend_cat, surv) for surv in self.surveys.values()]
+
+        if len(blend_batch_list) == 1:
+            return blend_batch_list[0]
+
+        return MultiResolutionBlendBatch(blend_batch_list)
+
+    def shard(self, index: int, count: int) -> "DrawBlendsGenerator":
+        """Restricts the generator to one of `count` disjoint shards of its stream of batches.
+
+        Shard `index` returns the batches `index`, `index + count`, `index + 2 * count`, ... that
+        the generator would return without sharding. The other batches are skipped by only
+        sampling their blends and spawning their seeds, without rendering them. Hence, running
+        each shard (e.g. on a different node) with the same arguments and seed gives the same
+        batches as a single run, which can be combined with `btk.dataset.merge_datasets`.
+        Sampling functions and PSFs relying on global random states (e.g. `np.random`) are not
+        reproducible, with or without sharding.
+
+        Args:
+            index: Index of the shard, between 0 and `count - 1`.
+            count: Total number of shards.
+
+        Returns:
+            The generator itself, restricted to the shard.
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"Invalid shard {index} out of {count} shards.")
+        self.shard_index = index
+        self.shard_count = count
+        return self
+
+    def state_dict(self) -> dict:
+        """Returns the state of the generator, from which the next batches can be generated.
+
+        It contains the number of batches generated so far and the random states of the
+        sampling function and of the seeds of the generator, and can be converted to JSON.
+        Loading it with `load_state_dict` in a generator created with the same arguments
+        resumes generation at the next batch, with the same output as without interruption.
+        See also `btk.dataset.DatasetWriter`, which saves the state along with each batch.
+        """
+        state = {
+            "batch_number": self._batch_number,
+            "blend_generator": self.blend_generator.state_dict(),
+            "seedseq": _get_seedseq_state(self.seedseq),
+        }
+        if self.noise_engine != "galsim":
+            state["seedseq_noise"] = _get_seedseq_state(self.seedseq_noise)
+        return state
+
+    def load_state_dict(self, state: dict):
+        """Restores the state of the generator returned by `state_dict`."""
+        self._batch_number = state["batch_number"]
+        self.blend_generator.load_state_dict(state["blend_generator"])
+        self.seedseq = _make_seedseq(state["seedseq"])
+        if self.noise_engine != "galsim":
+            self.seedseq_noise = _make_seedseq(state["seedseq_noise"])
+
+    def _skip_batch(self):
+        """Advances the random states of the generator as if a batch was rendered."""
+        next(self.blend_generator)
+        self._batch_number += 1
+        for _ in self.surveys:
+            self._spawn_batch_seeds()
+
+    def _spawn_batch_seeds(
+        self,
+    ) -> Tuple[List[np.random.SeedSequence], Optional[np.random.SeedSequence]]:
+        """Returns the seeds of a batch and of its noise (numpy engines only).
+
+        The seeds of the batch are one per mini-batch, or one per blend if `seeding="blend"`.
+        In the latter case, the seed of the i-th blend is the i-th child of a single seed
+        spawned for the batch, independently of `njobs`.
+        """
+        if self.seeding == "blend":
+            seeds = self.seedseq.spawn(1)[0].spawn(self.batch_size)
+        else:
+            mini_batch_size = np.max([self.batch_size // self.njobs, 1])
+            seeds = self.seedseq.spawn(self.batch_size // mini_batch_size + 1)
+        seedseq_noise = None
+        if self.noise_engine != "galsim":
+            seedseq_noise = self.seedseq_noise.spawn(1)[0]
+        return seeds, seedseq_noise
+
+    def _render_batch(self, blend_cat: List[Table], surv: Survey) -> BlendBatch:
+        """Renders the blends of a batch in a single survey, see `__next__`."""
         mini_batch_size = np.max([self.batch_size // self.njobs, 1])
-        blend_batch_list = []
-        for surv in self.surveys.values():
-            slen = self._get_pix_stamp_size(surv)
-            psf = self._get_psf_from_survey(surv)  # psf is the same for all blends in batch.
-            wcs = make_wcs(surv.pixel_scale.to_value("arcsec"), (slen, slen))
+        if self.scheduling == "dynamic":
+            mini_batch_size = np.max([self.batch_size // (4 * self.njobs), 1])
+        slen = self._get_pix_stamp_size(surv)
+        psf = self._get_psf_from_survey(surv)  # psf is the same for all blends in batch.
+        psf_index = self._sample_psf_index(psf)  # unless PSF libraries are used.
+        wcs = make_wcs(surv.pixel_scale.to_value("arcsec"), (slen, slen))
+
+        n_bands = len(surv.available_filters)
+        image_shape = (n_bands, slen, slen)
+        seeds, seedseq_noise = self._spawn_batch_seeds()
+        specs = self._prepare_render_specs(blend_cat, surv)
+        worker_surv = _without_psf_libraries(surv)
+
+        costs = None
+        if self.scheduling == "dynamic":
+            # rendering time is roughly proportional to the number of sources and stamp area.
+            costs = [
+                sum(len(spec) for spec in specs[ii : ii + mini_batch_size]) * slen**2
+                for ii in range(0, self.batch_size, mini_batch_size)
+            ]
+
+        buffers = []
+        try:
+            if self.use_shared_memory:
+                # workers write images directly in the batch arrays, only catalogs are returned.
+                buffers.append(SharedArray((self.batch_size, *image_shape), self.dtype))
+                buffers.append(
+                    SharedArray((self.batch_size, self.max_number, *image_shape), self.dtype)
+                )
 
             input_args = []
-            seedseq_minibatch = self.seedseq.spawn(self.batch_size // mini_batch_size + 1)
-
             for ii in range(0, self.batch_size, mini_batch_size):
-                cat = copy.deepcopy(blend_cat[ii : ii + mini_batch_size])
-                input_args.append((cat, psf, wcs, surv, seedseq_minibatch[ii // mini_batch_size]))
+                spec = specs[ii : ii + mini_batch_size]
+                out = (*buffers, ii) if buffers else None
+                psf_minibatch = psf
+                if psf_index is not None:
+                    minibatch_index = psf_index[ii : ii + mini_batch_size]
+                    psf_minibatch = [[band_psf[kk] for band_psf in psf] for kk in minibatch_index]
+                if self.seeding == "blend":
+                    seedseq_minibatch = seeds[ii : ii + mini_batch_size]
+                else:
+                    seedseq_minibatch = seeds[ii // mini_batch_size]
+                input_args.append(
+                    (self, spec, psf_minibatch, wcs, worker_surv, seedseq_minibatch, out)
+                )
 
             # multiprocess and join results
             # ideally, each cpu processes a single mini_batch
             mini_batch_results = multiprocess(
-                self._render_mini_batch,
+                _render_mini_batch_from_specs,
                 input_args,
                 njobs=self.njobs,
                 verbose=self.verbose,
+                pool=self.pool,
+                costs=costs,
             )
 
             # join results across mini-batches.
             batch_results = list(chain(*mini_batch_results))
 
             # organize results.
-            n_bands = len(surv.available_filters)
-            image_shape = (n_bands, slen, slen)
-            blend_images = np.zeros((self.batch_size, *image_shape))
-            isolated_images = np.zeros((self.batch_size, self.max_number, *image_shape))
-            catalog_list = []
-            for ii in range(self.batch_size):
-                blend_images[ii] = batch_results[ii][0]
-                isolated_images[ii] = batch_results[ii][1]
-                catalog_list.append(batch_results[ii][2])
-                
-            print(isolated_images.min())
-
-            blend_batch = BlendBatch(
-                self.batch_size,
-                self.max_number,
-                self.stamp_size,
-                surv,
-                blend_images,
-                isolated_images,
-                catalog_list,
-                psf,
-            )
-
-            blend_batch_list.append(blend_batch)
-
-        if len(blend_batch_list) == 1:
-            return blend_batch_list[0]
+            if buffers:
+                blend_images = buffers[0].array.copy()
+                isolated_images = buffers[1].array.copy()
+                new_columns = batch_results
+            else:
+                blend_images, isolated_images = self._join_images(batch_results, image_shape)
+                new_columns = [result[2] for result in batch_results]
+        finally:
+            # also frees the shared memory if the buffers were allocated but rendering failed.
+            for buffer in buffers:
+                buffer.close()
+
+        if seedseq_noise is not None:
+            blend_images = self._add_noise_to_batch(blend_images, surv, seedseq_noise)
+
+        # add columns created during rendering to a copy of the blend tables.
+        catalog_list = []
+        for blend, columns in zip(blend_cat, new_columns):
+            catalog = blend.copy()
+            for name in columns.dtype.names:
+                catalog[name] = columns[name]
+            catalog_list.append(catalog)
+
+        if psf_index is not None:
+            psf = [[band_psf[kk] for kk in psf_index] for band_psf in psf]
+
+        return BlendBatch(
+            self.batch_size,
+            self.max_number,
+            self.stamp_size,
+            surv,
+            blend_images,
+            isolated_images,
+            catalog_list,
+            psf,
+            psf_index,
+        )
 
-        return MultiResolutionBlendBatch(blend_batch_list)
+    def _join_images(
+        self, batch_results: list, image_shape: Tuple[int, int, int]
+    ) -> Tuple[np.ndarray, Union[np.ndarray, SparseIsolatedImages]]:
+        """Joins the blend and isolated images of each blend of the batch into single arrays."""
+        blend_images = np.zeros((self.batch_size, *image_shape), dtype=self.dtype)
+        for ii, result in enumerate(batch_results):
+            blend_images[ii] = result[0]
+        if self.sparse_isolated_images:
+            isolated_images = SparseIsolatedImages.concatenate([r[1] for r in batch_results])
+            return blend_images, isolated_images
+
+        isolated_images = np.zeros(
+            (self.batch_size, self.max_number, *image_shape), dtype=self.dtype
+        )
+        for ii, result in enumerate(batch_results):
+            isolated_images[ii] = result[1]
+        return blend_images, isolated_images
 
     def _render_mini_batch(
         self,
         catalog_list: List[Table],
-        psf: List[galsim.GSObject],
+        psf: Union[List[galsim.GSObject], List[List[galsim.GSObject]]],
         wcs: WCS,
         survey: Survey,
-        seedseq_minibatch: np.random.SeedSequence,
+        seedseq_minibatch: Union[np.random.SeedSequence, List[np.random.SeedSequence]],
+        out: Optional[Tuple[SharedArray, SharedArray, int]] = None,
     ) -> list:
         """Returns isolated and blended images for blend catalogs in catalog_list.
 
@@ -341,15 +1137,30 @@ class DrawBlendsGenerator(ABC):
             catalog_list: List of catalogs with entries corresponding to one
                                blend. The size of this list is equal to the
                                mini_batch_size.
-            psf: List of Galsim objects containing the PSF
+            psf: List of Galsim objects containing the PSF, or list of such lists with the
+                PSF of each blend when using PSF libraries (see `PSFLibrary`).
             wcs: astropy WCS object
             survey: Dictionary containing survey information.
-            seedseq_minibatch: Numpy object for generating random seeds (for noise generation).
+            seedseq_minibatch: Numpy object for generating random seeds (for noise generation
+                and data augmentation), or list of such objects with one per blend.
+            out: Optional tuple `(blend_images, isolated_images, start)` containing the shared
+                arrays for the blend and isolated images of the whole batch, along with the
+                index of the first blend of this mini-batch in the batch. If provided, images
+                are written into these arrays instead of being returned.
 
         Returns:
             `numpy.ndarray` of blend images and isolated galaxy images, along with
-            list of blend catalogs.
+            list of blend catalogs. If `out` is provided, only the list of blend catalogs.
         """
+        try:
+            return self._render_blends(catalog_list, psf, wcs, survey, seedseq_minibatch, out)
+        finally:
+            if out is not None:
+                out[0].detach()
+                out[1].detach()
+
+    def _render_blends(self, catalog_list, psf, wcs, survey, seedseq_minibatch, out) -> list:
+        """Loops over blends of a mini-batch, see `_render_mini_batch` for details."""
         outputs = []
         index = 0
 
@@ -358,7 +1169,9 @@ class DrawBlendsGenerator(ABC):
         main_desc = f"Generating blends for {survey.name} survey"
         desc = main_desc if process_id == "main" else f"{main_desc} in process id {process_id}"
         disable = not self.use_bar or process_id != "main"
-        for blend in tqdm(catalog_list, total=len(catalog_list), desc=desc, disable=disable):
+        for kk, blend in enumerate(
+            tqdm(catalog_list, total=len(catalog_list), desc=desc, disable=disable)
+        ):
             # All bands in same survey have same pixel scale, WCS
             slen = self._get_pix_stamp_size(survey)
 
@@ -366,27 +1179,43 @@ class DrawBlendsGenerator(ABC):
             blend.add_column(x_peak)
             blend.add_column(y_peak)
 
+            # seeds are either shared by the mini-batch or specific to each blend.
+            if isinstance(seedseq_minibatch, list):
+                seedseq = seedseq_minibatch[kk]
+            else:
+                seedseq = seedseq_minibatch
+
+            # same for PSFs, which are specific to each blend with PSF libraries.
+            blend_psf = psf[kk] if isinstance(psf[0], list) else psf
+
             # add rotation, if requested
             if self.augment_data:
-                rng = np.random.default_rng(seedseq_minibatch.generate_state(1))
+                rng = np.random.default_rng(seedseq.generate_state(1))
                 theta = rng.uniform(0, 360, size=len(blend))
                 blend.add_column(Column(theta), name="btk_rotation")
             else:
                 blend.add_column(Column(np.zeros(len(blend))), name="btk_rotation")
 
             n_bands = len(survey.available_filters)
-            iso_image_multi = np.zeros((self.max_number, n_bands, slen, slen))
-            blend_image_multi = np.zeros((n_bands, slen, slen))
-            seedseq_blend = seedseq_minibatch.spawn(n_bands)
+            iso_image_multi = np.zeros((self.max_number, n_bands, slen, slen), dtype=self.dtype)
+            blend_image_multi = np.zeros((n_bands, slen, slen), dtype=self.dtype)
+            seedseq_blend = seedseq.spawn(n_bands)
             for jj, filter_name in enumerate(survey.available_filters):
                 filt = survey.get_filter(filter_name)
                 single_band_output = self.render_blend(
-                    blend, psf[jj], filt, survey, seedseq_blend[jj]
+                    blend, blend_psf[jj], filt, survey, seedseq_blend[jj]
                 )
                 blend_image_multi[jj, :, :] = single_band_output[0]
                 iso_image_multi[:, jj, :, :] = single_band_output[1]
 
-            outputs.append([blend_image_multi, iso_image_multi, blend])
+            if out is None:
+                if self.sparse_isolated_images:
+                    iso_image_multi = SparseIsolatedImages.from_dense(iso_image_multi[None])
+                outputs.append([blend_image_multi, iso_image_multi, blend])
+            else:
+                out[0].array[out[2] + kk] = blend_image_multi
+                out[1].array[out[2] + kk] = iso_image_multi
+                outputs.append(blend)
             index += len(blend)
         return outputs
 
@@ -421,22 +1250,48 @@ class DrawBlendsGenerator(ABC):
         Returns:
             Images of blend and isolated galaxies as `numpy.ndarray`.
         """
-        sky_level = mean_sky_level(survey, filt).to_value("electron")
         blend_catalog.add_column(
             Column(np.zeros(len(blend_catalog)), name="not_drawn_" + filt.name)
         )
         slen = int(self.stamp_size / survey.pixel_scale.to_value("arcsec"))
 
-        iso_image = np.zeros((self.max_number, slen, slen))
-        blend_image = galsim.Image(np.zeros((slen, slen)))
+        iso_image = np.zeros((self.max_number, slen, slen), dtype=self.dtype)
+        blend_image = galsim.Image(np.zeros((slen, slen), dtype=self.dtype))
 
         for ii, entry in enumerate(blend_catalog):
             single_image = self.render_single(entry, filt, psf, survey)
             if single_image is not None:
-                iso_image[ii] = single_image.array
-                blend_image += single_image
+                _add_to_stamp(iso_image[ii], single_image)
+                _add_to_stamp(blend_image.array, single_image)
+
+        if self.noise_engine == "galsim":
+            # otherwise, noise is added to the whole batch in `_add_noise_to_batch`.
+            blend_image = self._add_noise_to_image(blend_image, filt, survey, seedseq_blend)
+        return blend_image.array, iso_image
 
-        # add noise.
+    def _get_sky_level(self, filt: Filter, survey: Survey) -> float:
+        """Returns the mean sky level (in electrons per pixel) used for the background noise."""
+        return mean_sky_level(survey, filt).to_value("electron")
+
+    def _add_noise_to_image(
+        self,
+        blend_image: galsim.Image,
+        filt: Filter,
+        survey: Survey,
+        seedseq_blend: np.random.SeedSequence,
+    ) -> galsim.Image:
+        """Adds noise to the noiseless image of a blend in a single band, according to `add_noise`.
+
+        Args:
+            blend_image: Noiseless blend image, which might be modified in place.
+            filt: BTK Filter object
+            survey: BTK Survey object
+            seedseq_blend: Seed sequence for the noise generation.
+
+        Returns:
+            Image of the blend with noise.
+        """
+        slen = blend_image.array.shape[0]
         if self.add_noise in ("galaxy", "all"):
             if self.verbose:
                 print("Galaxy noise added to blend image")
@@ -446,21 +1301,112 @@ class DrawBlendsGenerator(ABC):
         if self.add_noise in ("background", "all"):
             if self.verbose:
                 print("Background noise added to blend image")
+            sky_level = self._get_sky_level(filt, survey)
             generator = galsim.random.BaseDeviate(seed=seedseq_blend.generate_state(1))
             background_noise = galsim.PoissonNoise(rng=generator, sky_level=sky_level)
-            noise_image = galsim.Image(np.zeros((slen, slen)))
+            noise_image = galsim.Image(np.zeros((slen, slen), dtype=blend_image.array.dtype))
             noise_image.addNoise(background_noise)
             blend_image += noise_image
+        return blend_image
+
+    def _add_noise_to_batch(
+        self, blend_images: np.ndarray, survey: Survey, seedseq: np.random.SeedSequence
+    ) -> np.ndarray:
+        """Adds noise to the noiseless blend images of a whole batch with the numpy engines.
+
+        Args:
+            blend_images: Noiseless blend images of shape `(batch_size, n_bands, H, W)`,
+                modified in place.
+            survey: BTK Survey object
+            seedseq: Seed sequence for the noise generation.
+
+        Returns:
+            Blend images with noise.
+        """
+        sky_levels = [
+            self._get_sky_level(survey.get_filter(band), survey)
+            for band in survey.available_filters
+        ]
+        rng = np.random.default_rng(seedseq)
+        gaussian = self.noise_engine == "gaussian"
+        return add_batch_noise(blend_images, sky_levels, self.add_noise, rng, gaussian)
+
+    def noise_realizations(
+        self,
+        blend_batch: Union[BlendBatch, MultiResolutionBlendBatch],
+        n_realizations: int,
+        seed: int = DEFAULT_SEED,
+    ) -> Iterator[Union[BlendBatch, MultiResolutionBlendBatch]]:
+        """Yields new noise realizations of a batch without drawing its galaxies again.
+
+        The noiseless blend images are obtained by summing the isolated images of `blend_batch`,
+        which should therefore have been produced by this generator (with any `add_noise`
+        option). Noise is then added as during the generation, using seeds spawned from a new
+        `SeedSequence(seed)`, so that the realizations are reproducible for a given seed and do
+        not affect the random state of the generator. Isolated images and catalogs are shared
+        with `blend_batch` rather than copied.
 
-        blend_image = blend_image.array
-        return blend_image, iso_image
+        Args:
+            blend_batch: Batch of blends produced by this generator.
+            n_realizations: Number of noise realizations to generate.
+            seed: Integer seed for the noise realizations. (Default: `DEFAULT_SEED`)
+
+        Returns:
+            Iterator over `n_realizations` batches of the same type as `blend_batch`.
+        """
+        is_multiresolution = isinstance(blend_batch, MultiResolutionBlendBatch)
+        batches = list(blend_batch.results.values()) if is_multiresolution else [blend_batch]
+        noiseless_images = [batch.isolated_images.sum(axis=1) for batch in batches]
+
+        for seedseq_realization in np.random.SeedSequence(seed).spawn(n_realizations):
+            new_batches = []
+            for batch, noiseless, seedseq_survey in zip(
+                batches, noiseless_images, seedseq_realization.spawn(len(batches))
+            ):
+                survey = batch.survey
+                if self.noise_engine != "galsim":
+                    blend_images = self._add_noise_to_batch(
+                        noiseless.copy(), survey, seedseq_survey
+                    )
+                    new_batches.append(self._replace_blend_images(batch, blend_images))
+                    continue
+                blend_images = np.empty_like(noiseless)
+                for ii, seedseq_blend in enumerate(seedseq_survey.spawn(batch.batch_size)):
+                    seedseq_bands = seedseq_blend.spawn(len(survey.available_filters))
+                    for jj, filter_name in enumerate(survey.available_filters):
+                        filt = survey.get_filter(filter_name)
+                        image = galsim.Image(noiseless[ii, jj].copy())
+                        image = self._add_noise_to_image(image, filt, survey, seedseq_bands[jj])
+                        blend_images[ii, jj] = image.array
+                new_batches.append(self._replace_blend_images(batch, blend_images))
+            yield MultiResolutionBlendBatch(new_batches) if is_multiresolution else new_batches[0]
+
+    @staticmethod
+    def _replace_blend_images(blend_batch: BlendBatch, blend_images: np.ndarray) -> BlendBatch:
+        """Returns a new batch with other blend images, sharing the rest of `blend_batch`."""
+        return BlendBatch(
+            blend_batch.batch_size,
+            blend_batch.max_n_sources,
+            blend_batch.stamp_size,
+            blend_batch.survey,
+            blend_images,
+            blend_batch.isolated_images,
+            blend_batch.catalog_list,
+            blend_batch.psf,
+            blend_batch.psf_index,
+        )
 
     @abstractmethod
     def render_single(self, entry: Table, filt: Filter, psf: galsim.GSObject, survey: Survey):
         """Renders single galaxy in single band in the location given by its entry.
 
+        This method might run in worker processes, where the `catalog` of the generator is not
+        available and `entry` only contains the columns returned by `_get_render_columns`.
+
         The image created must be in a stamp of size stamp_size / cutout.pixel_scale. The image
-        must be drawn according to information provided by filter, psf, and survey.
+        must be drawn according to information provided by filter, psf, and survey. If
+        `self.use_substamps` is True, the image can instead cover only part of the stamp, in which
+        case its bounds indicate where it is located in the stamp (see `draw_on_stamp`).
 
         Args:
             entry: Line from astropy describing the galaxy to draw
@@ -496,6 +1442,14 @@ class CatsimGenerator(DrawBlendsGenerator):
                     f"has no associated magnitude in the given catalog."
                 )
 
+    def _get_render_columns(self, survey: Survey) -> List[str]:
+        """Returns names of the catalog columns needed to render galaxies in the given survey."""
+        return _get_catsim_render_columns(survey)
+
+    def _prepare_render_specs(self, catalog_list: List[Table], survey: Survey) -> List[np.ndarray]:
+        """Returns render specs with the galaxy parameters precomputed for the whole batch."""
+        return _get_catsim_render_specs(catalog_list, survey)
+
     def render_single(self, entry: Catalog, filt: Filter, psf: galsim.GSObject, survey: Survey):
         """Returns the Galsim Image of an isolated galaxy."""
         if self.verbose:
@@ -503,7 +1457,16 @@ class CatsimGenerator(DrawBlendsGenerator):
 
         slen = self._get_pix_stamp_size(survey)
         try:
-            return render_single_catsim_galaxy(entry, filt, survey, psf, slen, self.apply_shear)
+            return render_single_catsim_galaxy(
+                entry,
+                filt,
+                survey,
+                psf,
+                slen,
+                self.apply_shear,
+                self.use_substamps,
+                self.profile_cache,
+            )
 
         except SourceNotVisible:
             if self.verbose:
@@ -538,6 +1501,17 @@ class CosmoDC2Generator(DrawBlendsGenerator):
         apply_shear: bool = False,
         augment_data: bool = False,
         gal_type: str = "real",
+        use_substamps: bool = False,
+        pool: Optional[WorkerPool] = None,
+        use_shared_memory: bool = False,
+        profile_cache_size: float = 0,
+        noise_engine: str = "galsim",
+        dtype: Union[str, np.dtype] = np.float64,
+        sparse_isolated_images: bool = False,
+        seeding: str = "minibatch",
+        scheduling: str = "static",
+        backend: str = "processes",
+        batch_sampling: bool = False,
     ):
         """Initializes the CosmosGenerator class. See parent class for most attributes.
 
@@ -556,6 +1530,17 @@ class CosmoDC2Generator(DrawBlendsGenerator):
             augment_data: See parent class.
             gal_type: string to specify the type of galaxy simulations.
                             Either "real" (default) or "parametric".
+            use_substamps: See parent class.
+            pool: See parent class.
+            use_shared_memory: See parent class.
+            profile_cache_size: See parent class.
+            noise_engine: See parent class.
+            dtype: See parent class.
+            sparse_isolated_images: See parent class.
+            seeding: See parent class.
+            scheduling: See parent class.
+            backend: See parent class.
+            batch_sampling: See parent class.
         """
         super().__init__(
             catalog,
@@ -570,6 +1555,17 @@ class CosmoDC2Generator(DrawBlendsGenerator):
             seed,
             apply_shear,
             augment_data,
+            use_substamps=use_substamps,
+            pool=pool,
+            use_shared_memory=use_shared_memory,
+            profile_cache_size=profile_cache_size,
+            noise_engine=noise_engine,
+            dtype=dtype,
+            sparse_isolated_images=sparse_isolated_images,
+            seeding=seeding,
+            scheduling=scheduling,
+            backend=backend,
+            batch_sampling=batch_sampling,
         )
         
         self.sky_levels = sky_levels
@@ -587,8 +1583,16 @@ class CosmoDC2Generator(DrawBlendsGenerator):
                 raise ValueError(
                     f"The {band} filter of the survey {survey.name} "
                     f"has no associated magnitude in the given catalog."
-                )       
-                
+                )
+
+    def _get_render_columns(self, survey: Survey) -> List[str]:
+        """Returns names of the catalog columns needed to render galaxies in the given survey."""
+        return _get_catsim_render_columns(survey)
+
+    def _prepare_render_specs(self, catalog_list: List[Table], survey: Survey) -> List[np.ndarray]:
+        """Returns render specs with the galaxy parameters precomputed for the whole batch."""
+        return _get_catsim_render_specs(catalog_list, survey)
+
     def render_blend(
         self,
         blend_catalog: Table,
@@ -620,48 +1624,47 @@ class CosmoDC2Generator(DrawBlendsGenerator):
         Returns:
             Images of blend and isolated galaxies as `numpy.ndarray`.
         """
-        #sky_level = mean_sky_level(survey, filt).to_value("electron")
-        sky_level = self.sky_levels[filt.name]
-        
         blend_catalog.add_column(
             Column(np.zeros(len(blend_catalog)), name="not_drawn_" + filt.name)
         )
         pix_stamp_size = int(self.stamp_size / survey.pixel_scale.to_value("arcsec"))
-        iso_image = np.zeros((self.max_number, pix_stamp_size, pix_stamp_size))
-        _blend_image = galsim.Image(np.zeros((pix_stamp_size, pix_stamp_size)))
+        iso_image = np.zeros((self.max_number, pix_stamp_size, pix_stamp_size), dtype=self.dtype)
+        _blend_image = galsim.Image(np.zeros((pix_stamp_size, pix_stamp_size), dtype=self.dtype))
 
         for ii, entry in enumerate(blend_catalog):
             single_image = self.render_single(entry, filt, psf, survey)
-            if single_image is None:
-                iso_image[ii] = np.zeros(single_image)
-            else:
-                iso_image[ii] = single_image.array
-                _blend_image += single_image
+            if single_image is not None:
+                _add_to_stamp(iso_image[ii], single_image)
+                _add_to_stamp(_blend_image.array, single_image)
 
-                
-        
-                
-        # add noise.
-        if self.add_noise in ("galaxy", "all"):
-            if self.verbose:
-                print("Galaxy noise added to blend image")
-            generator = galsim.random.BaseDeviate(seed=seedseq_blend.generate_state(1))
-            galaxy_noise = galsim.PoissonNoise(rng=generator, sky_level=0.0)
-            _blend_image.addNoise(galaxy_noise)
-        if self.add_noise in ("background", "all"):
-            if self.verbose:
-                print("Background noise added to blend image")
-            generator = galsim.random.BaseDeviate(seed=seedseq_blend.generate_state(1))
-            background_noise = galsim.PoissonNoise(rng=generator, sky_level=sky_level)
-            noise_image = galsim.Image(np.zeros((pix_stamp_size, pix_stamp_size)))
-            noise_image.addNoise(background_noise)
-            _blend_image += noise_image
-            
-        #divide by exposure time
-        _blend_image = _blend_image / filt.full_exposure_time.value
+        blend_image = _blend_image
+        if self.noise_engine == "galsim":
+            blend_image = self._add_noise_to_image(_blend_image, filt, survey, seedseq_blend)
+        return blend_image.array, iso_image
 
-        blend_image = _blend_image.array
-        return blend_image, iso_image
+    def _get_sky_level(self, filt: Filter, survey: Survey) -> float:
+        """Returns the sky level of the band given at initialization."""
+        return self.sky_levels[filt.name]
+
+    def _add_noise_to_image(
+        self,
+        blend_image: galsim.Image,
+        filt: Filter,
+        survey: Survey,
+        seedseq_blend: np.random.SeedSequence,
+    ) -> galsim.Image:
+        """Adds noise as in the parent class, then divides the image by the exposure time."""
+        blend_image = super()._add_noise_to_image(blend_image, filt, survey, seedseq_blend)
+        return blend_image / filt.full_exposure_time.value
+
+    def _add_noise_to_batch(
+        self, blend_images: np.ndarray, survey: Survey, seedseq: np.random.SeedSequence
+    ) -> np.ndarray:
+        """Adds noise as in the parent class, then divides the images by the exposure time."""
+        blend_images = super()._add_noise_to_batch(blend_images, survey, seedseq)
+        for jj, band in enumerate(survey.available_filters):
+            blend_images[:, jj] /= survey.get_filter(band).full_exposure_time.value
+        return blend_images
 
     def render_single(self, entry: Catalog, filt: Filter, psf: galsim.GSObject, survey: Survey):
         """Returns the Galsim Image of an isolated galaxy."""
@@ -670,19 +1673,15 @@ class CosmoDC2Generator(DrawBlendsGenerator):
 
         slen = self._get_pix_stamp_size(survey)
         try:
-            gal = get_catsim_galaxy(entry, filt, survey)
-            gal = gal.rotate(galsim.Angle(entry["btk_rotation"], unit=galsim.degrees))
-            if self.apply_shear:
-                if "g1" in entry.keys() and "g2" in entry.keys():
-                    gal = gal.shear(g1=entry["g1"], g2=entry["g2"])
-                else:
-                    raise KeyError("g1 and g2 not found in blend list.")
-            gal_conv = galsim.Convolve(gal, psf)
-            gal_conv = gal_conv.shift(entry["ra"], entry["dec"])
-            return gal_conv.drawImage(  # pylint: disable=no-value-for-parameter
-                nx=slen,
-                ny=slen,
-                scale=survey.pixel_scale.to_value("arcsec"),
+            return render_single_catsim_galaxy(
+                entry,
+                filt,
+                survey,
+                psf,
+                slen,
+                self.apply_shear,
+                self.use_substamps,
+                self.profile_cache,
             )
 
         except SourceNotVisible:
@@ -714,6 +1713,18 @@ class CosmosGenerator(DrawBlendsGenerator):
         augment_data: bool = False,
         gal_type: str = "real",
         noise_pad_size: float = 0,
+        use_substamps: bool = False,
+        pool: Optional[WorkerPool] = None,
+        use_shared_memory: bool = False,
+        profile_cache_size: float = 0,
+        galaxy_cache_size: float = 0,
+        noise_engine: str = "galsim",
+        dtype: Union[str, np.dtype] = np.float64,
+        sparse_isolated_images: bool = False,
+        seeding: str = "minibatch",
+        scheduling: str = "static",
+        backend: str = "processes",
+        batch_sampling: bool = False,
     ):
         """Initializes the CosmosGenerator class. See parent class for most attributes.
 
@@ -737,6 +1748,24 @@ class CosmosGenerator(DrawBlendsGenerator):
                             add noise after the blend is produced according to the `sky_level`,
                             so the default for this argument is 0, as otherwise, noise would
                             be added to the image twice.
+            use_substamps: See parent class.
+            pool: See parent class.
+            use_shared_memory: See parent class.
+            profile_cache_size: See parent class.
+            galaxy_cache_size: Memory budget (in MB) of the least-recently-used cache of the
+                            galaxies returned by `COSMOSCatalog.makeGalaxy`, keyed by `btk_index`
+                            and `gal_type`. Each galaxy is then only loaded once and reused
+                            across bands and batches. As for `profile_cache_size`, each worker
+                            process has its own cache. The cache is not used when
+                            `noise_pad_size > 0`, since the padding noise would be frozen.
+                            Set to 0 to disable it. (Default: 0)
+            noise_engine: See parent class.
+            dtype: See parent class.
+            sparse_isolated_images: See parent class.
+            seeding: See parent class.
+            scheduling: See parent class.
+            backend: See parent class.
+            batch_sampling: See parent class.
         """
         super().__init__(
             catalog,
@@ -750,6 +1779,17 @@ class CosmosGenerator(DrawBlendsGenerator):
             seed,
             apply_shear,
             augment_data,
+            use_substamps=use_substamps,
+            pool=pool,
+            use_shared_memory=use_shared_memory,
+            profile_cache_size=profile_cache_size,
+            noise_engine=noise_engine,
+            dtype=dtype,
+            sparse_isolated_images=sparse_isolated_images,
+            seeding=seeding,
+            scheduling=scheduling,
+            backend=backend,
+            batch_sampling=batch_sampling,
         )
 
         if gal_type not in ("real", "parametric"):
@@ -758,6 +1798,59 @@ class CosmosGenerator(DrawBlendsGenerator):
             )
         self.gal_type = gal_type
         self.noise_pad_size = noise_pad_size
+        # kept separately since the catalog itself is not sent to worker processes, which load
+        # it from its files instead when possible (see `__getstate__`).
+        self._galsim_catalog = catalog.get_galsim_catalog()
+        self._galsim_catalog_args = getattr(catalog, "galsim_catalog_args", None)
+        self.galaxy_cache_size = galaxy_cache_size
+        self._galaxy_cache_name = f"galaxies-{uuid4().hex}"
+        self._cache_names.append(self._galaxy_cache_name)
+
+    @property
+    def galsim_catalog(self) -> galsim.COSMOSCatalog:
+        """The `galsim.COSMOSCatalog` from which galaxies are drawn.
+
+        In worker processes, it is loaded the first time it is used and then shared by all the
+        tasks of the process (see `btk.catalog.get_process_galsim_catalog`).
+        """
+        if self._galsim_catalog is None:
+            self._galsim_catalog = get_process_galsim_catalog(*self._galsim_catalog_args)
+        return self._galsim_catalog
+
+    def __getstate__(self):
+        """Also excludes the galsim catalog if workers can load it from its files."""
+        state = super().__getstate__()
+        if self._galsim_catalog_args is not None:
+            state["_galsim_catalog"] = None
+        return state
+
+    @property
+    def galaxy_cache(self) -> Optional[LRUCache]:
+        """Cache of COSMOS galaxies of the current process (None if disabled).
+
+        See `profile_cache` for details on the statistics of the cache.
+        """
+        if self.galaxy_cache_size <= 0 or self.noise_pad_size > 0:
+            return None
+        return get_process_cache(self._galaxy_cache_name, self.galaxy_cache_size * 1e6)
+
+    def make_galaxy(self, index: int) -> galsim.GSObject:
+        """Returns the galaxy of the COSMOS catalog with the given `btk_index`.
+
+        The galaxy is taken from `galaxy_cache` if enabled, and otherwise created with
+        `COSMOSCatalog.makeGalaxy`. Galsim profiles are immutable so the same object can safely
+        be reused, e.g. with a different flux in each band.
+        """
+
+        def _make_galaxy():
+            return self.galsim_catalog.makeGalaxy(
+                index, gal_type=self.gal_type, noise_pad_size=self.noise_pad_size
+            )
+
+        cache = self.galaxy_cache
+        if cache is None:
+            return _make_galaxy()
+        return cache.get_or_compute((int(index), self.gal_type), _make_galaxy)
 
     def _check_compatibility(self, survey: Survey) -> None:
         if type(self.catalog).__name__ not in self.compatible_catalogs:
@@ -766,10 +1859,13 @@ class CosmosGenerator(DrawBlendsGenerator):
                 f"catalogs available for the {type(self).__name__} are {self.compatible_catalogs}"
             )
 
+    def _get_render_columns(self, survey: Survey) -> List[str]:
+        """Returns names of the catalog columns needed to render galaxies in the given survey."""
+        columns = ["ra", "dec", "btk_index", "MAG", "g1", "g2"]
+        return columns + [f"{survey.name}_{band}" for band in survey.available_filters]
+
     def render_single(self, entry: Table, filt: Filter, psf: galsim.GSObject, survey: Survey):
         """Returns the Galsim Image of an isolated galaxy."""
-        galsim_catalog: galsim.COSMOSCatalog = self.catalog.get_galsim_catalog()
-
         # we optionally check if additional entres if of the form `f'{survey_name}_{filter_name}`
         # were added to the catalog in which case we use that (assuming it's an AB magnitude).
         # otherwise we simply use the COSMOS magnitudes which AB magnitudes so we can apply
@@ -782,22 +1878,15 @@ class CosmosGenerator(DrawBlendsGenerator):
         gal_flux = mag2counts(gal_mag, survey, filt).to_value("electron")
 
         index = entry["btk_index"]
-        gal = galsim_catalog.makeGalaxy(
-            index, gal_type=self.gal_type, noise_pad_size=self.noise_pad_size
-        )
-        gal = gal.withFlux(gal_flux)
-        gal = gal.rotate(galsim.Angle(entry["btk_rotation"], unit=galsim.degrees))
-        if self.apply_shear:
-            if "g1" in entry.keys() and "g2" in entry.keys():
-                gal = gal.shear(g1=entry["g1"], g2=entry["g2"])
-            else:
-                raise KeyError("g1 and g2 not found in blend list.")
-        slen = self._get_pix_stamp_size(survey)
-        gal_conv = galsim.Convolve(gal, psf)
-        gal_conv = gal_conv.shift(entry["ra"], entry["dec"])
 
-        return gal_conv.drawImage(  # pylint: disable=no-value-for-parameter
-            nx=slen,
-            ny=slen,
-            scale=survey.pixel_scale.to_value("arcsec"),
+        def get_galaxy():
+            return self.make_galaxy(index).withFlux(gal_flux)
+
+        cache = self.profile_cache
+        key = (int(index), filt.name, survey.name)
+        gal_conv = convolve_galaxy(get_galaxy, entry, psf, self.apply_shear, cache, key)
+        slen = self._get_pix_stamp_size(survey)
+        pixel_scale = survey.pixel_scale.to_value("arcsec")
+        return draw_on_stamp(
+            gal_conv, entry["ra"], entry["dec"], slen, pixel_scale, self.use_substamps
         )
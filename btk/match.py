@@ -65,7 +65,7 @@ class Matching:
         new_arrs = []
         for arr in arrs:
             assert len(arr) == self.batch_size
-            new_arr = np.zeros((self.batch_size, self.max_n_sources, *arr.shape[2:]))
+            new_arr = np.zeros((self.batch_size, self.max_n_sources, *arr.shape[2:]), arr.dtype)
             for ii in range(self.batch_size):
                 for jj, m in enumerate(matches[ii]):
                     new_arr[ii, jj] = arr[ii, m]
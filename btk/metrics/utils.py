@@ -11,12 +11,14 @@ def get_segmentation(isolated_images: np.ndarray, sky_level: float, sigma_noise:
 
     Args:
         isolated_images: Images of isolated galaxies. Shape only be in a single band.
+            Can also be a `SparseIsolatedImages` object.
         sky_level: Background level of all images. Images are assume to not be
             background-substracted.
         sigma_noise: Sigma level at which an pixel is considered to be noise. Should match
             the argument in SEP if that is being used to compuate the segmentation
             for deblending.
     """
+    isolated_images = np.asarray(isolated_images)  # densify `SparseIsolatedImages`
     assert isolated_images.ndim == 4
     _, _, h, w = isolated_images.shape
     err = np.sqrt(sky_level)
@@ -24,7 +26,7 @@ def get_segmentation(isolated_images: np.ndarray, sky_level: float, sigma_noise:
     is_on = is_on[:, :, None, None].repeat(h, axis=2).repeat(w, axis=3)
     seg = isolated_images > sigma_noise * err
     assert is_on.shape == seg.shape
-    return np.where(is_on, seg, np.nan)
+    return np.where(is_on, seg, np.nan).astype(isolated_images.dtype, copy=False)
 
 
 def mse(images1: np.ndarray, images2: np.ndarray) -> np.ndarray:
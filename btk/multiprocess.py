@@ -1,8 +1,17 @@
 """Tools for multiprocessing in BTK."""
 
+import contextlib
 import multiprocessing as mp
+import multiprocessing.dummy
+import multiprocessing.pool
+import queue
+import threading
+import weakref
 from itertools import repeat, starmap
-from typing import Callable, Iterable, Optional
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
 
 
 def _apply_args_and_kwargs(func: Callable, args, kwargs):
@@ -14,13 +23,306 @@ def _pool_starmap_with_kwargs(pool, func: Callable, args_iter: Iterable, kwargs_
     return pool.starmap(_apply_args_and_kwargs, args_for_starmap)
 
 
+def _apply_indexed_args_and_kwargs(task: tuple):
+    index, func, args, kwargs = task
+    return index, func(*args, **kwargs)
+
+
+def _pool_imap_by_cost(
+    pool, func: Callable, args_iter: Iterable, kwargs_iter: Iterable, costs: Sequence[float]
+) -> list:
+    """Runs the tasks from the most to the least expensive, one at a time on each worker."""
+    tasks = list(zip(repeat(func), args_iter, kwargs_iter))
+    order = np.argsort(-np.asarray(costs, dtype=float), kind="stable")
+    results = [None] * len(tasks)
+    indexed_tasks = [(ii, *tasks[ii]) for ii in order]
+    for ii, result in pool.imap_unordered(_apply_indexed_args_and_kwargs, indexed_tasks):
+        results[ii] = result
+    return results
+
+
 def _starmap_with_kwargs(func: Callable, args_iter: Iterable, kwargs_iter: Iterable):
     args_for_starmap = zip(repeat(func), args_iter, kwargs_iter)
     return starmap(_apply_args_and_kwargs, args_for_starmap)
 
 
+BACKENDS = ("processes", "threads")
+
+
+def _check_backend(backend: str):
+    if backend not in BACKENDS:
+        raise ValueError(f"The options for `backend` are {BACKENDS}, but you provided {backend}.")
+
+
+def _make_pool(njobs: int, backend: str) -> mp.pool.Pool:
+    if backend == "threads":
+        return mp.pool.ThreadPool(processes=njobs)
+    return mp.Pool(processes=njobs)
+
+
+def _terminate_pool(pool: mp.pool.Pool):
+    pool.terminate()
+    pool.join()
+
+
+class WorkerPool:
+    """Long-lived pool of worker processes that can be shared across BTK objects.
+
+    Creating a `multiprocessing.Pool` requires spawning processes and importing modules in each
+    of them, which can dominate the running time when batches are small. A `WorkerPool` instead
+    starts its processes the first time it is used and keeps them alive until `close` is called,
+    so that the same processes can be reused by every batch of a `DrawBlendsGenerator`,
+    `Deblender.batch_call` or `DeblendGenerator`.
+
+    It can be used as a context manager, in which case the processes are stopped on exit::
+
+        with WorkerPool(njobs=4) as pool:
+            draw_generator = CatsimGenerator(..., njobs=4, pool=pool)
+            blend_batch = next(draw_generator)
+            deblend_batch = deblender(blend_batch, pool=pool)
+
+    If the pool is used again after being closed, new processes are started. Pools that are
+    never closed have their processes terminated when they are garbage collected or when the
+    interpreter exits.
+
+    With `backend="threads"`, the workers are threads of the current process instead (see
+    `multiprocess`).
+    """
+
+    def __init__(self, njobs: int, backend: str = "processes"):
+        """Initializes the pool of workers (processes are only started when first needed).
+
+        Args:
+            njobs: Number of processes in the pool.
+            backend: Whether the workers are "processes" or "threads". (Default: "processes")
+        """
+        if njobs < 1:
+            raise ValueError(f"`njobs` must be a positive integer, but got {njobs}.")
+        _check_backend(backend)
+        self.njobs = njobs
+        self.backend = backend
+        self._pool = None
+        self._finalizer = None
+
+    @property
+    def is_running(self) -> bool:
+        """Whether the worker processes are currently alive."""
+        return self._pool is not None
+
+    def _get_pool(self) -> mp.pool.Pool:
+        if self._pool is None:
+            self._pool = _make_pool(self.njobs, self.backend)
+            self._finalizer = weakref.finalize(self, _terminate_pool, self._pool)
+        return self._pool
+
+    def starmap(
+        self,
+        func: Callable,
+        args_iter: Iterable,
+        kwargs_iter: Iterable,
+        costs: Optional[Sequence[float]] = None,
+    ) -> list:
+        """Runs `func(*args, **kwargs)` in the worker processes and returns results in order.
+
+        If the estimated `costs` of the tasks are provided, tasks are scheduled dynamically
+        (see `multiprocess`).
+        """
+        if costs is not None:
+            return _pool_imap_by_cost(self._get_pool(), func, args_iter, kwargs_iter, costs)
+        return _pool_starmap_with_kwargs(self._get_pool(), func, args_iter, kwargs_iter)
+
+    def close(self):
+        """Stops the worker processes once they have finished their pending tasks."""
+        if self._pool is not None:
+            self._finalizer.detach()
+            self._finalizer = None
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        """Returns the pool itself when used as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Closes the pool when exiting the context manager."""
+        self.close()
+
+    def __getstate__(self):
+        """Pools can not be sent to other processes."""
+        raise TypeError("`WorkerPool` objects can not be pickled.")
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return (
+            f"WorkerPool(njobs={self.njobs}, backend={self.backend!r}, running={self.is_running})"
+        )
+
+
+class SharedArray:
+    """Numpy array stored in shared memory that worker processes can write into directly.
+
+    Only the name, shape and dtype of the array are pickled when sending a `SharedArray` to
+    another process, which attaches to the same memory when unpickling it. Hence, large outputs
+    can be written by the workers without being pickled back to the main process.
+
+    The process that creates the array owns the shared memory, and must call `close` once it
+    is done with it to free the memory. Worker processes should call `detach` instead.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype="float64", name: Optional[str] = None):
+        """Creates a new zero-initialized array in shared memory, or attaches to an existing one.
+
+        Args:
+            shape: Shape of the array.
+            dtype: Data type of the array. (Default: float64)
+            name: Name of existing shared memory to attach to. If None, new shared memory is
+                allocated and owned by this object.
+        """
+        self.shape = tuple(int(s) for s in shape)
+        self.dtype = np.dtype(dtype)
+        self.is_owner = name is None
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._shm = SharedMemory(name=name, create=self.is_owner, size=nbytes)
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    def __getstate__(self):
+        """Only send the information needed to attach to the shared memory."""
+        return {"shape": self.shape, "dtype": self.dtype.str, "name": self.name}
+
+    def __setstate__(self, state):
+        """Attach to the shared memory when unpickling."""
+        self.__init__(state["shape"], state["dtype"], state["name"])
+
+    def detach(self):
+        """Releases access to the shared memory from a worker process.
+
+        This is a no-op for the object owning the shared memory, so that workers can always
+        call it, even when running in the main process.
+        """
+        if not self.is_owner:
+            self.array = None
+            self._shm.close()
+
+    def close(self):
+        """Releases access to the shared memory, freeing it if this object created it."""
+        self.array = None
+        self._shm.close()
+        if self.is_owner:
+            self._shm.unlink()
+
+
+class Prefetcher:
+    """Iterator which computes the next items of another iterator in a background thread.
+
+    Wrapping a `DrawBlendsGenerator` allows a training loop to use a batch while the next
+    `n_prefetch` batches are being rendered (see `DrawBlendsGenerator.prefetch`). A single
+    thread consumes the wrapped iterator, so items are returned in the same order as without
+    prefetching and the output for a given seed is unchanged. The wrapped iterator should not be
+    used directly while it is being prefetched.
+
+    Exceptions raised by the wrapped iterator are raised again by `next` when reaching the
+    corresponding item. The background thread is stopped by `close`, which is called when
+    using the prefetcher as a context manager::
+
+        with draw_generator.prefetch(n_prefetch=4) as prefetcher:
+            for _ in range(n_steps):
+                blend_batch = next(prefetcher)
+
+    Rendering with `njobs > 1` is recommended, as galsim mostly holds the GIL: the background
+    thread then spends its time waiting for the worker processes.
+    """
+
+    _END = object()
+
+    def __init__(self, iterator: Iterator, n_prefetch: int = 2):
+        """Starts prefetching the items of the iterator.
+
+        Args:
+            iterator: Iterator to prefetch the items of.
+            n_prefetch: Maximum number of items computed in advance and waiting to be used.
+        """
+        if n_prefetch < 1:
+            raise ValueError(f"`n_prefetch` must be a positive integer, but got {n_prefetch}.")
+        self.iterator = iterator
+        self.n_prefetch = n_prefetch
+        self._queue = queue.Queue(maxsize=n_prefetch)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Any, error: Optional[BaseException] = None) -> bool:
+        """Puts an item in the queue, unless the prefetcher is closed before there is room."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        """Computes the items of the iterator until it is exhausted or the prefetcher closed."""
+        while not self._stop.is_set():
+            try:
+                item = next(self.iterator)
+            except StopIteration:
+                self._put(self._END)
+                return
+            except Exception as error:
+                self._put(self._END, error)
+                return
+            if not self._put(item):
+                return
+
+    def __iter__(self) -> "Prefetcher":
+        """Returns the prefetcher itself."""
+        return self
+
+    def __next__(self) -> Any:
+        """Returns the next item of the wrapped iterator."""
+        if self._done:
+            raise StopIteration
+        item, error = self._queue.get()
+        if item is self._END:
+            self._done = True
+            self.close()
+            if error is not None:
+                raise error
+            raise StopIteration
+        return item
+
+    def close(self):
+        """Stops the background thread, discarding the items computed in advance."""
+        self._done = True
+        self._stop.set()
+        while self._thread.is_alive():
+            with contextlib.suppress(queue.Empty):
+                self._queue.get(timeout=0.1)
+        self._thread.join()
+
+    def __enter__(self) -> "Prefetcher":
+        """Returns the prefetcher itself when used as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stops the background thread when exiting the context manager."""
+        self.close()
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return f"Prefetcher(n_prefetch={self.n_prefetch}, running={self._thread.is_alive()})"
+
+
 def get_current_process() -> int:
-    """Return ID of current process or 'main' if no multiprocessing."""
+    """Return ID of current process or 'main' if no multiprocessing.
+
+    Worker threads of a pool with `backend="threads"` are identified by their thread ID.
+    """
+    if isinstance(threading.current_thread(), multiprocessing.dummy.DummyProcess):
+        return threading.current_thread().ident
     if mp.current_process().name == "MainProcess":
         return "main"
     return mp.current_process().ident
@@ -32,6 +334,9 @@ def multiprocess(
     kwargs_iter: Optional[Iterable] = None,
     njobs: int = 1,
     verbose: bool = False,
+    pool: Optional[WorkerPool] = None,
+    costs: Optional[Sequence[float]] = None,
+    backend: str = "processes",
 ):
     """Sole function that implements multiprocessing across mini-batches/batches for BTK.
 
@@ -46,16 +351,35 @@ def multiprocess(
             are passed in. Each element returned by the iterator must be a `dict`.
         njobs: # of njobs to use for multiprocessing.
         verbose: Whether to print information related to multiprocessing
+        pool: Long-lived `WorkerPool` to run the function in. If provided, no new pool of
+            processes is created and `njobs` is ignored in favor of `pool.njobs`.
+        costs: Estimated cost of each task. If provided, tasks are not split evenly between
+            the processes beforehand, but sent one at a time to the first available process,
+            starting with the most expensive ones. This balances the load when the costs of the
+            tasks are heterogeneous. Results are still returned in the order of `args_iter`.
+        backend: Whether to run the function in "processes" or in "threads" of the current
+            process when `njobs > 1`. Threads share the memory of the main process, so the
+            arguments are neither pickled nor duplicated in each worker, but they only run in
+            parallel while the function releases the GIL (e.g. in numpy or FFTW calls). Ignored
+            if `pool` is provided, in which case `pool.backend` is used. (Default: "processes")
     """
+    _check_backend(backend)
     kwargs_iter = repeat({}) if kwargs_iter is None else kwargs_iter
-    if njobs > 1:
+    if pool is not None and pool.njobs > 1:
         if verbose:
             print(
-                f"Running mini-batch of size {len(args_iter)} with multiprocessing with "
-                f"pool {njobs}"
+                f"Running mini-batch of size {len(args_iter)} with {pool.backend} with "
+                f"persistent pool {pool.njobs}"
             )
-        with mp.Pool(processes=njobs) as pool:
-            results = _pool_starmap_with_kwargs(pool, func, args_iter, kwargs_iter)
+        results = pool.starmap(func, args_iter, kwargs_iter, costs)
+    elif pool is None and njobs > 1:
+        if verbose:
+            print(f"Running mini-batch of size {len(args_iter)} with {backend} with pool {njobs}")
+        with _make_pool(njobs, backend) as mp_pool:
+            if costs is not None:
+                results = _pool_imap_by_cost(mp_pool, func, args_iter, kwargs_iter, costs)
+            else:
+                results = _pool_starmap_with_kwargs(mp_pool, func, args_iter, kwargs_iter)
     else:
         if verbose:
             print(f"Running mini-batch of size {len(args_iter)} serial {njobs} times")
@@ -1,13 +1,15 @@
 """Contains classes of function for extracing information from catalog in blend batches."""
 
+import weakref
 from abc import ABC, abstractmethod
-from typing import Optional, Tuple
+from typing import Any, Callable, Hashable, List, Optional, Tuple
 
 import astropy
 import numpy as np
 from astropy.coordinates import SkyCoord
 from astropy.table import Table
 from fast3tree import find_friends_of_friends
+from scipy import spatial
 
 from btk.utils import DEFAULT_SEED
 
@@ -57,11 +59,39 @@ def _raise_error_if_out_of_bounds(ra: np.ndarray, dec: np.ndarray, stamp_size: f
         raise ValueError("Object center lies outside the stamp")
 
 
+def _split_blend_tables(
+    table: Table, indices: np.ndarray, dx: np.ndarray, dy: np.ndarray, sizes: np.ndarray
+) -> List[Table]:
+    """Returns the tables of a batch of blends from flat arrays of indices and shifts.
+
+    Args:
+        table: Catalog table.
+        indices: Indices of the entries of all blends, concatenated.
+        dx: Shifts along the x axis of the entries of all blends (in arcseconds).
+        dy: Shifts along the y axis of the entries of all blends (in arcseconds).
+        sizes: Number of entries of each blend.
+
+    Returns:
+        List with the table of each blend.
+    """
+    batch_table = table[indices]
+    batch_table["ra"] = dx
+    batch_table["dec"] = dy
+    return [batch_table[stop - size : stop] for size, stop in zip(sizes, np.cumsum(sizes))]
+
+
 class SamplingFunction(ABC):
     """Class representing sampling functions to sample input catalog from which to draw blends.
 
     The object can be called to return an astropy table with entries corresponding to the
     galaxies chosen for the blend.
+
+    The indices of the catalog entries passing a selection cut (e.g. on magnitude), and other
+    values derived from the catalog like spatial indices, are only computed the first time the
+    cut is applied to a table, and then reused for every blend (see `_get_candidates`). They are
+    computed again if columns of the table are added, replaced or removed, or if rows are added
+    or removed. Modifying values of a column in place is not detected, `clear_candidates` should
+    be called afterwards.
     """
 
     def __init__(self, stamp_size: int, max_number: int, min_number: int = 1, seed=DEFAULT_SEED):
@@ -85,10 +115,103 @@ class SamplingFunction(ABC):
         else:
             raise AttributeError("The seed you provided is invalid, should be an int.")
 
+        self._candidates = {}  # key -> (weak reference to table, columns, length, value)
+
+    def _get_cached(self, table: Table, key: Hashable, func: Callable[[Table], Any]) -> Any:
+        """Returns `func(table)`, computed only once per table (see `_get_candidates`).
+
+        Args:
+            table: Catalog table.
+            key: Hashable description of the computed value, including the values of its
+                parameters, used as key of the cache.
+            func: Function computing the value for a table, only called if it is not cached.
+
+        Returns:
+            The value returned by `func`.
+        """
+        columns = tuple(table.itercols())
+        cached = self._candidates.get(key)
+        if (
+            cached is None
+            or cached[0]() is not table
+            or len(cached[1]) != len(columns)
+            or any(col1 is not col2 for col1, col2 in zip(cached[1], columns))
+            or cached[2] != len(table)
+        ):
+            cached = (weakref.ref(table), columns, len(table), func(table))
+            self._candidates[key] = cached
+        return cached[3]
+
+    def _get_candidates(
+        self, table: Table, cut: Hashable, mask_func: Callable[[Table], np.ndarray]
+    ) -> np.ndarray:
+        """Returns the indices of the entries of `table` passing a selection cut.
+
+        Args:
+            table: Catalog table.
+            cut: Hashable description of the cut, including the values of its parameters
+                (e.g. `("mag", mag_name, min_mag, max_mag)`), used as key of the cache.
+            mask_func: Function returning the boolean mask of the cut for a table, only
+                called if the indices are not cached.
+
+        Returns:
+            Sorted array of indices.
+        """
+        return self._get_cached(table, cut, lambda table: np.flatnonzero(mask_func(table)))
+
+    def _get_mag_candidates(self, table: Table) -> np.ndarray:
+        """Returns the indices of the entries with `min_mag < mag <= max_mag`."""
+
+        def _mask(table):
+            mag = table[self.mag_name]
+            return (mag <= self.max_mag) & (mag > self.min_mag)
+
+        cut = ("mag", self.mag_name, self.min_mag, self.max_mag)
+        return self._get_candidates(table, cut, _mask)
+
+    def clear_candidates(self):
+        """Discards the cached indices of the entries passing selection cuts."""
+        self._candidates = {}
+
+    def __getstate__(self):
+        """Excludes the cached candidates, which refer to tables, when pickling."""
+        state = self.__dict__.copy()
+        state["_candidates"] = {}
+        return state
+
     @abstractmethod
     def __call__(self, table) -> Table:
         """Outputs a sample from the given astropy table."""
 
+    def sample_batch(self, table: Table, n: int) -> List[Table]:
+        """Outputs the samples of `n` blends from the given astropy table.
+
+        By default, the sampling function is called once per blend. Subclasses can override
+        this method to draw the number of entries, the indices and the shifts of all the blends
+        at once, in which case the blends differ from the ones of successive calls with the
+        same seed.
+
+        Args:
+            table: Table containing entries from which to sample.
+            n: Number of blends.
+
+        Returns:
+            List of astropy tables, each one corresponding to a blend.
+        """
+        return [self(table) for _ in range(n)]
+
+    def state_dict(self) -> dict:
+        """Returns the state of the random number generator, to resume sampling later.
+
+        Sampling functions using the global numpy random state instead of `self.rng` can not
+        be resumed.
+        """
+        return {"rng": self.rng.bit_generator.state}
+
+    def load_state_dict(self, state: dict):
+        """Restores the state of the random number generator returned by `state_dict`."""
+        self.rng.bit_generator.state = state["rng"]
+
 
 class DefaultSampling(SamplingFunction):
     """Default sampling function used for producing blend catalogs."""
@@ -150,8 +273,7 @@ class DefaultSampling(SamplingFunction):
 
         number_of_objects = self.rng.integers(self.min_number, self.max_number + 1)
 
-        cond = (table[self.mag_name] <= self.max_mag) & (table[self.mag_name] > self.min_mag)
-        (q,) = np.where(cond)
+        q = self._get_mag_candidates(table)
         blend_table = table[self.rng.choice(q, size=number_of_objects)]
 
         blend_table["ra"] = 0.0
@@ -162,6 +284,30 @@ class DefaultSampling(SamplingFunction):
         _raise_error_if_out_of_bounds(blend_table["ra"], blend_table["dec"], self.stamp_size)
         return blend_table
 
+    def sample_batch(self, table: Table, n: int) -> List[Table]:
+        """Applies default sampling to catalog for `n` blends at once.
+
+        The blends follow the same distribution as the ones returned by `__call__`, but the
+        random numbers of all blends are drawn together so the blends are not the same as
+        for successive calls with the same seed.
+
+        Args:
+            table: Table containing entries corresponding to galaxies
+                                    from which to sample.
+            n: Number of blends.
+
+        Returns:
+            List of astropy tables, each one corresponding to a blend.
+        """
+        if self.mag_name not in table.colnames:
+            raise ValueError(f"Catalog must have '{self.mag_name}' column.")
+
+        sizes = self.rng.integers(self.min_number, self.max_number + 1, size=n)
+        indices = self.rng.choice(self._get_mag_candidates(table), size=np.sum(sizes))
+        dx, dy = _get_random_center_shift(len(indices), self.max_shift, self.rng)
+        _raise_error_if_out_of_bounds(dx, dy, self.stamp_size)
+        return _split_blend_tables(table, indices, dx, dy, sizes)
+
 
 class DensitySampling(SamplingFunction):
     """Sampling function that produces galaxy field with a specified density."""
@@ -231,8 +377,7 @@ class DensitySampling(SamplingFunction):
             self.rng.poisson(self.exp_count), self.min_number, self.max_number
         )
 
-        cond = (table[self.mag_name] <= self.max_mag) & (table[self.mag_name] > self.min_mag)
-        (q,) = np.where(cond)
+        q = self._get_mag_candidates(table)
         blend_table = table[self.rng.choice(q, size=number_of_objects)]
 
         blend_table["ra"] = 0.0
@@ -244,6 +389,30 @@ class DensitySampling(SamplingFunction):
 
         return blend_table
 
+    def sample_batch(self, table: Table, n: int) -> List[Table]:
+        """Applies density sampling to catalog for `n` blends at once.
+
+        The blends follow the same distribution as the ones returned by `__call__`, but the
+        random numbers of all blends are drawn together so the blends are not the same as
+        for successive calls with the same seed.
+
+        Args:
+            table: Table containing entries corresponding to galaxies
+                                    from which to sample.
+            n: Number of blends.
+
+        Returns:
+            List of astropy tables, each one corresponding to a blend.
+        """
+        if self.mag_name not in table.colnames:
+            raise ValueError(f"Catalog must have '{self.mag_name}' column.")
+
+        sizes = np.clip(self.rng.poisson(self.exp_count, size=n), self.min_number, self.max_number)
+        indices = self.rng.choice(self._get_mag_candidates(table), size=np.sum(sizes))
+        dx, dy = _get_random_center_shift(len(indices), self.max_shift, self.rng)
+        _raise_error_if_out_of_bounds(dx, dy, self.stamp_size)
+        return _split_blend_tables(table, indices, dx, dy, sizes)
+
 
 class BasicSampling(SamplingFunction):
     """Example of basic sampling function features.
@@ -276,6 +445,17 @@ class BasicSampling(SamplingFunction):
         if min_number < 1:
             raise ValueError("At least 1 bright galaxy will be added, so need min_number >=1.")
 
+    def _get_basic_candidates(self, table: Table, max_mag: float, strict: bool) -> np.ndarray:
+        """Returns indices of entries with semi-major axis in (0.2, 2] and mag below `max_mag`."""
+
+        def _mask(table):
+            a = np.hypot(table["a_d"], table["a_b"])
+            mag = table[self.mag_name]
+            cond_mag = mag < max_mag if strict else mag <= max_mag
+            return (a <= 2) & (a > 0.2) & cond_mag
+
+        return self._get_candidates(table, ("basic", self.mag_name, max_mag, strict), _mask)
+
     def __call__(self, table: Table) -> Table:
         """Samples galaxies from input catalog to make blend scene.
 
@@ -303,13 +483,11 @@ class BasicSampling(SamplingFunction):
             raise ValueError("Catalog must have 'a_d' and 'a_b' columns.")
 
         number_of_objects = self.rng.integers(self.min_number - 1, self.max_number)
-        a = np.hypot(table["a_d"], table["a_b"])
-        cond = (a <= 2) & (a > 0.2)
-        (q_bright,) = np.where(cond & (table[self.mag_name] <= 24))
+        q_bright = self._get_basic_candidates(table, 24, strict=False)
         if self.rng.random() >= 0.9:
-            (q,) = np.where(cond & (table[self.mag_name] < 28))
+            q = self._get_basic_candidates(table, 28, strict=True)
         else:
-            (q,) = np.where(cond & (table[self.mag_name] <= 25.3))
+            q = self._get_basic_candidates(table, 25.3, strict=False)
         blend_table = astropy.table.vstack(
             [
                 table[self.rng.choice(q_bright, size=1)],
@@ -369,6 +547,14 @@ class DefaultSamplingShear(DefaultSampling):
         blend_table["g2"] = self.shear[1]
         return blend_table
 
+    def sample_batch(self, table: Table, n: int) -> List[Table]:
+        """Same as corresponding function for `DefaultSampling` but adds shear to output tables."""
+        blend_tables = super().sample_batch(table, n)
+        for blend_table in blend_tables:
+            blend_table["g1"] = self.shear[0]
+            blend_table["g2"] = self.shear[1]
+        return blend_tables
+
 
 class PairSampling(SamplingFunction):
     """Sampling function for pairs of galaxies. Picks one centered bright galaxy and second dim.
@@ -412,9 +598,17 @@ class PairSampling(SamplingFunction):
         if self.mag_name not in table.colnames:
             raise ValueError(f"Catalog must have '{self.mag_name}' column.")
 
-        (q_bright,) = np.where(table[self.mag_name] <= self.bright_cut)
-        (q_dim,) = np.where(
-            (table[self.mag_name] > self.bright_cut) & (table[self.mag_name] <= self.dim_cut)
+        q_bright = self._get_candidates(
+            table,
+            ("mag", self.mag_name, -np.inf, self.bright_cut),
+            lambda table: table[self.mag_name] <= self.bright_cut,
+        )
+        q_dim = self._get_candidates(
+            table,
+            ("mag", self.mag_name, self.bright_cut, self.dim_cut),
+            lambda table: (
+                (table[self.mag_name] > self.bright_cut) & (table[self.mag_name] <= self.dim_cut)
+            ),
         )
 
         indexes = [np.random.choice(q_bright), np.random.choice(q_dim)]
@@ -463,6 +657,36 @@ class RandomSquareSampling(SamplingFunction):
         self.min_mag = min_mag
         self.mag_name = mag_name
 
+    def _get_square_index(self, table: Table) -> Tuple[np.ndarray, np.ndarray, spatial.cKDTree]:
+        """Returns the spatial index of the entries passing the magnitude cut.
+
+        The index is built once per catalog, and is used to find the galaxies in a square region
+        in `O(log N + k)` time, where `N` is the number of galaxies in the catalog and `k` the
+        number of galaxies in the region.
+
+        Args:
+            table: Catalog table, with `ra` and `dec` in degrees.
+
+        Returns:
+            Tuple with the indices of the entries passing the magnitude cut, their shifted `ra`
+            and `dec` coordinates stacked in an array of shape `(n, 2)` (in degrees), and a
+            KD-tree built from these coordinates.
+        """
+
+        def _build_index(table):
+            candidates = self._get_mag_candidates(table)
+            ra = np.asarray(table["ra"])[candidates] % 360
+            dec = np.asarray(table["dec"])[candidates] % 360
+
+            # sometimes we might have data from [0, 1] U [359:360] deg
+            # in this case to make coordinates close to each other
+            # we shift the 0 of ra and dec coordinates.
+            coords = np.stack([(ra + ra.mean()) % 360, (dec + dec.mean()) % 360], axis=1)
+            return candidates, coords, spatial.cKDTree(coords)
+
+        key = ("square", self.mag_name, self.min_mag, self.max_mag)
+        return self._get_cached(table, key, _build_index)
+
     def __call__(self, table: Table):
         """Samples galaxies from input catalog to make scene.
 
@@ -471,25 +695,11 @@ class RandomSquareSampling(SamplingFunction):
         # filter by magnitude
         if self.mag_name not in table.colnames:
             raise ValueError(f"Catalog must have '{self.mag_name}' column.")
-        cond1 = table[self.mag_name] <= self.max_mag
-        cond2 = table[self.mag_name] > self.min_mag
-        cond = cond1 & cond2
-        blend_table = table[cond]
-
-        ra = blend_table["ra"]
-        dec = blend_table["dec"]
-
-        # sometimes we might have data from [0, 1] U [359:360] deg
-        # in this case to make coordinates close to each other
-        # we shift the 0 of ra and dec coordinates.
-        ra %= 360
-        dec %= 360
-        ra = (ra + ra.mean()) % 360
-        dec = (dec + dec.mean()) % 360
+        candidates, coords, tree = self._get_square_index(table)
 
         # check size of stamp is appropriate
-        ra_range = ra.max() - ra.min()
-        dec_range = dec.max() - dec.min()
+        (ra_min, dec_min), (ra_max, dec_max) = tree.mins, tree.maxes
+        ra_range, dec_range = ra_max - ra_min, dec_max - dec_min
         size = self.stamp_size / 3600
         if size > min(ra_range, dec_range):
             raise ValueError(
@@ -498,15 +708,20 @@ class RandomSquareSampling(SamplingFunction):
             )
 
         # sample a square region
-        ra_center = np.random.uniform(ra.min() + size / 2, ra.max() - size / 2)
-        dec_center = np.random.uniform(dec.min() + size / 2, dec.max() - size / 2)
+        ra_center = np.random.uniform(ra_min + size / 2, ra_max - size / 2)
+        dec_center = np.random.uniform(dec_min + size / 2, dec_max - size / 2)
         ra_min, ra_max = ra_center - size / 2, ra_center + size / 2
         dec_min, dec_max = dec_center - size / 2, dec_center + size / 2
 
-        # get indices of galaxies in the square region
-        cond_ra = (ra > ra_min) & (ra < ra_max)
-        cond_dec = (dec > dec_min) & (dec < dec_max)
-        indices = np.where(cond_ra & cond_dec)
+        # get indices of galaxies in the square region, the query with a slightly larger
+        # radius returns a superset of them, which is then filtered exactly.
+        indices = tree.query_ball_point(
+            [ra_center, dec_center], size / 2 * (1 + 1e-6), p=np.inf, return_sorted=True
+        )
+        indices = np.asarray(indices, dtype=int)
+        ra, dec = coords[indices, 0], coords[indices, 1]
+        in_square = (ra > ra_min) & (ra < ra_max) & (dec > dec_min) & (dec < dec_max)
+        indices, ra, dec = indices[in_square], ra[in_square], dec[in_square]
 
         # check that number of galaxies is in [0, max_number]
         if len(indices) > self.max_number:
@@ -516,9 +731,9 @@ class RandomSquareSampling(SamplingFunction):
             )
 
         # recenter catalog 'ra' and 'dec' to the center of the stamp
-        blend_table = blend_table[indices]
-        blend_table["ra"] = ra[indices] - ra_center
-        blend_table["dec"] = dec[indices] - dec_center
+        blend_table = table[candidates[indices]]
+        blend_table["ra"] = ra - ra_center
+        blend_table["dec"] = dec - dec_center
 
         # finally, convert to arcsec
         blend_table["ra"] *= 3600
@@ -594,10 +809,7 @@ class FriendsOfFriendsSampling(SamplingFunction):
         # filter by magnitude
         if self.mag_name not in table.colnames:
             raise ValueError(f"Catalog must have '{self.mag_name}' column.")
-        cond1 = table[self.mag_name] <= self.max_mag
-        cond2 = table[self.mag_name] > self.min_mag
-        cond = cond1 & cond2
-        blend_table = table[cond]
+        blend_table = table[self._get_mag_candidates(table)]
 
         # filter by number of galaxies
         num_galaxies = blend_table.to_pandas()["friends_of_friends_id"].value_counts()
@@ -2,6 +2,8 @@
 
 import os
 import random as rd
+from collections.abc import Sequence
+from functools import lru_cache
 from typing import Callable, List, Optional, Tuple, Union
 
 import galsim
@@ -186,9 +188,79 @@ def _get_default_psf(
     return psf_model.withFlux(1.0)  # pylint: disable=no-value-for-parameter
 
 
+class PSFLibrary(Sequence):
+    """Bank of PSF images from which a PSF is assigned to each blend.
+
+    Setting the `psf` of the filters of a survey to a `PSFLibrary` makes `DrawBlendsGenerator`
+    draw each blend with a PSF of the library instead of a single PSF per batch, e.g. to mimic
+    the variation of the PSF across the focal plane. The index of the PSF of each blend is the
+    same in all bands, so the libraries of the filters of a survey should have the same size,
+    and it is recorded in the `psf_index` attribute of the resulting `BlendBatch`.
+
+    Each image is converted to a flux-normalized `galsim.InterpolatedImage` the first time it
+    is used, which is then reused by all blends and batches.
+    """
+
+    def __init__(self, images: List[np.ndarray], pixel_scale: float):
+        """Initializes the library.
+
+        Args:
+            images: List of PSF images (possibly of different sizes).
+            pixel_scale: Pixel scale of the images (in arcseconds).
+        """
+        if len(images) == 0:
+            raise ValueError("A `PSFLibrary` needs at least one PSF image.")
+        self.images = [np.asarray(image) for image in images]
+        self.pixel_scale = pixel_scale
+        self._psfs: List[Optional[galsim.GSObject]] = [None] * len(self.images)
+
+    @classmethod
+    def from_dir(cls, psf_dir: str, pixel_scale: float) -> "PSFLibrary":
+        """Loads all the FITS files of a directory (sorted by name) in a library.
+
+        Args:
+            psf_dir: Directory where the PSF FITS files are.
+            pixel_scale: Pixel scale of the images (in arcseconds).
+
+        Returns:
+            `PSFLibrary` object.
+        """
+        psf_files = sorted(os.listdir(psf_dir))
+        if len(psf_files) == 0:
+            raise RuntimeError(f"No psf files found in '{psf_dir}'.")
+        return cls([fits.getdata(os.path.join(psf_dir, f)) for f in psf_files], pixel_scale)
+
+    def __len__(self) -> int:
+        """Returns the number of PSFs in the library."""
+        return len(self.images)
+
+    def __getitem__(self, index: int) -> galsim.GSObject:
+        """Returns the PSF of the library with the given index as a galsim object."""
+        index = range(len(self))[index]
+        if self._psfs[index] is None:
+            image = galsim.Image(self.images[index])
+            psf = galsim.InterpolatedImage(image, scale=self.pixel_scale).withFlux(1.0)
+            self._psfs[index] = psf
+        return self._psfs[index]
+
+    def __repr__(self) -> str:
+        """Return string representation of class."""
+        return f"PSFLibrary(n_psfs={len(self)}, pixel_scale={self.pixel_scale})"
+
+
+@lru_cache(maxsize=8)
+def _load_psf_library(psf_dir: str, pixel_scale: float) -> PSFLibrary:
+    return PSFLibrary.from_dir(psf_dir, pixel_scale)
+
+
 def get_psf_from_file(psf_dir: str, survey: Survey) -> galsim.InterpolatedImage:
     """Generates a custom PSF galsim model from FITS file(s).
 
+    The files of the directory are only read the first time (see `PSFLibrary`), and a random one
+    is chosen at each call among the files sorted by name, using the `random` module. Files added
+    to the directory afterwards are not seen. The libraries of the 8 most recently used pairs of
+    directory and pixel scale are kept in memory.
+
     Args:
         psf_dir: directory where the PSF FITS files are
         survey: BTK Survey object
@@ -196,18 +268,9 @@ def get_psf_from_file(psf_dir: str, survey: Survey) -> galsim.InterpolatedImage:
     Returns:
         galsim.InterpolatedImage: PSF model
     """
-    psf_files = os.listdir(psf_dir)
-    if len(psf_files) > 1:
-        psf_file = rd.choice(psf_files)
-    elif len(psf_files) == 1:
-        psf_file = psf_files[0]
-    else:
-        raise RuntimeError(f"No psf files found in '{psf_dir}'.")
-    psf_array = fits.getdata(psf_dir + "/" + psf_file)
-
-    return galsim.InterpolatedImage(
-        galsim.Image(psf_array), scale=survey.pixel_scale.to_value("arcsec")
-    ).withFlux(1.0)
+    library = _load_psf_library(psf_dir, survey.pixel_scale.to_value("arcsec"))
+    index = rd.randrange(len(library)) if len(library) > 1 else 0
+    return library[index]
 
 
 def make_wcs(
@@ -4,8 +4,24 @@ from pathlib import Path
 
 import pytest
 
+import btk
+
 
 @pytest.fixture(scope="session")
 def data_dir():
     """Return the path to the data directory."""
     return Path(__file__).parent.joinpath("../data").resolve()
+
+
+@pytest.fixture(scope="session")
+def catsim_catalog(data_dir):
+    """Return the bundled CATSIM catalog with the per-band `fluxnorm` columns used for drawing.
+
+    The bundled catalog only has achromatic `fluxnorm_{component}` columns, so we copy them
+    over to each band.
+    """
+    catalog = btk.catalog.CatsimCatalog.from_file(data_dir / "input_catalog.fits")
+    for band in "ugrizy":
+        for component in ("disk", "bulge", "agn"):
+            catalog.table[f"fluxnorm_{component}_{band}"] = catalog.table[f"fluxnorm_{component}"]
+    return catalog
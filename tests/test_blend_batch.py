@@ -0,0 +1,105 @@
+"""Tests for the data containers in `btk.blend_batch`."""
+
+import h5py
+import numpy as np
+from astropy.io.misc.hdf5 import write_table_hdf5
+from astropy.table import MaskedColumn, Table
+
+import btk
+from btk.blend_batch import CatalogList, DeblendBatch, SparseIsolatedImages
+
+
+def _get_dense_images(seed=0):
+    rng = np.random.default_rng(seed)
+    images = np.zeros((3, 4, 2, 10, 10))
+    images[0, 0, :, 2:5, 3:9] = rng.uniform(size=(2, 3, 6))
+    images[0, 2, 1, 0:10, 7:8] = rng.uniform(size=(10, 1))
+    images[2, 1, :, 4:6, 0:3] = rng.uniform(size=(2, 2, 3))
+    return images
+
+
+def test_sparse_isolated_images():
+    """Check that sparse isolated images behave like the corresponding dense array."""
+    dense = _get_dense_images()
+    sparse = SparseIsolatedImages.from_dense(dense)
+    assert sparse.shape == dense.shape and sparse.ndim == 5 and len(sparse) == 3
+    assert len(sparse.sources) == 3
+    assert sparse.nbytes < dense.nbytes / 5
+
+    np.testing.assert_array_equal(np.asarray(sparse), dense)
+    np.testing.assert_array_equal(sparse[0], dense[0])
+    np.testing.assert_array_equal(sparse[2, 1], dense[2, 1])
+    np.testing.assert_array_equal(sparse[1:, ::2, 0, 4:], dense[1:, ::2, 0, 4:])
+    np.testing.assert_array_equal(sparse[..., 3], dense[..., 3])
+    np.testing.assert_array_equal(sparse.sum(axis=1), dense.sum(axis=1))
+    np.testing.assert_array_equal(sparse.sum(), dense.sum())
+
+    band = sparse[:, :, 1]
+    assert isinstance(band, SparseIsolatedImages)
+    np.testing.assert_array_equal(np.asarray(band), dense[:, :, 1])
+    np.testing.assert_array_equal(band[0], dense[0, :, 1])
+
+    both = SparseIsolatedImages.concatenate([sparse, SparseIsolatedImages.from_dense(dense[:1])])
+    np.testing.assert_array_equal(np.asarray(both), np.concatenate([dense, dense[:1]]))
+
+
+def test_sparse_metrics():
+    """Check that metrics give the same results with sparse isolated images."""
+    dense = _get_dense_images()
+    sparse = SparseIsolatedImages.from_dense(dense)
+    other = _get_dense_images(seed=1)
+    for metric_class in (btk.metrics.reconstruction.MSE, btk.metrics.reconstruction.PSNR):
+        dense_value = metric_class(batch_size=3)(dense[:, :, 0], other[:, :, 0])
+        sparse_value = metric_class(batch_size=3)(sparse[:, :, 0], other[:, :, 0])
+        np.testing.assert_array_equal(dense_value, sparse_value)
+    np.testing.assert_array_equal(
+        btk.metrics.utils.get_segmentation(sparse[:, :, 0], sky_level=1e-4),
+        btk.metrics.utils.get_segmentation(dense[:, :, 0], sky_level=1e-4),
+    )
+
+
+def test_catalog_storage(tmp_path):
+    """Check the columnar storage of catalogs and that files with a table per blend load."""
+    rng = np.random.default_rng(0)
+    catalog_list = []
+    for n_sources in (2, 0, 3):
+        catalog = Table()
+        catalog["ra"], catalog["dec"] = rng.normal(size=n_sources), rng.normal(size=n_sources)
+        catalog["ra"].unit = "arcsec"
+        catalog["name"] = [f"galaxy_{ii}" for ii in range(n_sources)]
+        catalog_list.append(catalog)
+    deblend_batch = DeblendBatch(3, 3, catalog_list, n_bands=1, image_size=10)
+    deblend_batch.save(tmp_path, 0)
+    with h5py.File(tmp_path / "deblend_0.hdf5", "r") as f:
+        assert "catalog_list" not in f
+        np.testing.assert_array_equal(f["catalog/offsets"][:], [0, 2, 2, 5])
+
+    loaded_list = DeblendBatch.load(tmp_path, 0).catalog_list
+    assert isinstance(loaded_list, CatalogList) and len(loaded_list) == 3
+    for catalog, loaded in zip(catalog_list, loaded_list):
+        assert loaded.colnames == catalog.colnames and loaded["ra"].unit == "arcsec"
+        for name in catalog.colnames:
+            np.testing.assert_array_equal(loaded[name], catalog[name])
+    loaded_list[0]["flag"] = True
+    assert "flag" in loaded_list[0].colnames
+
+    # columns missing from some catalogs are masked, and masks and meta are kept.
+    catalog_list[0].meta["deblender"] = {"name": "sep", "threshold": 1.5}
+    catalog_list[1] = Table({"ra": [], "dec": []})
+    catalog_list[2]["flux"] = MaskedColumn([1.0, 2.0, 3.0], mask=[False, True, False])
+    DeblendBatch(3, 3, catalog_list, n_bands=1, image_size=10).save(tmp_path, 2)
+    loaded_list = DeblendBatch.load(tmp_path, 2).catalog_list
+    assert loaded_list.colnames == ["ra", "dec", "name", "flux"]
+    assert loaded_list[0].meta == catalog_list[0].meta and not loaded_list[2].meta
+    np.testing.assert_array_equal(loaded_list[0]["flux"].mask, [True, True])
+    np.testing.assert_array_equal(loaded_list[2]["flux"].mask, catalog_list[2]["flux"].mask)
+    np.testing.assert_array_equal(loaded_list[2]["flux"][[0, 2]], [1.0, 3.0])
+    np.testing.assert_array_equal(loaded_list[2]["name"], catalog_list[2]["name"])
+
+    # files saved with previous versions, with one table per blend.
+    with h5py.File(tmp_path / "deblend_1.hdf5", "w") as f:
+        for ii, catalog in enumerate(catalog_list):
+            write_table_hdf5(catalog, f, path=f"catalog_list/{ii}", serialize_meta=True)
+        f.attrs.update({"batch_size": 3, "max_n_sources": 3, "image_size": 0, "n_bands": 0})
+    loaded_list = DeblendBatch.load(tmp_path, 1).catalog_list
+    np.testing.assert_array_equal(loaded_list[2]["name"], catalog_list[2]["name"])
@@ -1,17 +1,25 @@
+import pickle
+
+import numpy as np
+
 import btk
 from btk.survey import Survey
 
 SEED = 0
 
 
-def test_cosmos_generator(data_dir):
-    """Test the pipeline as a whole for a single deblender."""
+def _get_cosmos_catalog(data_dir):
     cosmos_catalog_paths = [
         data_dir / "cosmos" / "real_galaxy_catalog_23.5_example.fits",
         data_dir / "cosmos" / "real_galaxy_catalog_23.5_example_fits.fits",
     ]
     cosmos_catalog_files = [p.as_posix() for p in cosmos_catalog_paths]
-    catalog = btk.catalog.CosmosCatalog.from_file(cosmos_catalog_files)
+    return btk.catalog.CosmosCatalog.from_file(cosmos_catalog_files)
+
+
+def test_cosmos_generator(data_dir):
+    """Test the pipeline as a whole for a single deblender."""
+    catalog = _get_cosmos_catalog(data_dir)
 
     _ = catalog.get_raw_catalog()
 
@@ -52,3 +60,57 @@ def test_cosmos_generator(data_dir):
     assert blend_batch.blend_images.shape == (batch_size, 6, stamp_size / 0.2, stamp_size / 0.2)
     iso_shape = (batch_size, max_n_sources, 6, stamp_size / 0.2, stamp_size / 0.2)
     assert blend_batch.isolated_images.shape == iso_shape
+
+
+def test_galaxy_cache(data_dir):
+    """Check that cached COSMOS galaxies give the same images and are reused across bands."""
+    catalog = _get_cosmos_catalog(data_dir)
+    survey = btk.survey.get_surveys("LSST")
+    batches = []
+    for galaxy_cache_size in (0, 100):
+        sampling_function = btk.sampling_functions.DefaultSampling(
+            max_number=2, stamp_size=24.0, max_shift=1.0, seed=SEED, mag_name="MAG"
+        )
+        draw_generator = btk.draw_blends.CosmosGenerator(
+            catalog,
+            sampling_function,
+            survey,
+            batch_size=4,
+            add_noise="none",
+            seed=SEED,
+            galaxy_cache_size=galaxy_cache_size,
+        )
+        batches.append([next(draw_generator) for _ in range(2)])
+    for batch1, batch2 in zip(*batches):
+        np.testing.assert_array_equal(batch2.isolated_images, batch1.isolated_images)
+
+    # each galaxy is loaded once and reused in the other 5 bands.
+    stats = draw_generator.galaxy_cache.stats
+    assert stats["misses"] == stats["n_items"] > 0
+    assert stats["hits"] >= 5 * stats["misses"]
+    draw_generator.close()
+    assert draw_generator._galaxy_cache_name not in btk.cache._PROCESS_CACHES
+
+
+def test_galsim_catalog_not_pickled(data_dir):
+    """Check that workers load the galsim catalog from its files instead of receiving it."""
+    catalog = _get_cosmos_catalog(data_dir)
+    survey = btk.survey.get_surveys("LSST")
+
+    def _get_generator(**kwargs):
+        sampling_function = btk.sampling_functions.DefaultSampling(
+            max_number=2, stamp_size=24.0, max_shift=1.0, seed=SEED, mag_name="MAG"
+        )
+        return btk.draw_blends.CosmosGenerator(
+            catalog, sampling_function, survey, batch_size=4, add_noise="none", **kwargs
+        )
+
+    unpickled = pickle.loads(pickle.dumps(_get_generator()))
+    assert unpickled._galsim_catalog is None
+    assert unpickled.galsim_catalog is unpickled.galsim_catalog
+    assert unpickled.galsim_catalog.getNObjects() == catalog.galsim_catalog.getNObjects()
+
+    expected = next(_get_generator())
+    with _get_generator(njobs=2) as draw_generator:
+        blend_batch = next(draw_generator)
+    np.testing.assert_array_equal(blend_batch.isolated_images, expected.isolated_images)
@@ -0,0 +1,253 @@
+"""Tests for the on-disk datasets of `btk.dataset`."""
+
+import functools
+import multiprocessing as mp
+
+import galsim
+import h5py
+import numpy as np
+import pytest
+
+import btk
+from btk.blend_batch import SparseIsolatedImages, append_to_dataset, read_catalog_columns
+
+SEED = 0
+
+
+def _get_generator(catalog, stamp_size=24.0, **kwargs):
+    sampling_function = btk.sampling_functions.DefaultSampling(
+        max_number=3, min_number=1, stamp_size=stamp_size, max_shift=5.0, max_mag=24, seed=SEED
+    )
+    survey = btk.survey.get_surveys("LSST")
+    kwargs = {"batch_size": 4, "add_noise": "all", "seed": SEED, **kwargs}
+    return btk.draw_blends.CatsimGenerator(catalog, sampling_function, survey, **kwargs)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_dataset_writer(catsim_catalog, tmp_path, sparse):
+    """Check that batches streamed to a dataset are saved without loss."""
+    kwargs = {"use_substamps": True, "sparse_isolated_images": sparse}
+    draw_generator = _get_generator(catsim_catalog, **kwargs)
+    batches = [next(draw_generator) for _ in range(3)]
+    fpath = tmp_path / "dataset.hdf5"
+    with btk.dataset.DatasetWriter(fpath, compression="gzip") as writer:
+        writer.write_batches(_get_generator(catsim_catalog, **kwargs), n_batches=2)
+    with btk.dataset.DatasetWriter(fpath, mode="a") as writer:
+        writer.write(batches[2])
+
+    with h5py.File(fpath, "r") as f:
+        group = f["LSST"]
+        np.testing.assert_array_equal(f.attrs["surveys"], ["LSST"])
+        assert group["blend_images"].chunks == (1, *batches[0].blend_images.shape[1:])
+        assert group["blend_images"].compression == "gzip"
+        np.testing.assert_array_equal(group["batch_offsets"][:], [0, 4, 8, 12])
+        np.testing.assert_array_equal(
+            group["blend_images"][:], np.concatenate([b.blend_images for b in batches])
+        )
+        if sparse:
+            isolated_images = SparseIsolatedImages.load(group["isolated_images"])
+        else:
+            isolated_images = group["isolated_images"][:]
+        np.testing.assert_array_equal(
+            np.asarray(isolated_images),
+            np.concatenate([np.asarray(b.isolated_images) for b in batches]),
+        )
+        np.testing.assert_array_equal(group["psf"][2], batches[2].get_numpy_psf())
+
+        catalog_list = read_catalog_columns(group["catalog"], 2, 6)
+        expected = batches[0].catalog_list[2:] + batches[1].catalog_list[:2]
+        for catalog, expected_catalog in zip(catalog_list, expected):
+            assert catalog.colnames == expected_catalog.colnames
+            for name in catalog.colnames:
+                np.testing.assert_array_equal(catalog[name], expected_catalog[name])
+                assert catalog[name].unit == expected_catalog[name].unit
+
+
+def test_dataset_writer_errors(catsim_catalog, tmp_path):
+    """Check that errors of the writing thread are raised in the main thread."""
+    blend_batch = next(_get_generator(catsim_catalog))
+    other_batch = next(_get_generator(catsim_catalog, stamp_size=12.0))
+    writer = btk.dataset.DatasetWriter(tmp_path / "dataset.hdf5")
+    writer.write(blend_batch)
+    writer.write(other_batch)
+    with pytest.raises(RuntimeError, match="Writing to"):
+        writer.close()
+
+    with btk.dataset.DatasetWriter(tmp_path / "dataset.hdf5") as writer:
+        writer.write(blend_batch)
+    with pytest.raises(ValueError, match="closed"):
+        writer.write(blend_batch)
+
+
+def _read_blend(blend_dataset, index):
+    return blend_dataset[index]
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_blend_dataset(catsim_catalog, tmp_path, sparse):
+    """Check that blends are read lazily from datasets and single saved batches."""
+    kwargs = {"use_substamps": True, "sparse_isolated_images": sparse}
+    draw_generator = _get_generator(catsim_catalog, **kwargs)
+    batches = [next(draw_generator) for _ in range(2)]
+    with btk.dataset.DatasetWriter(tmp_path / "dataset.hdf5") as writer:
+        for blend_batch in batches:
+            writer.write(blend_batch)
+    batches[1].save(tmp_path, 1)
+
+    blend_dataset = btk.dataset.BlendDataset(tmp_path / "dataset.hdf5")
+    assert len(blend_dataset) == 8 and blend_dataset.surveys == ["LSST"]
+    blend = blend_dataset[6]
+    np.testing.assert_array_equal(blend["blend_images"], batches[1].blend_images[2])
+    np.testing.assert_array_equal(blend["isolated_images"], batches[1].isolated_images[2])
+    np.testing.assert_array_equal(blend["psf"], batches[1].get_numpy_psf())
+    np.testing.assert_array_equal(blend["catalog"]["ra"], batches[1].catalog_list[2]["ra"])
+
+    blend_batch = blend_dataset[3:6]
+    assert isinstance(blend_batch, btk.blend_batch.BlendBatch)
+    assert isinstance(blend_batch.isolated_images, SparseIsolatedImages) == sparse
+    np.testing.assert_array_equal(
+        blend_batch.blend_images, np.concatenate([b.blend_images for b in batches])[3:6]
+    )
+    np.testing.assert_array_equal(
+        np.asarray(blend_batch.isolated_images),
+        np.concatenate([np.asarray(b.isolated_images) for b in batches])[3:6],
+    )
+    assert len(blend_batch.catalog_list) == 3
+    np.testing.assert_array_equal(
+        blend_batch.catalog_list[1]["ra"], batches[1].catalog_list[0]["ra"]
+    )
+
+    # the dataset can be used by several processes.
+    with mp.Pool(processes=2) as pool:
+        blends = pool.map(functools.partial(_read_blend, blend_dataset), range(8))
+    for ii, blend in enumerate(blends):
+        np.testing.assert_array_equal(blend["blend_images"], batches[ii // 4].blend_images[ii % 4])
+    blend_dataset.close()
+
+    with btk.dataset.BlendDataset(tmp_path / "blend_1.hdf5") as blend_dataset:
+        assert len(blend_dataset) == 4
+        np.testing.assert_array_equal(blend_dataset[-2]["blend_images"], batches[1].blend_images[2])
+        np.testing.assert_array_equal(
+            blend_dataset[1:3].catalog_list[0]["ra"], batches[1].catalog_list[1]["ra"]
+        )
+
+
+@pytest.mark.parametrize("noise_engine", ["galsim", "poisson"])
+def test_shards(catsim_catalog, tmp_path, noise_engine, monkeypatch):
+    """Check that merging the shards of a generator gives the batches of a single run."""
+    kwargs = {"noise_engine": noise_engine}
+    draw_generator = _get_generator(catsim_catalog, **kwargs)
+    expected = [next(draw_generator) for _ in range(5)]
+
+    paths = []
+    for index in range(2):
+        shard_generator = _get_generator(catsim_catalog, **kwargs).shard(index, 2)
+        paths.append(tmp_path / f"shard_{index}.hdf5")
+        with btk.dataset.DatasetWriter(paths[-1]) as writer:
+            writer.write_batches(shard_generator, n_batches=3 - index)
+    btk.dataset.merge_datasets(paths, tmp_path / "merged.hdf5")
+    assert len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE)) == 0  # input files are closed.
+
+    with btk.dataset.BlendDataset(tmp_path / "merged.hdf5") as blend_dataset:
+        assert len(blend_dataset) == 20
+        for ii, blend_batch in enumerate(expected):
+            merged_batch = blend_dataset[4 * ii : 4 * ii + 4]
+            np.testing.assert_array_equal(merged_batch.blend_images, blend_batch.blend_images)
+            np.testing.assert_array_equal(
+                merged_batch.catalog_list[3]["ra"], blend_batch.catalog_list[3]["ra"]
+            )
+            np.testing.assert_array_equal(merged_batch.get_numpy_psf(), blend_batch.get_numpy_psf())
+    with pytest.raises(ValueError, match="Invalid shard"):
+        _get_generator(catsim_catalog).shard(2, 2)
+
+    # input files are closed when the merge fails.
+    def get_batch(*args):
+        raise OSError("Failed reading.")
+
+    monkeypatch.setattr(btk.dataset.BlendDataset, "get_batch", get_batch)
+    with pytest.raises(OSError, match="Failed reading") as excinfo:
+        btk.dataset.merge_datasets(paths, tmp_path / "failed.hdf5")
+    # the traceback keeps the datasets alive, so they must have been closed explicitly.
+    assert excinfo.traceback
+    assert len(h5py.h5f.get_obj_ids(types=h5py.h5f.OBJ_FILE)) == 0
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_resume(catsim_catalog, tmp_path, sparse):
+    """Check that an interrupted run can be resumed with the same output."""
+    kwargs = {"noise_engine": "poisson", "sparse_isolated_images": sparse}
+    fpath = tmp_path / "dataset.hdf5"
+    with btk.dataset.DatasetWriter(tmp_path / "expected.hdf5") as writer:
+        writer.write_batches(_get_generator(catsim_catalog, **kwargs), n_batches=4)
+    with btk.dataset.DatasetWriter(fpath) as writer:
+        writer.write_batches(_get_generator(catsim_catalog, **kwargs), n_batches=2)
+
+    # simulate a batch which was only partially written.
+    with h5py.File(fpath, "a") as f:
+        append_to_dataset(f["LSST/blend_images"], f["LSST/blend_images"][:3])
+        append_to_dataset(f["LSST/psf"], f["LSST/psf"][:1])
+
+    with btk.dataset.DatasetWriter(fpath, mode="a") as writer:
+        assert writer.n_batches == 2
+        draw_generator = _get_generator(catsim_catalog, **kwargs)
+        draw_generator.load_state_dict(writer.generator_state)
+        writer.write_batches(draw_generator, n_batches=4 - writer.n_batches)
+
+    with h5py.File(tmp_path / "expected.hdf5") as f1, h5py.File(fpath) as f2:
+        assert f1.attrs["n_batches"] == f2.attrs["n_batches"] == 4
+        for name in ("blend_images", "psf", "batch_offsets", "catalog/ra", "catalog/offsets"):
+            np.testing.assert_array_equal(f1["LSST"][name][:], f2["LSST"][name][:])
+        if sparse:
+            np.testing.assert_array_equal(
+                f1["LSST/isolated_images/data"][:], f2["LSST/isolated_images/data"][:]
+            )
+        else:
+            np.testing.assert_array_equal(
+                f1["LSST/isolated_images"][:], f2["LSST/isolated_images"][:]
+            )
+
+    # simulate a first batch which was only partially written.
+    fpath = tmp_path / "partial.hdf5"
+    draw_generator = _get_generator(catsim_catalog, **kwargs)
+    with btk.dataset.DatasetWriter(fpath) as writer:
+        blend_batch = next(draw_generator)
+        writer._create_survey_group(blend_batch)
+        append_to_dataset(writer._file["LSST/blend_images"], blend_batch.blend_images[:3])
+        append_to_dataset(writer._file["LSST/psf"], blend_batch.get_numpy_psf()[None])
+
+    with btk.dataset.DatasetWriter(fpath, mode="a") as writer:
+        assert writer.n_batches == 0
+        writer.write_batches(_get_generator(catsim_catalog, **kwargs), n_batches=4)
+
+    with h5py.File(tmp_path / "expected.hdf5") as f1, h5py.File(fpath) as f2:
+        for name in ("blend_images", "psf", "batch_offsets", "catalog/ra", "catalog/offsets"):
+            np.testing.assert_array_equal(f1["LSST"][name][:], f2["LSST"][name][:])
+
+
+def test_psf_library(catsim_catalog, tmp_path):
+    """Check that the PSF of each blend is saved and read when drawing with PSF libraries."""
+    survey = btk.survey.get_surveys("LSST")
+    for band in survey.available_filters:
+        images = [galsim.Gaussian(fwhm=fwhm).drawImage(nx=21, ny=21).array for fwhm in (0.6, 1.0)]
+        survey.get_filter(band).psf = btk.survey.PSFLibrary(images, pixel_scale=0.2)
+    sampling_function = btk.sampling_functions.DefaultSampling(max_number=3, max_mag=24)
+    draw_generator = btk.draw_blends.CatsimGenerator(
+        catsim_catalog, sampling_function, survey, batch_size=4, add_noise="none"
+    )
+    fpath = tmp_path / "dataset.hdf5"
+    with btk.dataset.DatasetWriter(fpath) as writer:
+        batches = [next(draw_generator) for _ in range(2)]
+        for blend_batch in batches:
+            writer.write(blend_batch)
+    writer = btk.dataset.DatasetWriter(fpath, mode="a")
+    writer.write(next(_get_generator(catsim_catalog)))
+    with pytest.raises(RuntimeError, match="Writing to"):
+        writer.close()
+
+    with btk.dataset.BlendDataset(fpath) as blend_dataset:
+        np.testing.assert_array_equal(blend_dataset[5]["psf"], batches[1].get_numpy_psf(1))
+        blend_batch = blend_dataset[2:6]
+        np.testing.assert_array_equal(
+            blend_batch.psf_index, np.concatenate([b.psf_index for b in batches])[2:6]
+        )
+        np.testing.assert_array_equal(blend_batch.get_numpy_psf(3), batches[1].get_numpy_psf(1))
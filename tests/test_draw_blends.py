@@ -0,0 +1,514 @@
+"""Tests for the rendering options of `DrawBlendsGenerator`."""
+
+import gc
+import json
+import pickle
+from multiprocessing.shared_memory import SharedMemory
+
+import galsim
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.table import Table
+from surveycodex.utilities import mean_sky_level
+
+import btk
+
+SEED = 0
+
+
+def _get_generator(catalog, **kwargs):
+    sampling_function = btk.sampling_functions.DefaultSampling(
+        max_number=3, min_number=1, stamp_size=24.0, max_shift=5.0, max_mag=24, seed=SEED
+    )
+    survey = btk.survey.get_surveys("LSST")
+    kwargs = {"batch_size": 4, "add_noise": "none", "seed": SEED, **kwargs}
+    return btk.draw_blends.CatsimGenerator(catalog, sampling_function, survey, **kwargs)
+
+
+def test_substamps(catsim_catalog):
+    """Check that drawing in sub-stamps agrees with drawing on the full stamp."""
+    batch1 = next(_get_generator(catsim_catalog))
+    batch2 = next(_get_generator(catsim_catalog, use_substamps=True))
+
+    # only flux falling outside each sub-stamp (< 0.5% of the total flux) is missing.
+    flux1 = batch1.isolated_images.sum(axis=(-1, -2))
+    flux2 = batch2.isolated_images.sum(axis=(-1, -2))
+    np.testing.assert_allclose(flux2, flux1, rtol=5e-3)
+    diff = np.abs(batch1.isolated_images - batch2.isolated_images)
+    assert np.all(diff.max(axis=(-1, -2)) <= 5e-3 * flux1 + 1e-8)
+    np.testing.assert_allclose(batch2.blend_images, batch2.isolated_images.sum(axis=1))
+
+
+def test_worker_pool(catsim_catalog):
+    """Check that a persistent pool can be shared by generators and deblenders."""
+    serial_batch = next(_get_generator(catsim_catalog))
+    deblender = btk.deblend.PeakLocalMax(max_n_sources=3, sky_level=1.0, use_band=2)
+
+    with btk.multiprocess.WorkerPool(njobs=2) as pool:
+        draw_generator = _get_generator(catsim_catalog, njobs=2, pool=pool)
+        blend_batch = next(draw_generator)
+        np.testing.assert_allclose(blend_batch.blend_images, serial_batch.blend_images)
+        for _ in range(2):
+            deblend_batch = deblender(blend_batch, pool=pool)
+            assert len(deblend_batch.catalog_list) == blend_batch.batch_size
+            blend_batch = next(draw_generator)
+        assert pool.is_running
+        draw_generator.close()  # generator does not own the pool.
+        assert pool.is_running
+    assert not pool.is_running
+
+    with _get_generator(catsim_catalog, njobs=2) as draw_generator:
+        blend_batch = next(draw_generator)
+        assert draw_generator.pool.is_running
+    assert not draw_generator.pool.is_running
+    np.testing.assert_allclose(blend_batch.blend_images, serial_batch.blend_images)
+
+    # processes of generators that are never closed are terminated when garbage collected.
+    draw_generator = _get_generator(catsim_catalog, njobs=2)
+    next(draw_generator)
+    processes = list(draw_generator.pool._pool._pool)
+    assert all(process.is_alive() for process in processes)
+    del draw_generator
+    gc.collect()
+    assert not any(process.is_alive() for process in processes)
+
+
+def test_shared_memory(catsim_catalog):
+    """Check that writing images to shared memory gives the same results."""
+    kwargs = {"add_noise": "all", "augment_data": True}
+    for njobs in (1, 2):
+        with _get_generator(catsim_catalog, njobs=njobs, **kwargs) as draw_generator:
+            blend_batch1 = next(draw_generator)
+        generator = _get_generator(catsim_catalog, njobs=njobs, use_shared_memory=True, **kwargs)
+        with generator as draw_generator:
+            blend_batch2 = next(draw_generator)
+        np.testing.assert_array_equal(blend_batch1.blend_images, blend_batch2.blend_images)
+        np.testing.assert_array_equal(blend_batch1.isolated_images, blend_batch2.isolated_images)
+        for cat1, cat2 in zip(blend_batch1.catalog_list, blend_batch2.catalog_list):
+            assert cat1.colnames == cat2.colnames
+            np.testing.assert_array_equal(cat1["x_peak"], cat2["x_peak"])
+
+
+def test_shared_memory_freed_on_error(catsim_catalog, data_dir, monkeypatch):
+    """Check that the shared memory of a batch is freed when rendering fails."""
+    names = []
+
+    class _SharedArray(btk.multiprocess.SharedArray):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            names.append(self.name)
+
+    def _raise_error(*args):
+        raise RuntimeError("Rendering failed")
+
+    monkeypatch.setattr(btk.draw_blends, "SharedArray", _SharedArray)
+    draw_generator = _get_generator(catsim_catalog, use_shared_memory=True)
+    monkeypatch.setattr(draw_generator, "render_blend", _raise_error)
+    with pytest.raises(RuntimeError, match="Rendering failed"):
+        next(draw_generator)
+    assert len(names) == 2
+
+    # the catalog lacks the fluxes used to prepare the render specs.
+    catalog = btk.catalog.CatsimCatalog.from_file(data_dir / "input_catalog.fits")
+    with pytest.raises(KeyError):
+        next(_get_generator(catalog, use_shared_memory=True))
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
+
+
+def test_render_specs(catsim_catalog):
+    """Check that the data sent to workers does not scale with the size of the catalog."""
+    draw_generator = _get_generator(catsim_catalog)
+    assert len(pickle.dumps(draw_generator)) < 100_000
+    assert len(pickle.dumps(catsim_catalog)) > 10_000_000
+
+    survey = draw_generator.surveys["LSST"]
+    blend_tables = next(draw_generator.blend_generator)
+    specs = btk.draw_blends._get_render_specs(
+        blend_tables, draw_generator._get_render_columns(survey)
+    )
+    for spec, blend in zip(specs, blend_tables):
+        assert len(spec) == len(blend)
+        assert "redshift" not in spec.dtype.names
+        np.testing.assert_array_equal(spec["ra"], blend["ra"])
+
+    # all columns of the catalog are still in the output catalogs.
+    blend_batch = next(draw_generator)
+    for catalog in blend_batch.catalog_list:
+        assert "redshift" in catalog.colnames
+        assert "x_peak" in catalog.colnames
+        assert "not_drawn_r" in catalog.colnames
+
+
+def test_catsim_params(catsim_catalog):
+    """Check that precomputed CATSIM parameters give the same profiles as per-row computations."""
+    survey = btk.survey.get_surveys("LSST")
+    table = catsim_catalog.table[:50]
+    params = Table(btk.draw_blends.get_catsim_params(table, survey))
+    for entry, entry_params in zip(table, params):
+        for band in survey.available_filters:
+            filt = survey.get_filter(band)
+            try:
+                gal1 = btk.draw_blends.get_catsim_galaxy(entry, filt, survey)
+            except btk.draw_blends.SourceNotVisible:
+                with pytest.raises(btk.draw_blends.SourceNotVisible):
+                    btk.draw_blends.get_catsim_galaxy_from_params(entry_params, band)
+                continue
+            gal2 = btk.draw_blends.get_catsim_galaxy_from_params(entry_params, band)
+            assert gal1 == gal2
+
+
+@pytest.mark.parametrize("augment_data", [False, True])
+def test_profile_cache(catsim_catalog, augment_data):
+    """Check that cached profiles give the same images and are reused across batches."""
+    table = catsim_catalog.table
+    catalog = btk.catalog.CatsimCatalog(table[table["r_ab"] < 24][:10])
+    batches = []
+    for profile_cache_size in (0, 10):
+        draw_generator = _get_generator(
+            catalog, augment_data=augment_data, profile_cache_size=profile_cache_size
+        )
+        batches.append([next(draw_generator) for _ in range(3)])
+    for batch1, batch2 in zip(*batches):
+        np.testing.assert_allclose(batch2.isolated_images, batch1.isolated_images, atol=1e-8)
+
+    stats = draw_generator.profile_cache.stats
+    assert stats["hits"] > 0 and stats["misses"] > 0
+    assert stats["n_items"] == stats["misses"] and stats["evictions"] == 0
+    assert 0 < stats["size"] <= 10e6
+
+    draw_generator = _get_generator(catalog, augment_data=augment_data, profile_cache_size=1e-3)
+    next(draw_generator)
+    assert draw_generator.profile_cache.stats["size"] <= 1e3
+
+    # caches are released when the generator is closed or garbage collected.
+    name = draw_generator._profile_cache_name
+    assert name in btk.cache._PROCESS_CACHES
+    draw_generator.close()
+    assert name not in btk.cache._PROCESS_CACHES
+    draw_generator = _get_generator(catalog, profile_cache_size=10)
+    next(draw_generator)
+    name = draw_generator._profile_cache_name
+    del draw_generator
+    gc.collect()
+    assert name not in btk.cache._PROCESS_CACHES
+
+
+def test_noise_realizations(catsim_catalog):
+    """Check that noise realizations are reproducible and have the expected statistics."""
+    noiseless_batch = next(_get_generator(catsim_catalog))
+    draw_generator = _get_generator(catsim_catalog, add_noise="all")
+    blend_batch = next(draw_generator)
+    np.testing.assert_allclose(blend_batch.isolated_images, noiseless_batch.isolated_images)
+
+    realizations = list(draw_generator.noise_realizations(blend_batch, 3, seed=1))
+    assert len(realizations) == 3
+    again = list(draw_generator.noise_realizations(blend_batch, 3, seed=1))
+    other = next(draw_generator.noise_realizations(blend_batch, 1, seed=2))
+    for batch1, batch2 in zip(realizations, again):
+        np.testing.assert_array_equal(batch1.blend_images, batch2.blend_images)
+        assert batch1.isolated_images is blend_batch.isolated_images
+    assert not np.array_equal(realizations[0].blend_images, realizations[1].blend_images)
+    assert not np.array_equal(realizations[0].blend_images, other.blend_images)
+
+    # noise is added on top of the same noiseless images, with the same variance.
+    survey = blend_batch.survey
+    sky_level = mean_sky_level(survey, survey.get_filter("r")).to_value("electron")
+    noise = realizations[0].blend_images[:, 2] - noiseless_batch.blend_images[:, 2]
+    expected_var = noiseless_batch.blend_images[:, 2] + sky_level
+    assert np.abs(np.mean(noise**2 / expected_var) - 1) < 0.05
+
+    # the random state of the generator is not affected.
+    batch = next(draw_generator)
+    draw_generator = _get_generator(catsim_catalog, add_noise="all")
+    next(draw_generator)
+    np.testing.assert_array_equal(next(draw_generator).blend_images, batch.blend_images)
+
+
+@pytest.mark.parametrize("noise_engine", ["poisson", "gaussian"])
+def test_numpy_noise(catsim_catalog, noise_engine):
+    """Check the statistics and reproducibility of the vectorized noise engines."""
+    noiseless_batch = next(_get_generator(catsim_catalog, batch_size=8))
+    blend_batch = next(
+        _get_generator(catsim_catalog, batch_size=8, add_noise="all", noise_engine=noise_engine)
+    )
+    survey = blend_batch.survey
+    sky_levels = np.array(
+        [mean_sky_level(survey, survey.get_filter(b)).to_value("electron") for b in "ugrizy"]
+    )
+    noise = blend_batch.blend_images - noiseless_batch.blend_images
+    expected_var = noiseless_batch.blend_images + sky_levels[None, :, None, None]
+    assert np.abs(np.mean(noise / np.sqrt(expected_var))) < 0.01
+    assert np.abs(np.mean(noise**2 / expected_var) - 1) < 0.01
+
+    # images do not depend on the number of processes.
+    draw_generator = _get_generator(
+        catsim_catalog, batch_size=8, add_noise="all", noise_engine=noise_engine, njobs=2
+    )
+    with draw_generator:
+        np.testing.assert_array_equal(next(draw_generator).blend_images, blend_batch.blend_images)
+        realizations = list(draw_generator.noise_realizations(blend_batch, 2, seed=1))
+    assert not np.array_equal(realizations[0].blend_images, realizations[1].blend_images)
+    again = next(draw_generator.noise_realizations(blend_batch, 1, seed=1))
+    np.testing.assert_array_equal(again.blend_images, realizations[0].blend_images)
+
+
+def test_float32(catsim_catalog, tmp_path):
+    """Check that images stay in single precision through generation, deblending and saving."""
+    draw_generator = _get_generator(
+        catsim_catalog, add_noise="all", noise_engine="poisson", dtype=np.float32
+    )
+    blend_batch = next(draw_generator)
+    assert blend_batch.dtype == np.float32
+    assert blend_batch.isolated_images.dtype == np.float32
+    assert blend_batch.get_numpy_psf().dtype == np.float32
+    batch64 = next(_get_generator(catsim_catalog, add_noise="none"))
+    batch32 = next(_get_generator(catsim_catalog, add_noise="none", dtype="float32"))
+    np.testing.assert_allclose(batch32.isolated_images, batch64.isolated_images, rtol=1e-5)
+
+    realization = next(draw_generator.noise_realizations(blend_batch, 1))
+    assert realization.blend_images.dtype == np.float32
+
+    blend_batch.save(tmp_path, 0)
+    loaded = btk.blend_batch.BlendBatch.load(tmp_path, 0)
+    assert loaded.blend_images.dtype == loaded.isolated_images.dtype == np.float32
+
+    deblender = btk.deblend.SepSingleBand(max_n_sources=10, use_band=2)
+    deblend_batch = deblender(blend_batch)
+    assert deblend_batch.deblended_images.dtype == np.float32
+    deblend_batch.save(tmp_path, 0)
+    loaded = btk.blend_batch.DeblendBatch.load(tmp_path, 0)
+    assert loaded.deblended_images.dtype == np.float32
+
+    seg = btk.metrics.utils.get_segmentation(blend_batch.isolated_images[:, :, 2], 1.0)
+    assert seg.dtype == np.float32
+
+
+def test_sparse_isolated_images(catsim_catalog, tmp_path):
+    """Check that generating sparse isolated images gives the same images with less memory."""
+    kwargs = {"use_substamps": True, "add_noise": "all"}
+    dense_batch = next(_get_generator(catsim_catalog, **kwargs))
+    blend_batch = next(_get_generator(catsim_catalog, sparse_isolated_images=True, **kwargs))
+    isolated_images = blend_batch.isolated_images
+    assert isinstance(isolated_images, btk.blend_batch.SparseIsolatedImages)
+    assert isolated_images.nbytes < dense_batch.isolated_images.nbytes / 2
+    np.testing.assert_array_equal(np.asarray(isolated_images), dense_batch.isolated_images)
+    np.testing.assert_array_equal(blend_batch.blend_images, dense_batch.blend_images)
+
+    blend_batch.save(tmp_path, 0)
+    loaded = btk.blend_batch.BlendBatch.load(tmp_path, 0)
+    assert isinstance(loaded.isolated_images, btk.blend_batch.SparseIsolatedImages)
+    np.testing.assert_array_equal(loaded.isolated_images[1], dense_batch.isolated_images[1])
+
+
+def test_prefetch(catsim_catalog):
+    """Check that prefetching returns the same batches and propagates errors."""
+    draw_generator = _get_generator(catsim_catalog, add_noise="all")
+    expected = [next(draw_generator) for _ in range(3)]
+    with _get_generator(catsim_catalog, add_noise="all").prefetch(n_prefetch=2) as prefetcher:
+        for blend_batch in expected:
+            np.testing.assert_array_equal(next(prefetcher).blend_images, blend_batch.blend_images)
+    assert not prefetcher._thread.is_alive()
+
+    def failing_iterator():
+        yield 1
+        raise ValueError("Rendering failed.")
+
+    prefetcher = btk.multiprocess.Prefetcher(failing_iterator())
+    assert next(prefetcher) == 1
+    with pytest.raises(ValueError, match="Rendering failed"):
+        next(prefetcher)
+    with pytest.raises(StopIteration):
+        next(prefetcher)
+    assert list(btk.multiprocess.Prefetcher(iter(range(5)), n_prefetch=1)) == list(range(5))
+
+
+@pytest.mark.parametrize("noise_engine", ["galsim", "gaussian"])
+def test_state_dict(catsim_catalog, noise_engine):
+    """Check that loading the state of a generator resumes it at the next batch."""
+    draw_generator = _get_generator(catsim_catalog, noise_engine=noise_engine, add_noise="all")
+    next(draw_generator)
+    state = json.loads(json.dumps(draw_generator.state_dict()))
+    expected = [next(draw_generator) for _ in range(2)]
+
+    draw_generator = _get_generator(catsim_catalog, noise_engine=noise_engine, add_noise="all")
+    draw_generator.load_state_dict(state)
+    for blend_batch in expected:
+        resumed_batch = next(draw_generator)
+        np.testing.assert_array_equal(resumed_batch.blend_images, blend_batch.blend_images)
+        np.testing.assert_array_equal(
+            resumed_batch.catalog_list[0]["ra"], blend_batch.catalog_list[0]["ra"]
+        )
+
+
+@pytest.mark.parametrize("use_shared_memory", [False, True])
+def test_seeding_per_blend(catsim_catalog, use_shared_memory):
+    """Check that seeding each blend gives the same images for any number of jobs."""
+    kwargs = {
+        "add_noise": "all",
+        "augment_data": True,
+        "seeding": "blend",
+        "use_shared_memory": use_shared_memory,
+    }
+    batches = {}
+    for njobs in (1, 2, 4):
+        with _get_generator(catsim_catalog, njobs=njobs, **kwargs) as draw_generator:
+            batches[njobs] = [next(draw_generator) for _ in range(2)]
+    for njobs in (2, 4):
+        for blend_batch, expected in zip(batches[njobs], batches[1]):
+            np.testing.assert_array_equal(blend_batch.blend_images, expected.blend_images)
+            np.testing.assert_array_equal(blend_batch.isolated_images, expected.isolated_images)
+            for catalog, expected_catalog in zip(blend_batch.catalog_list, expected.catalog_list):
+                np.testing.assert_array_equal(
+                    catalog["btk_rotation"], expected_catalog["btk_rotation"]
+                )
+    # blends of a mini-batch have different rotations.
+    catalog_list = batches[1][0].catalog_list
+    assert catalog_list[0]["btk_rotation"][0] != catalog_list[1]["btk_rotation"][0]
+
+
+@pytest.mark.parametrize("use_shared_memory", [False, True])
+def test_dynamic_scheduling(catsim_catalog, use_shared_memory):
+    """Check that dynamic scheduling of the mini-batches gives the same images."""
+    kwargs = {"add_noise": "all", "seeding": "blend", "use_shared_memory": use_shared_memory}
+    expected = next(_get_generator(catsim_catalog, **kwargs))
+    with _get_generator(catsim_catalog, njobs=2, scheduling="dynamic", **kwargs) as draw_generator:
+        blend_batch = next(draw_generator)
+    np.testing.assert_array_equal(blend_batch.blend_images, expected.blend_images)
+    np.testing.assert_array_equal(blend_batch.isolated_images, expected.isolated_images)
+    for catalog, expected_catalog in zip(blend_batch.catalog_list, expected.catalog_list):
+        np.testing.assert_array_equal(catalog["ra"], expected_catalog["ra"])
+
+    with pytest.raises(ValueError, match="requires `seeding='blend'`"):
+        _get_generator(catsim_catalog, scheduling="dynamic")
+
+
+@pytest.mark.parametrize("use_shared_memory", [False, True])
+def test_thread_backend(catsim_catalog, use_shared_memory):
+    """Check that rendering in threads gives the same images as in processes."""
+    kwargs = {"add_noise": "all", "augment_data": True, "use_shared_memory": use_shared_memory}
+    batches = {}
+    for backend in ("processes", "threads"):
+        with _get_generator(
+            catsim_catalog, njobs=2, backend=backend, profile_cache_size=10, **kwargs
+        ) as draw_generator:
+            batches[backend] = [next(draw_generator) for _ in range(2)]
+            stats = draw_generator.profile_cache.stats
+    for blend_batch, expected in zip(batches["threads"], batches["processes"]):
+        np.testing.assert_array_equal(blend_batch.blend_images, expected.blend_images)
+        np.testing.assert_array_equal(blend_batch.isolated_images, expected.isolated_images)
+        for catalog, expected_catalog in zip(blend_batch.catalog_list, expected.catalog_list):
+            # the WCS sent to worker processes is rounded when pickled.
+            np.testing.assert_allclose(catalog["x_peak"], expected_catalog["x_peak"], atol=1e-10)
+
+    # worker threads share the cache of the main process.
+    assert draw_generator.pool.backend == "threads"
+    assert stats["misses"] > 0
+
+    with pytest.raises(ValueError, match="backend"):
+        _get_generator(catsim_catalog, backend="fork")
+
+
+def test_psf_cache(catsim_catalog):
+    """Check that PSFs are reused across batches and only drawn once, unless they vary."""
+    draw_generator = _get_generator(catsim_catalog)
+    batch1, batch2 = next(draw_generator), next(draw_generator)
+    assert all(psf1 is psf2 for psf1, psf2 in zip(batch1.psf, batch2.psf))
+    psf_image = batch1.get_numpy_psf()
+    image_size = batch1.image_size
+    expected = batch1.psf[0].drawImage(nx=image_size, ny=image_size, dtype=np.float64).array
+    np.testing.assert_array_equal(psf_image[0], expected)
+
+    cache = btk.cache.get_process_cache("psf-images", btk.blend_batch.PSF_CACHE_SIZE)
+    hits = cache.hits
+    np.testing.assert_array_equal(batch2.get_numpy_psf(), psf_image)
+    assert cache.hits == hits + len(batch2.psf)
+
+    # PSFs generated by a function are generated again for each batch.
+    rng = np.random.default_rng(SEED)
+    survey = btk.survey.get_surveys("LSST", lambda *_: galsim.Gaussian(fwhm=rng.uniform(0.5, 1)))
+    sampling_function = btk.sampling_functions.DefaultSampling(max_number=3, max_mag=24)
+    draw_generator = btk.draw_blends.CatsimGenerator(
+        catsim_catalog, sampling_function, survey, batch_size=2, add_noise="none"
+    )
+    batch1, batch2 = next(draw_generator), next(draw_generator)
+    assert batch1.psf[0] != batch2.psf[0]
+    assert not np.array_equal(batch1.get_numpy_psf(), batch2.get_numpy_psf())
+
+    # assigning a new PSF to a filter invalidates the PSFs of the generator.
+    survey.get_filter("r").psf = galsim.Gaussian(fwhm=0.7)
+    assert next(draw_generator).psf[2] == galsim.Gaussian(fwhm=0.7)
+
+
+def _get_psf_library(fwhms, pixel_scale=0.2):
+    images = [galsim.Gaussian(fwhm=fwhm).drawImage(nx=21, ny=21).array for fwhm in fwhms]
+    return btk.survey.PSFLibrary(images, pixel_scale)
+
+
+def test_psf_library(catsim_catalog, tmp_path):
+    """Check that each blend is drawn with the PSF of a library assigned to it."""
+    survey = btk.survey.get_surveys("LSST")
+    for band in survey.available_filters:
+        survey.get_filter(band).psf = _get_psf_library([0.6, 0.8, 1.0, 1.2])
+
+    def _get_library_generator(survey, **kwargs):
+        sampling_function = btk.sampling_functions.DefaultSampling(max_number=3, max_mag=24)
+        kwargs = {"batch_size": 8, "add_noise": "none", **kwargs}
+        return btk.draw_blends.CatsimGenerator(catsim_catalog, sampling_function, survey, **kwargs)
+
+    batches = []
+    for njobs in (1, 2):
+        with _get_library_generator(survey, njobs=njobs) as draw_generator:
+            batches.append(next(draw_generator))
+    blend_batch = batches[0]
+    np.testing.assert_array_equal(batches[1].psf_index, blend_batch.psf_index)
+    np.testing.assert_array_equal(batches[1].isolated_images, blend_batch.isolated_images)
+    assert len(set(blend_batch.psf_index)) > 1
+
+    # libraries are not sent to the workers, only the PSF of each blend.
+    unpickled = pickle.loads(pickle.dumps(_get_library_generator(survey))).surveys["LSST"]
+    assert unpickled.get_filter("r").psf is None
+    assert isinstance(survey.get_filter("r").psf, btk.survey.PSFLibrary)
+
+    # each blend is drawn with its own PSF, the same in every band.
+    psf_array = blend_batch.get_numpy_psf()
+    assert psf_array.shape == (8, 6, *blend_batch.blend_images.shape[-2:])
+    for ii, index in enumerate(blend_batch.psf_index):
+        assert blend_batch.get_blend_psf(ii)[2] is survey.get_filter("r").psf[index]
+        np.testing.assert_array_equal(blend_batch.get_numpy_psf(ii), psf_array[ii])
+    single_psf = btk.survey.get_surveys("LSST", lambda *_: blend_batch.get_blend_psf(0)[0])
+    expected = next(_get_library_generator(single_psf))
+    assert expected.psf_index is None
+    np.testing.assert_array_equal(expected.isolated_images[0], blend_batch.isolated_images[0])
+
+    blend_batch.save(tmp_path, 0)
+    loaded = btk.blend_batch.BlendBatch.load(tmp_path, 0)
+    np.testing.assert_array_equal(loaded.psf_index, blend_batch.psf_index)
+    np.testing.assert_array_equal(loaded.get_numpy_psf(), psf_array)
+
+    survey.get_filter("u").psf = _get_psf_library([0.6, 0.8])
+    with pytest.raises(ValueError, match="same size"):
+        next(_get_library_generator(survey))
+
+
+def test_psf_from_file(tmp_path):
+    """Check that PSF files are read once and randomly chosen from."""
+    library = _get_psf_library([0.6, 0.8, 1.0])
+    for ii, image in enumerate(library.images):
+        fits.writeto(tmp_path / f"psf_{ii}.fits", image)
+    survey = btk.survey.get_surveys("LSST")
+    psfs = [btk.survey.get_psf_from_file(tmp_path.as_posix(), survey) for _ in range(50)]
+    (tmp_path / "psf_0.fits").unlink()
+    psfs.append(btk.survey.get_psf_from_file(tmp_path.as_posix(), survey))
+    assert len({id(psf) for psf in psfs}) == 3
+    np.testing.assert_allclose(psfs[0].drawImage(nx=21, ny=21).array.sum(), 1.0, rtol=1e-3)
+
+    # only the most recently used libraries are kept in memory.
+    for ii in range(10):
+        psf_dir = tmp_path / f"dir_{ii}"
+        psf_dir.mkdir()
+        fits.writeto(psf_dir / "psf.fits", library.images[0])
+        btk.survey.get_psf_from_file(psf_dir.as_posix(), survey)
+    assert btk.survey._load_psf_library.cache_info().currsize == 8
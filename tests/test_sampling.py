@@ -2,6 +2,7 @@ import btk
 
 SEED = 0
 import numpy as np
+import pytest
 
 
 def test_density_sampling(data_dir):
@@ -24,3 +25,110 @@ def test_density_sampling(data_dir):
         assert 1 <= len(blends) <= 50
         assert np.all(blends["ra"] >= -10) & np.all(blends["ra"] <= 10)
         assert np.all(blends["dec"] >= -10) & np.all(blends["dec"] <= 10)
+
+
+def test_candidates_cache(data_dir):
+    """Check that indices passing magnitude cuts are cached and recomputed when needed."""
+    table = btk.catalog.CatsimCatalog.from_file(data_dir / "input_catalog.fits").table
+    sampling_function = btk.sampling_functions.DefaultSampling(max_mag=24, seed=SEED)
+    expected = np.flatnonzero(table["i_ab"] <= 24)
+    candidates = sampling_function._get_mag_candidates(table)
+    np.testing.assert_array_equal(candidates, expected)
+    assert sampling_function._get_mag_candidates(table) is candidates
+
+    # the cache is invalidated when the cut, the columns or the rows of the table change.
+    sampling_function.max_mag = 23
+    np.testing.assert_array_equal(
+        sampling_function._get_mag_candidates(table), np.flatnonzero(table["i_ab"] <= 23)
+    )
+    table["i_ab"] = table["i_ab"] - 1
+    np.testing.assert_array_equal(
+        sampling_function._get_mag_candidates(table), np.flatnonzero(table["i_ab"] <= 23)
+    )
+    table.remove_rows(expected[:10])
+    np.testing.assert_array_equal(
+        sampling_function._get_mag_candidates(table), np.flatnonzero(table["i_ab"] <= 23)
+    )
+    table["i_ab"][:] = 30
+    assert len(sampling_function._get_mag_candidates(table)) > 0
+    sampling_function.clear_candidates()
+    assert len(sampling_function._get_mag_candidates(table)) == 0
+
+
+def test_sample_batch(data_dir):
+    """Check that batches of blends are sampled at once, or with one call per blend."""
+    catalog = btk.catalog.CatsimCatalog.from_file(data_dir / "input_catalog.fits")
+    table = catalog.table
+    sampling_function = btk.sampling_functions.DefaultSamplingShear(
+        max_number=3, max_mag=24, seed=SEED, shear=(0.01, 0.02)
+    )
+    blend_tables = sampling_function.sample_batch(table, 5)
+
+    rng = np.random.default_rng(SEED)
+    sizes = rng.integers(1, 4, size=5)
+    indices = rng.choice(np.flatnonzero(table["i_ab"] <= 24), size=np.sum(sizes))
+    dx = rng.uniform(-2.4, 2.4, size=len(indices))
+    dy = rng.uniform(-2.4, 2.4, size=len(indices))
+    assert [len(blend_table) for blend_table in blend_tables] == list(sizes)
+    offset = 0
+    for blend_table in blend_tables:
+        rows = slice(offset, offset + len(blend_table))
+        np.testing.assert_array_equal(blend_table["galtileid"], table["galtileid"][indices[rows]])
+        np.testing.assert_array_equal(blend_table["ra"], dx[rows])
+        np.testing.assert_array_equal(blend_table["dec"], dy[rows])
+        np.testing.assert_array_equal(blend_table["g2"], 0.02)
+        offset += len(blend_table)
+
+    # sampling functions without a batched implementation are called once per blend.
+    sampling_function = btk.sampling_functions.BasicSampling(seed=SEED)
+    blend_tables = sampling_function.sample_batch(table, 3)
+    sampling_function = btk.sampling_functions.BasicSampling(seed=SEED)
+    for blend_table in blend_tables:
+        np.testing.assert_array_equal(
+            blend_table["galtileid"], sampling_function(table)["galtileid"]
+        )
+
+    # blend generators only sample batches at once if requested, to keep blends of a seed.
+    for batch_sampling in (False, True):
+        blend_generator = btk.blend_generator.BlendGenerator(
+            catalog,
+            btk.sampling_functions.DensitySampling(seed=SEED),
+            batch_size=4,
+            batch_sampling=batch_sampling,
+        )
+        sampling_function = btk.sampling_functions.DensitySampling(seed=SEED)
+        if batch_sampling:
+            expected = sampling_function.sample_batch(table, 4)
+        else:
+            expected = [sampling_function(table) for _ in range(4)]
+        for blend_table, expected_table in zip(next(blend_generator), expected):
+            np.testing.assert_array_equal(blend_table["galtileid"], expected_table["galtileid"])
+
+
+def test_random_square_sampling(data_dir):
+    """Check that the spatial index returns the galaxies in the sampled square region."""
+    table = btk.catalog.CatsimCatalog.from_file(data_dir / "input_catalog.fits").table
+    sampling_function = btk.sampling_functions.RandomSquareSampling(
+        stamp_size=36.0, max_number=100, max_mag=27
+    )
+    candidates, coords, tree = sampling_function._get_square_index(table)
+    assert sampling_function._get_square_index(table)[2] is tree
+
+    np.random.seed(SEED)
+    blend_tables = [sampling_function(table) for _ in range(5)]
+    np.random.seed(SEED)
+    half_size = 36.0 / 3600 / 2
+    for blend_table in blend_tables:
+        center = np.random.uniform(coords.min(0) + half_size, coords.max(0) - half_size)
+        in_square = np.all(np.abs(coords - center) < half_size, axis=1)
+        assert 0 < len(blend_table) == np.sum(in_square)
+        np.testing.assert_array_equal(
+            blend_table["galtileid"], table["galtileid"][candidates[in_square]]
+        )
+        np.testing.assert_allclose(
+            blend_table["ra"], (coords[in_square, 0] - center[0]) * 3600, atol=1e-9
+        )
+
+    sampling_function.max_number = 0
+    with pytest.raises(ValueError, match="max_number"):
+        sampling_function(table)